@@ -1,14 +1,25 @@
 # %%
 import pandas as pd
 import numpy as np
-import json
-import subprocess
 import pandas as pd
 from datetime import datetime
 import os
 import argparse
 import time
 import tempfile
+import sys
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rigtools.transfer_profiles import rsync_options
+from rigtools.unwrap import extract_frames, iter_strips, stitch_strips, read_tile_configuration, panorama_width
+from rigtools.tile_layout import layout_key, layout_for
+from rigtools.pupae_counts import count_folder
+from rigtools.slurm import run_job, failed_tasks
+from rigtools.stage_state import StageState
 
 ################
 # functions for pipeline
@@ -26,184 +37,150 @@ def list_directory_contents(folder_path):
     return contents
 
 # shell script content
-def sbatch_rsync(remove_files, username, ip_address, save_path):
-    shell_script_content = f"""#!/bin/bash
-    #SBATCH --job-name=rsync_pi
-    #SBATCH --ntasks=1
-    #SBATCH --time=08:00:00
-    #SBATCH --mem=64G
-    #SBATCH --partition=cpu
-    #SBATCH --cpus-per-task=8
-    #SBATCH --output=slurm-%j.out
-    #SBATCH --mail-user=$(whoami)@crick.ac.uk
-    #SBATCH --mail-type=FAIL
-
-    rsync -avzh --progress {remove_files}{username}@${ip_address}:/home/{username}/data/ {save_path}/raw_data
-    rsync_status=$?
-
-    # check rsync status and output file if it fails to allow user to easily notice
-    if [ $rsync_status -ne 0 ]; then
-        # If rsync fails, create a file indicating failure
-        echo "Rsync failed for IP: $ip_var" > "FAILED-rsync_IP-{ip_address}.out"
-    fi
-
-    ssh {username}@{ip_address} "find data/ -mindepth 1 -type d -empty -delete"
+def sbatch_rsync(remove_files, username, ip_address, save_path, transfer_profile='media'):
     """
+    Submit the rsync job and block until it has finished (sbatch --wait, no polling).
 
-    # Create a temporary file to hold the SBATCH script
-    with tempfile.NamedTemporaryFile(mode="w", delete=False) as tmp_script:
-        tmp_script.write(shell_script_content)
-        tmp_script_path = tmp_script.name
+    :return: (job id, dict of job id -> final state)
+    """
+    # pupae videos are already compressed, so by default they are not compressed again on the wire
+    rsync_opts = ' '.join(rsync_options(transfer_profile))
+    # no indentation: sbatch only reads the script if its first line starts with #! and the #SBATCH lines with #SBATCH
+    shell_script_content = f"""#!/bin/bash
+#SBATCH --job-name=rsync_pi
+#SBATCH --ntasks=1
+#SBATCH --time=08:00:00
+#SBATCH --mem=64G
+#SBATCH --partition=cpu
+#SBATCH --cpus-per-task=8
+#SBATCH --output=slurm-%j.out
+#SBATCH --mail-user=$(whoami)@crick.ac.uk
+#SBATCH --mail-type=FAIL
 
-    # Submit the SBATCH script
-    process = subprocess.run(["sbatch", tmp_script_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+rsync -avh {rsync_opts} --progress {remove_files}{username}@{ip_address}:/home/{username}/data/ {save_path}/raw_data
+rsync_status=$?
 
-    # Delete the temporary file after submission
-    os.unlink(tmp_script_path)
+# check rsync status and output file if it fails to allow user to easily notice
+if [ $rsync_status -ne 0 ]; then
+    # If rsync fails, create a file indicating failure
+    echo "Rsync failed for IP: {ip_address}" > "FAILED-rsync_IP-{ip_address}.out"
+fi
 
-    # Check the result and extract job ID from the output
-    if process.returncode == 0:
-        job_id_output = process.stdout.strip()
-        print(job_id_output)
+ssh {username}@{ip_address} "find data/ -mindepth 1 -type d -empty -delete"
 
-        job_id = job_id_output.split()[-1]
+# the job's final state is rsync's, so failed_tasks reports a failed transfer
+exit $rsync_status
+"""
 
-        print(process.stdout)
-    else:
-        print("Failed to submit job")
-        print(process.stderr)
-        exit(1)
+    return run_job(shell_script_content)
 
-# extract frames from video and crop centre 150 pixels
-def extract_frames(video_path, interval=1, save_path='', crop=[525, 675], stop_frame = 250): #250
+def stitch_images(strips, save_path, tile_config, name, rig, interval, layout_cache):
     """
-    Extract frames from a video.
-    
-    :param video_path: Path to the video file.
-    :param interval: Interval of frames to extract (1 = every frame, 2 = every other frame, etc.)
-    """
-
-    vidcap = cv2.VideoCapture(video_path)
-    success, image = vidcap.read()
-    count = 0
-    frames = []
-
-    while success:
-        if count <= stop_frame and (count % interval == 0):  # Save frame every 'interval' frames
-            frames.append(image)
-        success, image = vidcap.read()
-        count += 1
+    Stitch strips into one unwrapped image, in-process with NumPy (no Fiji/JVM); only the unwrapped image is written.
 
-    vidcap.release()
- 
-    os.makedirs(f'{save_path}/sequence/', exist_ok=True)
-    for i, frame in enumerate(frames):
-        frame = frame[:, crop[0]:crop[1]]
-        cv2.imwrite(f'{save_path}/sequence/{str(i).zfill(3)}.jpg', frame)
-
-    return(frames)
-
-def stitch_images(frames, save_path, tile_config, name):
-    path = f'{save_path}/pupae_data/raw_data/sequence'
-    if(tile_config==True):
-        source_path = f'{save_path}/TileConfiguration.txt'
-        destination_path = f'{path}/TileConfiguration.txt'
-        shutil.copy2(source_path, destination_path)
-
-    print(f'frame count {len(frames)}')
-
-    plugin = "Grid/Collection stitching"
-    args = {
-        "type": "[Grid: row-by-row]",
-        "order": "[Right & Down]",
-        "grid_size_x": f"{(len(frames))}",
-        "grid_size_y": "1",
-        "tile_overlap": "86",
-        "first_file_index_i": "0",
-        "directory": f'{path}',
-        "file_names": "{iii}.jpg",
-        "output_textfile_name": "TileConfiguration.txt",
-        "fusion_method": "[Linear Blending]",
-        "regression_threshold": "0.30",
-        "max/avg_displacement_threshold": "2.50",
-        "absolute_displacement_threshold": "3.50",
-        "compute_overlap": True,
-        "computation_parameters": "[Save computation time (but use more RAM)]",
-        "image_output": "[Write to disk]",
-        "output_directory": f'{path}'
-    }
+    :param strips: cropped strips (arrays), in order
+    :param tile_config: place the strips with the offsets in {save_path}/TileConfiguration.txt, otherwise use the
+                        layout cached for this rig and video geometry (registered once, then only validated)
+    :param layout_cache: path of the JSON layout cache
+    """
+    print(f'frame count {len(strips)}')
 
     # if tile_config=True, stitch based on tile configuration file
     if(tile_config==True):
+        offsets = read_tile_configuration(f'{save_path}/TileConfiguration.txt')
+    else:
+        key = layout_key(rig, strips[0].shape, len(strips), interval)
+        offsets = layout_for(strips, key, layout_cache)
 
-        args = {
-            "type": "[Positions from file]",
-            "order": "[Defined by TileConfiguration]",
-            "layout_file": f"TileConfiguration.txt",
-            "directory": f'{path}',
-            "fusion_method": "[Linear Blending]",
-            "regression_threshold": "0.30",
-            "max/avg_displacement_threshold": "2.50",
-            "absolute_displacement_threshold": "3.50",
-            "compute_overlap": True,
-            "computation_parameters": "[Save computation time (but use more RAM)]",
-            "image_output": "[Write to disk]",
-            "output_directory": f'{path}'
-        }
-
-    # run plugin
-    ij.py.run_plugin(plugin, args)
-
-    # Fiji stitcher saves output as separate 8-bit R, G, and B images
-    # merge them together and save here
-
-    # Open the 8-bit grayscale TIFF images
-    image_r = Image.open(f'{path}/img_t1_z1_c1')
-    image_g = Image.open(f'{path}/img_t1_z1_c2')
-    image_b = Image.open(f'{path}/img_t1_z1_c3')
-
-    # Merge the images into one RGB image
-    image_rgb = Image.merge('RGB', (image_r, image_g, image_b))
-
-    # Define crop box with left, upper, right, and lower coordinates; heuristically defined by looking at uncropped images
-    crop_box = (0, 0, 1045, image_rgb.height)  # Right coordinate is 1050, lower coordinate is the height of the image
-
-    # Crop the image
-    cropped_image_rgb = image_rgb.crop(crop_box)
+    # blend strips and crop to panorama_width
+    panorama = stitch_strips(strips, offsets, width=panorama_width)
 
     # save the image
-    cropped_image_rgb.save(f'{save_path}/pupae_data/unwrapped/{name}.jpg')
-    
-    # delete everything from sequence directory and then directory itself
-    try:
-        shutil.rmtree(f'{path}/')
-    except:
-        print('Cannot delete folder!')
+    os.makedirs(f'{save_path}/pupae_data/unwrapped', exist_ok=True)
+    cv2.imwrite(f'{save_path}/pupae_data/unwrapped/{name}.jpg', panorama)
 
     return(f'{save_path}/pupae_data/unwrapped/{name}.jpg')
-    
-def is_job_array_completed(job_id):
-    cmd = ["sacct", "-j", f"{job_id}", "--format=JobID,State", "--noheader"]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
-    lines = result.stdout.strip().split('\n')
 
-    # Initialize flags
-    all_completed = True
+def unwrap_video(video_file_path, save_path, scratch_path, tile_config, rig, interval, layout_cache, strips_to_disk=False):
+    """
+    Extract and stitch one video.
+
+    By default the strips go straight from the decoder to the stitcher in memory (about 50 strips of 150 px per video).
 
-    for line in lines:
-        parts = line.split()
-        if len(parts) < 2:
-            continue  # Skip any malformed lines
+    :param scratch_path: with strips_to_disk, parent folder for the per-video scratch folders (node-local storage is fastest)
+    :param strips_to_disk: write the strips as JPEGs and stitch from those, as before (e.g. to inspect them)
+    :return: (name, path of the unwrapped image)
+    """
+    name = os.path.basename(video_file_path)
+
+    if not strips_to_disk:
+        strips = [strip for _, strip in iter_strips(video_file_path, interval=interval)]
+        path = stitch_images(strips=strips, save_path=save_path, tile_config=tile_config, name=name, rig=rig, interval=interval, layout_cache=layout_cache)
+        return name, path
+
+    # its own scratch folder, so several videos can be unwrapped at once
+    scratch = tempfile.mkdtemp(prefix=f'{name}-', dir=scratch_path)
+    try:
+        frames = extract_frames(video_file_path, interval=interval, save_path=scratch)
+        strips = [cv2.imread(frame) for frame in frames]
+        path = stitch_images(strips=strips, save_path=save_path, tile_config=tile_config, name=name, rig=rig, interval=interval, layout_cache=layout_cache)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return name, path
+
+def init_unwrap_worker():
+    # one OpenCV thread per process, the pool already uses every allocated core
+    cv2.setNumThreads(1)
+
+def unwrap_videos(video_files, workers, on_done=None, **kwargs):
+    """
+    Unwrap videos on a process pool.
 
-        # Extract and ignore array job steps (e.g., "12345678_1") for simplicity
-        job_id_part, job_state = parts[0], parts[1]
-        if "_" in job_id_part and not job_id_part.endswith("batch"):  # Focus on array tasks excluding batch job steps
-            if job_state not in ["COMPLETED", "FAILED", "CANCELLED"]:
-                all_completed = False
-                break
+    The first video is unwrapped on its own, so its strip layout is registered and cached once
+    before the other videos only validate it.
 
-    return all_completed
+    :param workers: number of processes (e.g. the SLURM --cpus-per-task)
+    :param on_done: optional function called in this process with (video_file_path, name, path) as each video finishes
+    :param kwargs: passed on to unwrap_video
+    :return: (names, paths, failed): names and paths of the unwrapped videos, in the same order as video_files,
+             and (video_file_path, error) for each video that could not be unwrapped
+    """
+    results = []
+    failed = []
+
+    def finished(video_file_path, result=None, error=None):
+        # one broken video is recorded and skipped, the others carry on
+        if error is not None:
+            print(f'Failed to unwrap {video_file_path}: {error}')
+            failed.append((video_file_path, str(error)))
+            return
+        results.append(result)
+        if on_done is not None:
+            on_done(video_file_path, *result)
+
+    if len(video_files) == 0:
+        return [], [], failed
 
+    try:
+        finished(video_files[0], unwrap_video(video_files[0], **kwargs))
+    except Exception as e:
+        finished(video_files[0], error=e)
+
+    if len(video_files) > 1:
+        # fork, so the workers inherit the functions of this script instead of re-running it
+        workers = max(1, min(workers, len(video_files) - 1))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'), initializer=init_unwrap_worker) as executor:
+            futures = [executor.submit(unwrap_video, video_file_path, **kwargs) for video_file_path in video_files[1:]]
+            for video_file_path, future in zip(video_files[1:], futures):
+                try:
+                    finished(video_file_path, future.result())
+                except Exception as e:
+                    finished(video_file_path, error=e)
+
+    names = [name for name, _ in results]
+    paths = [path for _, path in results]
+    return names, paths, failed
+    
 #####################
 #################
 # PIPELINE STARTS
@@ -213,6 +190,13 @@ def is_job_array_completed(job_id):
 username = 'rotator'
 ip_address = '192.168.1.100'
 remove_files = True
+layout_cache = '/camp/lab/windingm/data/instruments/behavioural_rigs/plugcamera/tile_layouts.json'
+
+# processes used to unwrap videos; defaults to the cores SLURM allocated to this job
+workers = int(os.environ.get('SLURM_CPUS_PER_TASK', os.cpu_count()))
+
+# SLEAP array tasks
+sleap_shards = 4
 
 # pulling user-input variables from command line
 parser = argparse.ArgumentParser(description='Pupae video pipeline: take IP address of RPi taking pupae videos, syncs to NEMO, processes videos, and determines number of pupae per vial')
@@ -220,7 +204,12 @@ parser.add_argument('-ip', '--ip-address', type=str, required=True, default=ip_a
 parser.add_argument('-e', '--experiment-name', type=str, required=True, help='name of experiment; should match existing experiment')
 parser.add_argument('-u', '--username', type=str, default=username, help='username for SSH attempts')
 parser.add_argument('-r', '--remove-files', type=bool, default=remove_files, help='whether to remove files from RPi source')
-parser.add_arguemnt('-ec', '--experiment-csv', type=str, required=True, help='path to the CSV with experimental details')
+parser.add_argument('-tc', '--tile-config', action='store_true', help='stitch with the fixed offsets in raw_data/TileConfiguration.txt instead of the cached layout')
+parser.add_argument('-lc', '--layout-cache', type=str, default=layout_cache, help='JSON file of strip layouts per rig and video geometry, shared between experiments')
+parser.add_argument('-w', '--workers', type=int, default=workers, help='number of videos unwrapped at the same time')
+parser.add_argument('-sd', '--strips-to-disk', action='store_true', help='write the extracted strips to scratch JPEGs before stitching, instead of keeping them in memory')
+parser.add_argument('-s', '--sleap-shards', type=int, default=sleap_shards, help='number of SLEAP array tasks; each loads the models once and predicts its share of the images')
+parser.add_argument('-ec', '--experiment-csv', type=str, required=True, help='path to the CSV with experimental details')
 
 # ingesting user-input arguments
 args = parser.parse_args()
@@ -229,6 +218,11 @@ username = args.username
 experiment_name = args.experiment_name
 remove_files = args.remove_files
 experiment_csv_path = args.experiment_csv
+tile_config = args.tile_config
+layout_cache = args.layout_cache
+workers = args.workers
+strips_to_disk = args.strips_to_disk
+sleap_shards = args.sleap_shards
 
 # save-path on NEMO, must exist already in this case
 save_path = f'/camp/lab/windingm/data/instruments/behavioural_rigs/plugcamera/{experiment_name}/pupae'
@@ -263,20 +257,10 @@ if(remove_files==True):
 if(remove_files==False):
     remove_files = ''
 
-sbatch_rsync(remove_files, username, ip_address, save_path)
-
-# Function to check if the array job is completed
-seconds = 60
-print(f"Wait for {seconds} seconds before checking if slurm job has completed")
-time.sleep(seconds)
-
-# Wait for the array job to complete
-print(f"Waiting for slurm job {job_id} to complete...")
-while not is_job_array_completed(job_id):
-    print(f"Slurm job {job_id} is still running. Waiting...")
-    time.sleep(30)  # Check every 30 seconds
+job_id, states = sbatch_rsync(remove_files, username, ip_address, save_path)
+if len(failed_tasks(states)) > 0:
+    print(f'Slurm job {job_id} did not complete, check FAILED-rsync_IP-{ip_address}.out')
 
-print(f"Slurm job {job_id} has completed.\n")
 end_transfer = datetime.now()
 
 ########
@@ -284,27 +268,41 @@ end_transfer = datetime.now()
 ########
 
 start_processing = datetime.now()
-fiji_path = '/camp/home/shared/Fiji-installation/Fiji.app'
-tile_config = True
-
-# Start ImageJ
-scyjava.config.add_option('-Xmx6g')
-ij = imagej.init(fiji_path) # point to local installation
-
 video_path = f'{save_path}/raw_data'
 
-# batch process videos in folder
+# batch process videos in folder, several at once
+# with --strips-to-disk, scratch folders for the strips go on node-local storage when SLURM provides it
+interval = 5
+scratch_path = os.environ.get('TMPDIR', tempfile.gettempdir())
 paths = []
 names = []
+
+# videos unwrapped by an earlier run, whose image is unchanged since, are skipped on a rerun
+unwrap_state = StageState(f'{save_path}/.stage_state', 'unwrap')
+
+def unwrapped_path(video_file_path):
+    return f'{video_path}/pupae_data/unwrapped/{os.path.basename(video_file_path)}.jpg'
+
+def mark_unwrapped(video_file_path, name, path):
+    unwrap_state.mark_done(video_file_path, [video_file_path], [path])
+
 if(os.path.isdir(video_path)):
     video_files = [f'{video_path}/{f}' for f in os.listdir(video_path) if os.path.isfile(os.path.join(video_path, f)) and not (f.endswith('.txt') or f=='.DS_Store')]
-    for video_file_path in video_files:
-        frames = extract_frames(video_file_path, interval=5, save_path=video_path)
-        name = os.path.basename(video_file_path)
-        path = stitch_images(frames=frames, save_path=video_path, tile_config=tile_config, name=name)
-
-        names.append(name) # return file name for subsequent saving
-        paths.append(path) # return all paths of unwrapped videos for subsequent processing
+    pending = unwrap_state.pending(video_files, lambda v: [v], lambda v: [unwrapped_path(v)])
+    print(f'Unwrapping {len(pending)} videos on {workers} processes ({len(video_files) - len(pending)} already unwrapped)')
+    _, _, unwrap_failed = unwrap_videos(pending, workers, on_done=mark_unwrapped, save_path=video_path, scratch_path=scratch_path, tile_config=tile_config,
+                                        rig=ip_address, interval=interval, layout_cache=layout_cache, strips_to_disk=strips_to_disk)
+
+    # failed videos are listed and left out of the later stages; a rerun retries them
+    if len(unwrap_failed) > 0:
+        print(f'{len(unwrap_failed)} of {len(pending)} videos could not be unwrapped, see FAILED-unwrap.txt')
+        with open(f'{save_path}/FAILED-unwrap.txt', 'w') as f:
+            f.write(''.join(f'{video_file_path}\t{error}\n' for video_file_path, error in unwrap_failed))
+    failed_videos = [video_file_path for video_file_path, _ in unwrap_failed]
+    video_files = [video_file_path for video_file_path in video_files if video_file_path not in failed_videos]
+
+    names = [os.path.basename(video_file_path) for video_file_path in video_files]
+    paths = [unwrapped_path(video_file_path) for video_file_path in video_files]
 
 ############
 # SLEAP predictions
@@ -312,21 +310,33 @@ if(os.path.isdir(video_path)):
 centroid_path = '/camp/lab/windingm/home/shared/SLEAP_models/pupae_detection/240306_235934.centroid'
 centered_instance_path = '/camp/lab/windingm/home/shared/SLEAP_models/pupae_detection/240306_235934.centered_instance'
 
-paths_string = ' '.join(paths)
-names_string = ' '.join(names)
+sleap_infer_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rigtools', 'sleap_infer.py')
 
-shell_script_content = f"""#!/bin/bash
+# images predicted by an earlier run, whose image and predictions are unchanged since, are skipped on a rerun
+predict_state = StageState(f'{save_path}/.stage_state', 'predict')
+
+def predictions_path(image_path):
+    # same naming as rigtools/sleap_infer.py with an output folder
+    return f'{save_path}/predictions/{os.path.splitext(os.path.basename(image_path))[0]}.predictions.slp'
 
-# usage: to run on pupae videos after unwrapping:
-# sbatch --export=EXP_NAME=test_exp,RIG_NUMBERS="50 51 52",REMOVE=False sbatch-transfer.sh
+pending = predict_state.pending(paths, lambda p: [p], lambda p: [predictions_path(p)])
+print(f'Predicting {len(pending)} images ({len(paths) - len(pending)} already predicted)')
 
-#SBATCH --job-name=SLEAP_training
+# each array task loads the models once and predicts its shard of the unwrapped images
+shards = max(1, min(sleap_shards, len(pending)))
+images_list = f'{save_path}/predictions/unwrapped_images.txt'
+with open(images_list, 'w') as f:
+    f.write(''.join(f'{path}\n' for path in pending))
+
+shell_script_content = f"""#!/bin/bash
+
+#SBATCH --job-name=SLEAP_infer
 #SBATCH --ntasks=1
 #SBATCH --time=08:00:00
 #SBATCH --mem=64G
 #SBATCH --partition=cpu
-#SBATCH --cpus-per-task=4
-#SBATCH --array=1-{len(paths)}
+#SBATCH --cpus-per-task=8
+#SBATCH --array=1-{shards}
 #SBATCH --output=slurm-%j.out
 #SBATCH --mail-user=$(whoami)@crick.ac.uk
 #SBATCH --mail-type=FAIL
@@ -336,51 +346,23 @@ ml Anaconda3/2023.09-0
 source /camp/apps/eb/software/Anaconda/conda.env.sh
 
 conda activate sleap
-IFS=' ' read -r -a paths_array <<< "{paths_string}"
-IFS=' ' read -r -a paths_array <<< "{names_string}"
-
-path_var="${{paths_array[$SLURM_ARRAY_TASK_ID-1]}}"
-name_var="${{names_array[$SLURM_ARRAY_TASK_ID-1]}}"
-
-sleap-track $path_var -m {centroid_path} -m {centered_instance_path} -o {save_path}/predictions/$name_var.predictions.slp
-sleap-convert $path_var.predictions.slp -o $path_var.json --format json"""
 
-# Create a temporary file to hold the SBATCH script
-with tempfile.NamedTemporaryFile(mode="w", delete=False) as tmp_script:
-    tmp_script.write(shell_script_content)
-    tmp_script_path = tmp_script.name
+python {sleap_infer_script} shard -l {images_list} --shard $SLURM_ARRAY_TASK_ID --shards {shards} -m {centroid_path} -m {centered_instance_path} -o {save_path}/predictions"""
 
-# Submit the SBATCH script
-process = subprocess.run(["sbatch", tmp_script_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+if len(pending) > 0:
+    # submit and block until every array task has finished (sbatch --wait, no polling)
+    sleap_start = time.time()
+    job_id, states = run_job(shell_script_content)
+    failed = failed_tasks(states)
+    if len(failed) > 0:
+        print(f'SLEAP tasks that did not complete: {failed}')
 
-# Delete the temporary file after submission
-os.unlink(tmp_script_path)
+    # only predictions written by this job count as done
+    for path in pending:
+        output = predictions_path(path)
+        if os.path.exists(output) and os.path.getmtime(output) >= sleap_start:
+            predict_state.mark_done(path, [path], [output])
 
-# Check the result and extract job ID from the output
-if process.returncode == 0:
-    job_id_output = process.stdout.strip()
-    print(job_id_output)
-
-    job_id = job_id_output.split()[-1]
-
-    print(process.stdout)
-else:
-    print("Failed to submit job")
-    print(process.stderr)
-    exit(1)
-
-# Function to check if the array job is completed
-seconds = 60
-print(f"Wait for {seconds} seconds before checking if slurm job has completed")
-time.sleep(seconds)
-
-# Wait for the array job to complete
-print(f"Waiting for array job {job_id} to complete...")
-while not is_job_array_completed(job_id):
-    print(f"Array job {job_id} is still running. Waiting...")
-    time.sleep(30)  # Check every 30 seconds
-
-print(f"Array job {job_id} has completed.\n")
 print(f"SLEAP predictions complete!\n")
 
 ############
@@ -388,19 +370,10 @@ print(f"SLEAP predictions complete!\n")
 
 prediction_path = f'{save_path}/predictions'
 
+# counts are read straight from the .slp files and written to the CSV as they are read
 counts = []
 if(os.path.isdir(prediction_path)):
-    video_files = [f'{prediction_path}/{f}' for f in os.listdir(prediction_path) if os.path.isfile(os.path.join(prediction_path, f)) and not (f.endswith('.jpg') or f=='.DS_Store')]
-    for video_file in video_files:
-        with open(video_file, 'r') as file:
-            data = json.load(file)
-
-            pupae_count = len(data['labels'][0]['_instances'])
-            print([pupae_count, video_file])
-            counts.append([pupae_count, video_file])
-
-df = pd.DataFrame(counts, columns = ['pupae_count', 'dataset'])
-df.to_csv(f'{prediction_path}/pupae_counts.csv')
+    counts = count_folder(prediction_path, f'{prediction_path}/pupae_counts.csv', workers=workers)
 
 # body_x, body_y = data['labels'][0]['_instances'][0]['_points']['0']['x'], data['labels'][0]['_instances'][0]['_points']['0']['y']
 # tail_x, tail_y = data['labels'][0]['_instances'][0]['_points']['1']['x'], data['labels'][0]['_instances'][0]['_points']['1']['y']
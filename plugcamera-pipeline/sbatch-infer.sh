@@ -2,6 +2,8 @@
 
 # usage: to run on pupae videos after unwrapping:
 # sbatch --export=VIDEOS_PATH=path/to/videos,CENTROID_PATH=path/to/model.centroid,CENTERED_PATH=path/to/model.centered_instance sbatch-infer.sh
+# submit from this folder; the models are loaded once and run over every video (rigtools/sleap_infer.py)
+# counts can then be read from the .predictions.slp files with rigtools/pupae_counts.py, no JSON conversion needed
 
 #SBATCH --job-name=SLEAP_infer
 #SBATCH --ntasks=1
@@ -18,9 +20,4 @@ ml Anaconda3/2023.09-0
 source /camp/apps/eb/software/Anaconda/conda.env.sh
 
 conda activate sleap
-for video in "$VIDEOS_PATH"/*.mp4
-do
-  sleap-track "$video" -m "$CENTROID_PATH" -m "$CENTERED_PATH"
-  #sleap-track "$video" -m 240306_235934.centroid -m 240306_235934.centered_instance
-  sleap-convert "$video".predictions.slp -o "$video".json --format json
-done
+python "$SLURM_SUBMIT_DIR/../rigtools/sleap_infer.py" shard -i "$VIDEOS_PATH"/*.mp4 -m "$CENTROID_PATH" -m "$CENTERED_PATH"
@@ -4,13 +4,22 @@ import pandas as pd
 from datetime import datetime
 import os
 import argparse
-import time
-import tempfile
+import sys
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rigtools.transfer_profiles import rsync_options, profiles
+from rigtools.transfer_stage import transfer_stage_script
+from rigtools.video_convert import jpgs_to_mp4_command
+from rigtools.slurm import run_job, failed_tasks
+from rigtools.stage_state import StageState
+from rigtools.dag import DAG
 
 # default argument values
 username = 'plugcamera'
 ip_path = 'ip_addresses.csv'
 remove_files = False
+transfer_profile = 'media' # JPEGs do not compress further, see rigtools/transfer_profiles.py
 
 # pulling user-input variables from command line
 parser = argparse.ArgumentParser(description='Batch SSH test, requires SSH password, path of IP addresses to test, and a save path for the connectivity data')
@@ -19,6 +28,8 @@ parser.add_argument('-e', '--experiment-name', type=str, required=True, help='na
 parser.add_argument('-l', '--list-of-rig-names', nargs='+', type=int, default=[], help='list of rig names')
 parser.add_argument('-u', '--username', type=str, default=username, help='username for SSH attempts')
 parser.add_argument('-r', '--remove-files', action='store_true', help='whether to remove files from RPi source')
+parser.add_argument('-tp', '--transfer-profile', type=str, default=transfer_profile, choices=list(profiles), help='rsync compression/checksum profile')
+parser.add_argument('-p', '--per-rig', action='store_true', help="transfer and convert each rig as its own pipeline, converting a rig's folders as soon as its own transfer verified")
 
 # ingesting user-input arguments
 args = parser.parse_args()
@@ -27,6 +38,8 @@ list_names = args.list_of_rig_names
 username = args.username
 experiment_name = args.experiment_name
 remove_files = args.remove_files
+transfer_profile = args.transfer_profile
+per_rig = args.per_rig
 
 # save-path on NEMO
 save_path = f'/camp/lab/windingm/data/instruments/behavioural_rigs/plugcamera/{experiment_name}'
@@ -60,31 +73,38 @@ if not os.path.exists(f'{save_path}/mp4s'):
 
 start_transfer = datetime.now()
 
-len(IPs)
-IPs_string = ' '.join(IPs)
 rig_num_str = [f'pc{x}' for x in rig_num]
-rigs_string = ' '.join(rig_num_str)
-
-# remove source files from RPi or not, is a user-input parameter
-if remove_files==True: remove_files_option = '--remove-source-files '  
-if remove_files==False: remove_files_option = '' 
-
-print('\nremove_files variable:')
-print(remove_files_option)
-print('\n')
-
-# shell script content
-shell_script_content = f"""#!/bin/bash
+log_dir = f'{save_path}/transfer_logs'
+
+print(f'\nremove_files variable: {remove_files}\n')
+
+# one rsync pass per rig, verified locally against the manifest it records;
+# only verified files are then removed from the RPi (if remove_files)
+transfer_stage = transfer_stage_script(
+    username='plugcamera',
+    source='/home/plugcamera/data/',
+    destination=f'{save_path}/raw_data',
+    log_dir=log_dir,
+    rsync_opts=['-avh'] + rsync_options(transfer_profile),
+    remove_files=remove_files,
+    fail_file=f'FAILED-rsync_{experiment_name}_${{rig}}_IP-${{ip}}.out',
+)
+
+def transfer_job_script(ips, rigs):
+    # SBATCH array job with one task per rig
+    ips_string = ' '.join(ips)
+    rigs_string = ' '.join(rigs)
+    return f"""#!/bin/bash
 #SBATCH --job-name=rsync_pis
 #SBATCH --ntasks=1
 #SBATCH --cpus-per-task=4
-#SBATCH --array=1-{len(IPs)}
+#SBATCH --array=1-{len(ips)}
 #SBATCH --partition=ncpu
 #SBATCH --mem=10G
 #SBATCH --time=08:00:00
 
 # convert ip_string to shell array
-IFS=' ' read -r -a ip_array <<< "{IPs_string}"
+IFS=' ' read -r -a ip_array <<< "{ips_string}"
 ip="${{ip_array[$SLURM_ARRAY_TASK_ID-1]}}"
 
 IFS=' ' read -r -a rig_array <<< "{rigs_string}"
@@ -93,78 +113,75 @@ rig="${{rig_array[$SLURM_ARRAY_TASK_ID-1]}}"
 # rsync using the IP address obtained above
 
 echo $ip
+{transfer_stage}"""
 
-rsync -avzh --progress plugcamera@$ip:/home/plugcamera/data/ {save_path}/raw_data
-rsync -avzh --progress {remove_files_option}plugcamera@$ip:/home/plugcamera/data/ {save_path}/raw_data
-rsync_status=$?
-
-# check rsync status and output file if it fails to allow user to easily notice
-if [ $rsync_status -ne 0 ]; then
-    # If rsync fails, create a file indicating failure
-    echo "Rsync failed for IP: $ip" > "FAILED-rsync_{experiment_name}_${{rig}}_IP-${{ip}}.out"
-fi
-
-ssh plugcamera@$ip "find data/ -mindepth 1 -type d -empty -delete"
-"""
-
-# Create a temporary file to hold the SBATCH script
-with tempfile.NamedTemporaryFile(mode="w", delete=False) as tmp_script:
-    tmp_script.write(shell_script_content)
-    tmp_script_path = tmp_script.name
-
-# Submit the SBATCH script
-process = subprocess.run(["sbatch", tmp_script_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-# Optionally, delete the temporary file after submission
-os.unlink(tmp_script_path)
-
-# Check the result and extract job ID from the output
-if process.returncode == 0:
-    job_id_output = process.stdout.strip()
-    print(job_id_output)
-
-    job_id = job_id_output.split()[-1]
+# generate and crop mp4 videos for each directory
+def run_commands_in_directory(directory_path, save_path):
+    # encode and crop in a single ffmpeg pass, without an uncropped intermediate
+    generate_mp4 = jpgs_to_mp4_command(directory_path, f'{save_path}.mp4', framerate=7, crop='1750:1750:1430:360')
+
+    # Run the command using subprocess
+    return subprocess.run(generate_mp4, shell=True).returncode
+
+# directories already converted, and unchanged since, are skipped on a rerun
+state = StageState(f'{save_path}/.stage_state', 'jpg_to_mp4')
+
+def convert_directory(directory):
+    """
+    :return: True if the directory's mp4 exists (converted now or by an earlier run)
+    """
+    inputs = [f'{save_path}/raw_data/{directory}']
+    outputs = [f'{save_path}/mp4s/{directory}.mp4']
+    if state.is_done(directory, inputs, outputs):
+        print(f"\nAlready converted: {save_path}/raw_data/{directory}")
+        return True
+
+    print(f"\nProcessing: {save_path}/raw_data/{directory}")
+    if run_commands_in_directory(f'{save_path}/raw_data/{directory}', f'{save_path}/mp4s/{directory}') == 0:
+        state.mark_done(directory, inputs, outputs)
+        return True
+    return False
+
+if per_rig:
+    # each rig is its own branch: the folders its transfer verified are converted as soon as that transfer is done,
+    # without waiting for the slowest rig; a failed transfer only skips that rig's conversion
+    def transfer_rig(ip, rig):
+        job_id, states = run_job(transfer_job_script([ip], [rig]))
+        if len(failed_tasks(states)) > 0:
+            raise RuntimeError(f'transfer job {job_id} did not complete: {states}')
+
+    def convert_rig(rig):
+        # the files this rig's transfer verified (NUL-separated, relative to raw_data); one mp4 per top-level folder
+        with open(f'{log_dir}/{rig}_verified.txt') as f:
+            verified = [path for path in f.read().split('\0') if path.endswith('.jpg')]
+        directories = sorted({path.split('/')[0] for path in verified if '/' in path})
+        if len(directories) == 0:
+            print(f'No image folders transferred from {rig}')
+            return 0
+
+        failed = [directory for directory in directories if not convert_directory(directory)]
+        if len(failed) > 0:
+            raise RuntimeError(f'conversion did not complete for {failed}')
+        return len(directories)
+
+    dag = DAG()
+    for ip, rig in zip(IPs, rig_num_str):
+        verified = f'{log_dir}/{rig}_verified.txt'
+        dag.add(f'transfer_{rig}', partial(transfer_rig, ip, rig), outputs=[verified])
+        dag.add(f'convert_{rig}', partial(convert_rig, rig), inputs=[verified])
+
+    results = dag.run(workers=2 * len(IPs))
+    not_done = [name for name, result in results.items() if result.status != 'done']
+    if len(not_done) > 0:
+        print(f'Stages that did not complete: {not_done}')
 
-    print(process.stdout)
 else:
-    print("Failed to submit job")
-    print(process.stderr)
-    exit(1)
-    
-# Function to check if the array job is completed
-def is_job_array_completed(job_id):
-    cmd = ["sacct", "-j", f"{job_id}", "--format=JobID,State", "--noheader"]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
-    lines = result.stdout.strip().split('\n')
-
-    # Initialize flags
-    all_completed = True
-
-    for line in lines:
-        parts = line.split()
-        if len(parts) < 2:
-            continue  # Skip any malformed lines
-
-        # Extract and ignore array job steps (e.g., "12345678_1") for simplicity
-        job_id_part, job_state = parts[0], parts[1]
-        if "_" in job_id_part and not job_id_part.endswith("batch"):  # Focus on array tasks excluding batch job steps
-            if job_state not in ["COMPLETED", "FAILED", "CANCELLED"]:
-                all_completed = False
-                break
-
-    return all_completed
-
-seconds = 60
-print(f"Wait for {seconds} seconds before checking if array job has completed")
-time.sleep(seconds)
-
-# Wait for the array job to complete
-print(f"Waiting for array job {job_id} to complete...")
-while not is_job_array_completed(job_id):
-    print(f"Array job {job_id} is still running. Waiting...")
-    time.sleep(30)  # Check every 30 seconds
-
-print(f"Array job {job_id} has completed.\n")
+    # submit and block until every array task has finished (sbatch --wait, no polling)
+    job_id, states = run_job(transfer_job_script(list(IPs), rig_num_str))
+    failed = failed_tasks(states)
+    if len(failed) > 0:
+        print(f'Transfer tasks that did not complete: {failed}')
+
 end_transfer = datetime.now()
 
 ###############################
@@ -185,18 +202,6 @@ def list_directory_contents(folder_path):
     
     return contents
 
-# generate and crop mp4 videos for each directory
-def run_commands_in_directory(directory_path, save_path):
-    # Define the commands
-    generate_mp4 = f"ffmpeg -framerate 7 -pattern_type glob -i '{directory_path}/*.jpg' -c:v libx264 -pix_fmt yuv420p {directory_path}_raw.mp4"
-    crop_mp4 = f"ffmpeg -i {directory_path}_raw.mp4 -filter:v 'crop=1750:1750:1430:360' {save_path}.mp4"
-    remove_uncropped = f"rm {directory_path}_raw.mp4"
-
-    # Run the commands using subprocess
-    subprocess.run(generate_mp4, shell=True)
-    subprocess.run(crop_mp4, shell=True)
-    subprocess.run(remove_uncropped, shell=True)
-
 # Path to the parent directory with the folders you want to list
 base_path = f'{save_path}/raw_data'
 directory_contents = list_directory_contents(base_path)
@@ -208,11 +213,11 @@ if directory_contents:
 else:
     print("No contents found.")
 
+# with --per-rig, this only converts folders the per-rig pipelines did not (e.g. from earlier runs)
 if directory_contents:
     print(f"Processing each directory in {base_path}:")
     for directory in directory_contents:
-        print(f"\nProcessing: {base_path}/{directory}")
-        run_commands_in_directory(f'{save_path}/raw_data/{directory}', f'{save_path}/mp4s/{directory}')
+        convert_directory(directory)
 else:
     print("No directories found.")
 
@@ -13,11 +13,16 @@
 
 import subprocess
 import getpass
+import sys
 import pandas as pd
 from datetime import datetime
 import os
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rigtools.fleet import probe_hosts, probe_columns
+from rigtools.ssh_pool import SSHPool
+
 # default argument values
 timeout = 10
 username = 'plugcamera'
@@ -50,23 +55,16 @@ now = datetime.now()
 now = now.strftime("%Y-%m-%d_%H-%M-%S")
 
 # check how many IPs could be connected to
-IPs_connected = []
-for i, IP in enumerate(IPs):
-    ssh_command = f'sshpass -p "{password}" ssh -o StrictHostKeyChecking=no -o ConnectTimeout={timeout} {username}@{IP} echo Connection to {IP} successful'
-    result = subprocess.run(ssh_command, shell=True)
-    if result.returncode == 0:
-        result = 1
-    else:
-        print(f"Failed to connect to {IP}")
-        result = 0
-    IPs_connected.append([f'pc{rig_num[i]}', IP, result])
+# this also opens one persistent SSH connection per rig, which is reused by the commands below
+pool = SSHPool(username=username, password=password, timeout=timeout)
+IPs_connected = probe_hosts(IPs, rig_num, password, username, timeout, pool=pool)
 
 # Check if a save folder exists already and create it if not
 if not os.path.exists(save_path):
     os.makedirs(save_path)
 
 # export data on SSH connectivity
-IPs_connected = pd.DataFrame(IPs_connected, columns=['rig_number','IP', 'SSH_worked'])
+IPs_connected = pd.DataFrame(IPs_connected, columns=probe_columns)
 frac_connected = sum(IPs_connected.SSH_worked==1)/len(IPs_connected.SSH_worked)
 IPs_connected.to_csv(f'{save_path}/{now}_IPs-connected_{frac_connected*100:.0f}%.csv', index=0)
 
@@ -78,8 +76,7 @@ print(f'{frac_connected*100:.1f}% of IPs worked')
 for i, IP in enumerate(IPs):
     try:
         print(f'Running command 1 on {rig_num[i]} [{IP}]')
-        ssh_dir = f'sshpass -p {password} ssh -o ConnectTimeout={timeout} {username}@{IP} "mkdir .ssh"'
-        result = subprocess.run(ssh_dir, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result = pool.run(IP, ['mkdir', '.ssh'])
         print(result.stdout.decode())
 
     except subprocess.CalledProcessError as e:
@@ -91,8 +88,7 @@ for i, IP in enumerate(IPs):
 
     try:
         print(f'Running command 2 on {rig_num[i]} [{IP}]')
-        ssh_command = f'sshpass -p {password} rsync -avzh --progress pi_key.pub plugcamera@{IP}:/home/plugcamera/.ssh/authorized_keys'
-        result = subprocess.run(ssh_command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result = pool.rsync(IP, 'pi_key.pub', f'/home/{username}/.ssh/authorized_keys', options=['-avzh', '--progress'], remote_source=False)
         print(result.stdout.decode())
 
     except subprocess.CalledProcessError as e:
@@ -100,4 +96,6 @@ for i, IP in enumerate(IPs):
     except Exception as e:
         print(f"An error occurred on {rig_num[i]} [{IP}]: {e}")
     except:
-        print(f"Script failed on {rig_num[i]} [{IP}] with unknown error")
\ No newline at end of file
+        print(f"Script failed on {rig_num[i]} [{IP}] with unknown error")
+
+pool.close_all()
@@ -10,18 +10,34 @@
 #
 # optional arguments:   -t [timeout for SSH connections in seconds, default: 10]
 #                       -u [username for SSH connections, default: 'plugcamera']
+#                       -w [number of RPis transferring at the same time, default: 4]
+#                       -b [total bandwidth cap in MB/s shared by all transfers, default: 0 = no cap]
+#                       -ap [maximum transfers at the same time per access point, default: 0 = no limit;
+#                            needs an 'access_point' column in the IP CSV]
+#                       -pi [seconds between per-rig progress reports (printed and added to the transfers CSV), default: 30; 0 = none]
 
-import subprocess
 import getpass
+import sys
 import pandas as pd
 from datetime import datetime
 import os
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rigtools.fleet import probe_hosts, probe_columns
+from rigtools.ssh_pool import SSHPool
+from rigtools.transfer import run_transfers, transfer_columns, TransferLog
+from rigtools.transfer_profiles import rsync_options, profiles
+
 # default argument values
 timeout = 300
 username = 'plugcamera'
 save_path = 'SSH_data'
+workers = 4
+bwlimit = 0
+ap_limit = 0
+progress_interval = 30
+transfer_profile = 'media' # JPEGs do not compress further, see rigtools/transfer_profiles.py
 
 # pulling user-input variables from command line
 # note that the default timeout = 10 and default username = 'plugcamera' for SSH connections
@@ -31,6 +47,11 @@ parser.add_argument('-ip', '--ip-path', dest='ip_path', action='store', type=str
 parser.add_argument('-s', '--save-path', dest='save_path', action='store', type=str, default=save_path, help='The path to save folder for SSH connectivity data')
 parser.add_argument('-t', '--timeout', dest='timeout', action='store', type=int, default=timeout, help='Number of seconds to attempt rsync connection')
 parser.add_argument('-u', '--username', dest='username', action='store', type=str, default=username, help='username for SSH attempts')
+parser.add_argument('-w', '--workers', dest='workers', action='store', type=int, default=workers, help='number of RPis transferring at the same time')
+parser.add_argument('-b', '--bwlimit', dest='bwlimit', action='store', type=float, default=bwlimit, help='total bandwidth cap in MB/s, shared by concurrent transfers; 0 for no cap')
+parser.add_argument('-pi', '--progress-interval', dest='progress_interval', action='store', type=int, default=progress_interval, help='seconds between progress reports for each running transfer; 0 for none')
+parser.add_argument('-tp', '--transfer-profile', dest='transfer_profile', action='store', type=str, default=transfer_profile, choices=list(profiles), help='rsync compression/checksum profile')
+parser.add_argument('-ap', '--ap-limit', dest='ap_limit', action='store', type=int, default=ap_limit, help="maximum transfers at the same time per access point ('access_point' column of the IP CSV); 0 for no limit")
 
 # ingesting user-input arguments
 args = parser.parse_args()
@@ -39,34 +60,41 @@ ip_path = args.ip_path
 save_path = args.save_path
 timeout = args.timeout
 username = args.username
+workers = args.workers
+bwlimit = args.bwlimit
+ap_limit = args.ap_limit
+transfer_profile = args.transfer_profile
+progress_interval = args.progress_interval
+
+if workers < 1:
+    parser.error('--workers must be a positive integer')
 
 # pull IP address data
 data = pd.read_csv(ip_path)
 IPs = data.IP_address
 rig_num = data.rig_number
 
+# RPis sharing an access point can be limited with -ap; all rigs count as separate otherwise
+if 'access_point' in data.columns:
+    access_points = data.access_point.fillna('').astype(str)
+else:
+    access_points = ['']*len(IPs)
+
 # record current time for naming the saved data CSV
 now = datetime.now()
 now = now.strftime("%Y-%m-%d_%H-%M-%S")
 
 # check how many IPs could be connected to
-IPs_connected = []
-for i, IP in enumerate(IPs):
-    ssh_command = f'sshpass -p "{password}" ssh -o StrictHostKeyChecking=no -o ConnectTimeout=10 {username}@{IP} echo Connection to {IP} successful'
-    result = subprocess.run(ssh_command, shell=True)
-    if result.returncode == 0:
-        result = 1
-    else:
-        print(f"Failed to connect to {IP}")
-        result = 0
-    IPs_connected.append([f'pc{rig_num[i]}', IP, result])
+# this also opens one persistent SSH connection per rig, which is reused by the commands below
+pool = SSHPool(username=username, password=password, timeout=10)
+IPs_connected = probe_hosts(IPs, rig_num, password, username, 10, pool=pool)
 
 # Check if a save folder exists already and create it if not
 if not os.path.exists(save_path):
     os.makedirs(save_path)
 
 # export data on SSH connectivity
-IPs_connected = pd.DataFrame(IPs_connected, columns=['rig_number','IP', 'SSH_worked'])
+IPs_connected = pd.DataFrame(IPs_connected, columns=probe_columns)
 frac_connected = sum(IPs_connected.SSH_worked==1)/len(IPs_connected.SSH_worked)
 IPs_connected.to_csv(f'{save_path}/{now}_IPs-connected_{frac_connected*100:.0f}%.csv', index=0)
 
@@ -75,18 +103,28 @@ print(f'{frac_connected*100:.1f}% of IPs worked')
 
 #############################
 # run rsync in batch
-for i, IP in enumerate(IPs):
-    try:
-        print(f'Running command on {rig_num[i]} [{IP}]')
-        ssh_command = f'sshpass -p {password} rsync -avzh --progress --timeout={timeout} --remove-source-files plugcamera@{IP}:data/ data'
-        result = subprocess.run(ssh_command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        ssh_command = f'sshpass -p {password} ssh {username}@{IP} "find data/ -mindepth 1 -type d -empty -delete"' # find and delete empty folders after rsync; rsync doesn't delete folders on its own
-        result2 = subprocess.run(ssh_command, shell=True)
-        print(result.stdout.decode())
-
-    except subprocess.CalledProcessError as e:
-        print(f"Script failed on {rig_num[i]} [{IP}] with error: {e.stderr.decode()}")
-    except Exception as e:
-        print(f"An error occurred on {rig_num[i]} [{IP}]: {e}")
-    except:
-        print(f"Script failed on {rig_num[i]} [{IP}]")
\ No newline at end of file
+# rigs that failed the connectivity test are skipped
+rigs = [(f'pc{rig_num[i]}', IP, access_points[i]) for i, IP in enumerate(IPs) if IPs_connected.SSH_worked[i]==1]
+
+def remove_empty_folders(rig, row):
+    # find and delete empty folders after rsync; rsync doesn't delete folders on its own
+    if row[transfer_columns.index('exit_code')] == 0:
+        pool.run(rig[1], 'find data/ -mindepth 1 -type d -empty -delete', check=False)
+
+# per-rig progress ('running' rows) and final transfer times and throughput ('done'/'failed' rows) are written to the CSV as they come
+options = ['-av', f'--timeout={timeout}', '--remove-source-files'] + rsync_options(transfer_profile)
+transfer_log = TransferLog(f'{save_path}/{now}_rsync-transfers.csv')
+try:
+    transfers = run_transfers(pool, rigs, 'data/', 'data', options=options, workers=workers, total_bwlimit=bwlimit, ap_limit=ap_limit,
+                              after=remove_empty_folders, progress_interval=progress_interval, on_row=transfer_log)
+finally:
+    transfer_log.close()
+
+transfers = pd.DataFrame(transfers, columns=transfer_columns)
+
+failed = transfers[transfers.exit_code != 0]
+print(f'\n{len(transfers) - len(failed)} of {len(transfers)} transfers worked, {transfers.bytes_transferred.sum()/1e6:.1f} MB in total')
+for row in failed.itertuples():
+    print(f"Script failed on {row.rig_number} [{row.IP}] with error: {row.error}")
+
+pool.close_all()
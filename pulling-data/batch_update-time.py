@@ -13,11 +13,16 @@
 
 import subprocess
 import getpass
+import sys
 import pandas as pd
 from datetime import datetime
 import os
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rigtools.fleet import probe_hosts, probe_columns
+from rigtools.ssh_pool import SSHPool
+
 # default argument values
 username = 'topdown'
 
@@ -49,19 +54,12 @@ if(len(list_names)>0):
     rig_num = list_names
 
 # check how many IPs could be connected to
-IPs_connected = []
-for i, IP in enumerate(IPs):
-    ssh_command = f'sshpass -p "{password}" ssh -o StrictHostKeyChecking=no -o ConnectTimeout=10 {username}@{IP} echo Connection to {IP} successful'
-    result = subprocess.run(ssh_command, shell=True)
-    if result.returncode == 0:
-        result = 1
-    else:
-        print(f"Failed to connect to {IP}")
-        result = 0
-    IPs_connected.append([f'pc{rig_num[i]}', IP, result])
+# this also opens one persistent SSH connection per rig, which is reused by the commands below
+pool = SSHPool(username=username, password=password, timeout=10)
+IPs_connected = probe_hosts(IPs, rig_num, password, username, 10, pool=pool)
 
 # report the total percent of IPs that could be reached by SSH
-IPs_connected = pd.DataFrame(IPs_connected, columns=['rig_number','IP', 'SSH_worked'])
+IPs_connected = pd.DataFrame(IPs_connected, columns=probe_columns)
 frac_connected = sum(IPs_connected.SSH_worked==1)/len(IPs_connected.SSH_worked)
 print(f'{frac_connected*100:.1f}% of IPs worked')
 
@@ -72,8 +70,7 @@ for i, IP in enumerate(IPs):
         # pull the current time via local system and change Raspberry Pi time to that
         now = datetime.now()
         now = now.strftime("%m%d%H%M%Y.%S")
-        time_command = f'sshpass -p {password} ssh {username}@{IP} "sudo date {now}"'
-        result = subprocess.run(time_command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result = pool.run(IP, ['sudo', 'date', now])
         print(result.stdout.decode())
 
     except subprocess.CalledProcessError as e:
@@ -81,4 +78,6 @@ for i, IP in enumerate(IPs):
     except Exception as e:
         print(f"An error occurred on {rig_num[i]} [{IP}]: {e}")
     except:
-        print(f"Script failed on {rig_num[i]} [{IP}]")
\ No newline at end of file
+        print(f"Script failed on {rig_num[i]} [{IP}]")
+
+pool.close_all()
@@ -0,0 +1,2 @@
+# shared helpers for the behavioural-rig scripts
+# scripts in this repo are run from their own folder, so they add the repo root to sys.path before importing from here
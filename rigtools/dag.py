@@ -0,0 +1,127 @@
+## Small DAG runner for pipeline stages
+# each task declares the files it reads and writes (and optionally other tasks it needs); a task starts as soon as
+# everything it depends on has finished, so independent branches (e.g. one per rig) run concurrently instead of
+# waiting at a barrier after every stage
+# tasks are mostly waiting on SLURM jobs or subprocesses, so they run on threads
+
+# Example usage
+# dag = DAG()
+# for rig in rigs:
+#     dag.add(f'transfer_{rig}', partial(transfer, rig), outputs=[f'{log_dir}/{rig}_verified.txt'])
+#     dag.add(f'convert_{rig}', partial(convert, rig), inputs=[f'{log_dir}/{rig}_verified.txt'])
+# results = dag.run(workers=len(rigs) * 2)
+# failed = [name for name, result in results.items() if result.status != 'done']
+
+import os
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# status is 'done', 'failed' (the task raised, or did not write its outputs) or 'skipped' (something it depends on did not finish)
+TaskResult = namedtuple('TaskResult', ['name', 'status', 'seconds', 'error', 'value'])
+
+Task = namedtuple('Task', ['name', 'func', 'inputs', 'outputs', 'after'])
+
+class DAG:
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, name, func, inputs=(), outputs=(), after=()):
+        """
+        :param func: called with no arguments; its return value is kept in the result
+        :param inputs: files the task reads; it runs after whichever tasks list them as outputs
+        :param outputs: files the task writes; the task fails if they are missing afterwards
+        :param after: names of further tasks it must run after
+        """
+        if name in self.tasks:
+            raise ValueError(f'task {name} added twice')
+        self.tasks[name] = Task(name, func, list(inputs), list(outputs), list(after))
+
+    def dependencies(self):
+        # task name -> set of task names it depends on
+        producers = {}
+        for task in self.tasks.values():
+            for output in task.outputs:
+                producers[output] = task.name
+
+        dependencies = {}
+        for task in self.tasks.values():
+            needed = set(task.after) | {producers[i] for i in task.inputs if i in producers}
+            needed.discard(task.name)
+            unknown = needed - set(self.tasks)
+            if len(unknown) > 0:
+                raise ValueError(f'task {task.name} depends on unknown tasks {sorted(unknown)}')
+            dependencies[task.name] = needed
+        return dependencies
+
+    def check_acyclic(self, dependencies):
+        # Kahn's algorithm; any task left over is part of a cycle
+        remaining = {name: set(needed) for name, needed in dependencies.items()}
+        while True:
+            ready = [name for name, needed in remaining.items() if len(needed) == 0]
+            if len(ready) == 0:
+                break
+            for name in ready:
+                del remaining[name]
+            for needed in remaining.values():
+                needed.difference_update(ready)
+        if len(remaining) > 0:
+            raise ValueError(f'tasks form a cycle: {sorted(remaining)}')
+
+    def run_task(self, task):
+        start = time.monotonic()
+        try:
+            value = task.func()
+            missing = [output for output in task.outputs if not os.path.exists(output)]
+            if len(missing) > 0:
+                return TaskResult(task.name, 'failed', time.monotonic() - start, f'outputs missing: {missing}', value)
+            return TaskResult(task.name, 'done', time.monotonic() - start, '', value)
+        except Exception as e:
+            return TaskResult(task.name, 'failed', time.monotonic() - start, str(e), None)
+
+    def run(self, workers=8):
+        """
+        Run every task once its dependencies are done; tasks downstream of a failure are skipped.
+
+        :return: dict of task name -> TaskResult, in the order tasks finished
+        """
+        dependencies = self.dependencies()
+        self.check_acyclic(dependencies)
+
+        results = {}
+        running = set()
+        lock = threading.Condition()
+
+        def finish(result):
+            with lock:
+                results[result.name] = result
+                running.discard(result.name)
+                lock.notify_all()
+            print(f'[{result.status}] {result.name} ({result.seconds:.0f}s){" " + result.error if result.error else ""}')
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            with lock:
+                while len(results) < len(self.tasks):
+                    # a task that finishes straight away runs finish() in this thread (the lock is reentrant), so
+                    # progress is measured by the results, not only by skips
+                    finished_before = len(results)
+                    for name, needed in dependencies.items():
+                        if name in results or name in running:
+                            continue
+                        upstream_failed = sorted(n for n in needed if n in results and results[n].status != 'done')
+                        if len(upstream_failed) > 0:
+                            results[name] = TaskResult(name, 'skipped', 0, f'upstream failed: {upstream_failed}', None)
+                            print(f'[skipped] {name}')
+                        elif all(n in results for n in needed):
+                            running.add(name)
+                            future = executor.submit(self.run_task, self.tasks[name])
+                            future.add_done_callback(lambda f: finish(f.result()))
+
+                    # anything new can unblock further tasks straight away; otherwise wait for a running task to finish
+                    if len(results) == finished_before and len(results) < len(self.tasks):
+                        if len(running) == 0:
+                            raise RuntimeError(f'no task can run: {sorted(set(self.tasks) - set(results))}')
+                        lock.wait()
+
+        return results
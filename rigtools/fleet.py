@@ -0,0 +1,79 @@
+## Helpers to run commands on many RPis at once
+# each rig is handled on its own thread; the work is almost entirely waiting on SSH,
+# so a bounded thread pool lets a full sweep finish in roughly one timeout period
+
+import subprocess
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# default number of rigs contacted at the same time
+max_workers = 32
+
+def run_parallel(func, items, workers=max_workers):
+    """
+    Run func(item) for every item on a bounded thread pool.
+
+    :param func: function taking a single item
+    :param items: list of items (e.g. rig indices or IP addresses)
+    :param workers: maximum number of items processed at the same time
+    :return: list of results, in the same order as items
+    """
+    items = list(items)
+    if len(items) == 0:
+        return []
+
+    workers = max(1, min(workers, len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+def ssh_command(IP, password, username, timeout, remote_command):
+    # same sshpass/ssh call used throughout the fleet scripts
+    return f'sshpass -p {shlex.quote(password)} ssh -o StrictHostKeyChecking=no -o ConnectTimeout={timeout} {username}@{IP} {shlex.quote(remote_command)}'
+
+def probe_ssh(IP, password, username, timeout, pool=None):
+    """
+    Check whether an RPi accepts an SSH connection.
+
+    :param pool: optional SSHPool; the probe then opens the shared connection used by later commands
+    :return: (worked, latency in seconds, error message)
+    """
+    start = time.monotonic()
+    if pool is not None:
+        worked = pool.connect(IP)
+        return worked, time.monotonic() - start, '' if worked else pool.errors.get(IP, 'CONNECT_FAILED')
+
+    command = ssh_command(IP, password, username, timeout, f'echo Connection to {IP} successful')
+    try:
+        # the extra seconds stop a half-open connection from hanging the sweep
+        result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout + 5)
+    except subprocess.TimeoutExpired:
+        return False, time.monotonic() - start, 'TIMEOUT'
+    latency = time.monotonic() - start
+
+    if result.returncode == 0:
+        return True, latency, ''
+
+    err = result.stderr.decode(errors='replace').strip().replace('\n', ' | ')
+    return False, latency, err or f'exit code {result.returncode}'
+
+def probe_hosts(IPs, rig_num, password, username, timeout, workers=max_workers, rig_prefix='pc', pool=None):
+    """
+    Probe SSH connectivity of all rigs concurrently.
+
+    :return: list of [rig_number, IP, SSH_worked, latency_s, error] rows, in input order
+    """
+    def probe(i):
+        worked, latency, error = probe_ssh(IPs[i], password, username, timeout, pool=pool)
+        if worked:
+            print(f'Connection to {rig_prefix}{rig_num[i]} [{IPs[i]}] successful ({latency:.2f}s)')
+        else:
+            print(f"Failed to connect to {rig_prefix}{rig_num[i]} [{IPs[i]}]")
+        return [f'{rig_prefix}{rig_num[i]}', IPs[i], int(worked), round(latency, 3), error]
+
+    IPs = list(IPs)
+    rig_num = list(rig_num)
+    return run_parallel(probe, range(len(IPs)), workers=workers)
+
+# column names for the rows returned by probe_hosts
+probe_columns = ['rig_number', 'IP', 'SSH_worked', 'latency_s', 'error']
@@ -0,0 +1,225 @@
+## File manifests for verifying transfers without re-scanning the RPi
+# a manifest is a tab-separated file with one line per file: relative path, size in bytes,
+# modification time (epoch seconds, or rsync's %M format) and an optional xxh64 hash
+# after a transfer, the local copy is checked against the manifest with local stat calls only,
+# and the list of verified files is what gets deleted from the RPi
+
+# Manifests come from one of two places:
+#  - the RPi itself: recording scripts call append_entry() when a video is finished, which keeps data/.manifest.tsv up to date;
+#    `update` adds anything the recording scripts did not record (stat only, on the RPi)
+#  - the transfer: rsync run with rsync_manifest_options prints every file it considered (`from-rsync`)
+# This file only uses the standard library (xxhash is optional), so it can be copied next to the recording
+# scripts on an RPi or streamed over SSH: ssh pi@IP "python3 - update data" < manifest.py
+
+# Example usage (inside an SBATCH transfer job)
+# python3 manifest.py from-rsync -i rsync.log -o manifest.tsv
+# python3 manifest.py verify -m manifest.tsv -r /path/to/local/copy -v verified.txt
+
+import argparse
+import os
+import sys
+import time
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# name of the manifest kept in an RPi's data folder
+manifest_name = '.manifest.tsv'
+
+# prefix of the rsync --out-format lines that make up a manifest
+rsync_prefix = 'MANIFEST|'
+
+# rsync options that print every file in the source (changed or not) with size and modification time
+# --no-human-readable keeps %l as plain digits even when -h is also given
+rsync_manifest_options = ['-ii', '--no-human-readable', f"--out-format={rsync_prefix}%i|%l|%M|%n"]
+
+def format_mtime(mtime):
+    # same format as rsync's %M, in local time
+    return time.strftime('%Y/%m/%d-%H:%M:%S', time.localtime(int(mtime)))
+
+def read_manifest(manifest_path):
+    """
+    :return: list of (relative path, size, mtime string, hash) tuples; hash is '' if not recorded
+    """
+    entries = []
+    with open(manifest_path) as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 3:
+                continue
+            entries.append((parts[0], int(parts[1]), parts[2], parts[3] if len(parts) > 3 else ''))
+    return entries
+
+def write_manifest(entries, manifest_path):
+    # written to a temporary file first, so a crash never leaves a half-written manifest
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        for path, size, mtime, file_hash in entries:
+            f.write(f'{path}\t{size}\t{mtime}\t{file_hash}\n')
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+def hash_file(path):
+    # xxh64 of a file's contents, or '' if xxhash is not installed
+    if xxhash is None:
+        return ''
+    h = xxhash.xxh64()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def stat_entry(root, path, with_hash=False):
+    stat = os.stat(os.path.join(root, path))
+    file_hash = hash_file(os.path.join(root, path)) if with_hash else ''
+    return (path, stat.st_size, str(int(stat.st_mtime)), file_hash)
+
+def append_entry(root, path, with_hash=False):
+    """
+    Add one finished file to the manifest in root; called by recording scripts after each video.
+
+    :param root: the data folder (e.g. 'data')
+    :param path: the file, relative to root
+    """
+    entry = stat_entry(root, path, with_hash)
+    with open(os.path.join(root, manifest_name), 'a') as f:
+        f.write('\t'.join(str(x) for x in entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def update(root, with_hash=False):
+    """
+    Bring the manifest in root up to date: add files it does not list, and re-stat files whose size or mtime changed.
+
+    :return: the updated entries
+    """
+    manifest_path = os.path.join(root, manifest_name)
+    entries = read_manifest(manifest_path) if os.path.exists(manifest_path) else []
+    known = {entry[0]: entry for entry in entries}
+
+    updated = []
+    for dirpath, dirs, files in os.walk(root):
+        for f in files:
+            path = os.path.relpath(os.path.join(dirpath, f), root)
+            if f in [manifest_name, f'{manifest_name}.tmp']:
+                continue
+            stat = os.stat(os.path.join(root, path))
+            entry = known.get(path)
+            if entry is None or entry[1] != stat.st_size or entry[2] != str(int(stat.st_mtime)):
+                entry = stat_entry(root, path, with_hash)
+            updated.append(entry)
+
+    write_manifest(updated, manifest_path)
+    return updated
+
+def prune(root):
+    # drop entries for files that no longer exist (e.g. after the verified files were deleted)
+    manifest_path = os.path.join(root, manifest_name)
+    if not os.path.exists(manifest_path):
+        return []
+    entries = [entry for entry in read_manifest(manifest_path) if os.path.exists(os.path.join(root, entry[0]))]
+    write_manifest(entries, manifest_path)
+    return entries
+
+def from_rsync(log_path):
+    """
+    Build manifest entries from the output of an rsync run with rsync_manifest_options.
+
+    Only regular files are kept; rsync prints every file it considered, so the transfer itself is the only walk of the source.
+    """
+    entries = []
+    with open(log_path, errors='replace') as f:
+        for line in f:
+            if not line.startswith(rsync_prefix):
+                continue
+            itemize, size, mtime, path = line.rstrip('\n')[len(rsync_prefix):].split('|', 3)
+            if len(itemize) > 1 and itemize[1] == 'f':
+                entries.append((path, int(size.replace(',', '').replace('.', '')), mtime, ''))
+    return entries
+
+def mtime_matches(mtime, local_mtime):
+    # manifests from the RPi hold epoch seconds; manifests from rsync hold its %M format
+    if mtime == '':
+        return True
+    if mtime.isdigit():
+        return int(mtime) == int(local_mtime)
+    return format_mtime(local_mtime) == mtime
+
+def verify(entries, root, check_hash=False):
+    """
+    Check that every manifest entry exists under root with the same size and modification time.
+
+    :param check_hash: also compare xxh64 hashes, for entries that have one (skipped if xxhash is not installed)
+    :return: (verified relative paths, list of (path, problem) for everything else); only the verified paths may be deleted at the source
+    """
+    verified = []
+    problems = []
+    for path, size, mtime, file_hash in entries:
+        local = os.path.join(root, path)
+        try:
+            stat = os.stat(local)
+        except FileNotFoundError:
+            problems.append((path, 'missing'))
+            continue
+
+        if stat.st_size != size:
+            problems.append((path, f'size {stat.st_size} != {size}'))
+        elif not mtime_matches(mtime, stat.st_mtime):
+            problems.append((path, f'mtime {int(stat.st_mtime)} != {mtime}'))
+        elif check_hash and xxhash is not None and file_hash != '' and hash_file(local) != file_hash:
+            problems.append((path, 'hash mismatch'))
+        else:
+            verified.append(path)
+    return verified, problems
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build transfer manifests and verify local copies against them')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_rsync = subparsers.add_parser('from-rsync', help='build a manifest from rsync output')
+    parser_rsync.add_argument('-i', '--input', type=str, required=True, help='rsync output, run with the options in rsync_manifest_options')
+    parser_rsync.add_argument('-o', '--output', type=str, required=True, help='manifest path to write')
+
+    parser_update = subparsers.add_parser('update', help='bring the manifest in an RPi data folder up to date and print it')
+    parser_update.add_argument('root', type=str, help='data folder')
+    parser_update.add_argument('--hash', action='store_true', help='hash newly added files with xxh64 (needs xxhash)')
+
+    parser_prune = subparsers.add_parser('prune', help='drop manifest entries for files that no longer exist')
+    parser_prune.add_argument('root', type=str, help='data folder')
+
+    parser_verify = subparsers.add_parser('verify', help='verify a local copy against a manifest')
+    parser_verify.add_argument('-m', '--manifest', type=str, required=True, help='manifest path')
+    parser_verify.add_argument('-r', '--root', type=str, required=True, help='local folder the files were transferred into')
+    parser_verify.add_argument('--hash', action='store_true', help='also compare xxh64 hashes recorded in the manifest (needs xxhash)')
+    parser_verify.add_argument('-v', '--verified', type=str, default=None, help='optional path for the NUL-separated list of verified files (for deleting at the source)')
+
+    args = parser.parse_args()
+
+    if args.command == 'from-rsync':
+        entries = from_rsync(args.input)
+        write_manifest(entries, args.output)
+        print(f'{len(entries)} files in manifest {args.output}')
+
+    if args.command == 'update':
+        for entry in update(args.root, with_hash=args.hash):
+            sys.stdout.write('\t'.join(str(x) for x in entry) + '\n')
+
+    if args.command == 'prune':
+        entries = prune(args.root)
+        print(f'{len(entries)} files left in {os.path.join(args.root, manifest_name)}')
+
+    if args.command == 'verify':
+        if args.hash and xxhash is None:
+            print('xxhash is not installed, hashes will not be checked')
+        entries = read_manifest(args.manifest)
+        verified, problems = verify(entries, args.root, check_hash=args.hash)
+
+        if args.verified is not None:
+            with open(args.verified, 'w') as f:
+                f.write(''.join(f'{path}\0' for path in verified))
+
+        print(f'{len(verified)} of {len(entries)} files verified in {args.root}')
+        for path, problem in problems:
+            print(f'\tNOT VERIFIED: {path} ({problem})')
+
+        sys.exit(1 if len(problems) > 0 else 0)
@@ -0,0 +1,110 @@
+## Pupae counts straight from SLEAP predictions
+# reads the number of predicted instances from the .predictions.slp files (HDF5) without converting them to JSON;
+# only the first frame's row of the 'frames' table is read, not the points
+# JSON predictions are still supported and are read with a streaming parser (ijson) when it is installed
+# counts are written to the CSV as each file is read, so an interrupted run keeps what it counted
+
+# Example usage
+# python pupae_counts.py -p /path/to/predictions -o /path/to/predictions/pupae_counts.csv -w 8
+
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+count_columns = ['pupae_count', 'dataset']
+
+def count_slp(path):
+    # instances of the first labeled frame, from the instance index range SLEAP stores per frame
+    if h5py is None:
+        raise ImportError('h5py is needed to read .slp files')
+    with h5py.File(path, 'r') as f:
+        frames = f['frames']
+        if len(frames) == 0:
+            return 0
+        first = frames[0]
+        return int(first['instance_id_end'] - first['instance_id_start'])
+
+def count_json(path):
+    # same count as len(data['labels'][0]['_instances']), without loading the whole file when ijson is available
+    with open(path, 'rb') as f:
+        if ijson is None:
+            labels = json.load(f)['labels']
+        else:
+            labels = ijson.items(f, 'labels.item')
+        for label in labels:
+            return len(label['_instances'])
+    return 0
+
+def count_predictions(path):
+    if path.endswith('.slp'):
+        return count_slp(path)
+    return count_json(path)
+
+def prediction_files(prediction_path):
+    """
+    Prediction files in a folder: every .slp, plus .json files that have no .slp next to them
+    (X.json, as sleap-convert wrote it for X.predictions.slp, or X.predictions.json).
+    """
+    files = sorted(os.listdir(prediction_path))
+    slp_stems = {f[:-len('.slp')] for f in files if f.endswith('.slp')}
+    slp_stems |= {f[:-len('.predictions.slp')] for f in files if f.endswith('.predictions.slp')}
+    paths = []
+    for f in files:
+        if f.endswith('.slp') or (f.endswith('.json') and f[:-len('.json')] not in slp_stems):
+            paths.append(os.path.join(prediction_path, f))
+    return paths
+
+def count_folder(prediction_path, output_csv, workers=1):
+    """
+    Count pupae for every prediction file in a folder in one pass, appending a row to output_csv per file.
+
+    :param workers: files read at the same time (reading is mostly waiting on the filesystem)
+    :return: list of [pupae_count, dataset] rows; files that could not be read are reported and skipped
+    """
+    paths = prediction_files(prediction_path)
+
+    def count(path):
+        try:
+            return count_predictions(path), ''
+        except Exception as e:
+            return None, str(e)
+
+    rows = []
+    with open(output_csv, 'w', newline='') as f, ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        writer = csv.writer(f)
+        writer.writerow(count_columns)
+        f.flush()
+
+        for path, (pupae_count, error) in zip(paths, executor.map(count, paths)):
+            if pupae_count is None:
+                print(f'Could not count {path}: {error}')
+                continue
+            print([pupae_count, path])
+            writer.writerow([pupae_count, path])
+            f.flush()
+            rows.append([pupae_count, path])
+
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count pupae from SLEAP predictions (.slp or .json) and write pupae_counts.csv')
+    parser.add_argument('-p', '--predictions', type=str, required=True, help='folder with the prediction files')
+    parser.add_argument('-o', '--output', type=str, default=None, help='CSV to write (default: pupae_counts.csv in the predictions folder)')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='files read at the same time')
+    args = parser.parse_args()
+
+    output = args.output if args.output is not None else f'{args.predictions}/pupae_counts.csv'
+    rows = count_folder(args.predictions, output, workers=args.workers)
+    print(f'{len(rows)} prediction files counted, saved to {output}')
@@ -0,0 +1,86 @@
+## Run several commands on an RPi in a single SSH round trip
+# the steps are composed into one remote shell script; each step's output and exit code
+# are framed by marker lines, which are parsed back into per-step results here
+
+# Example usage
+# steps = [('set_date', f'sudo date {now}'), ('read_date', 'date'), ('remove_log', 'rm -f python.log')]
+# results = run_batch(pool, IP, steps)
+# failed = first_failure(results)
+
+import subprocess
+import uuid
+from collections import namedtuple
+
+# returncode is None for steps that never ran because an earlier step failed
+StepResult = namedtuple('StepResult', ['name', 'returncode', 'output'])
+
+def compose_script(steps, marker):
+    """
+    Build the remote shell script for a list of (name, command) steps.
+
+    stdout and stderr of each step are merged; the script stops at the first failing step.
+    """
+    lines = []
+    for name, command in steps:
+        lines.append(f"printf '%s\\n' '{marker} begin {name}'")
+        lines.append(f'{{ {command}\n}} 2>&1')
+        lines.append('rc=$?')
+        # the newline first, so the end marker starts its own line even after output without a final newline
+        lines.append(f"printf '\\n%s end {name} %d\\n' '{marker}' \"$rc\"")
+        lines.append('[ $rc -eq 0 ] || exit $rc')
+    return '\n'.join(lines) + '\n'
+
+def parse_output(steps, stdout, marker):
+    """
+    Split the combined stdout back into one result per step.
+
+    A step whose end marker is missing (the stream was cut off) or cut short keeps the output read so far
+    and a returncode of None, like steps that never started.
+    """
+    outputs = {}
+    returncodes = {}
+    current = None
+    for line in stdout.splitlines():
+        if line.startswith(f'{marker} begin '):
+            current = line[len(f'{marker} begin '):]
+            outputs[current] = []
+        elif line.startswith(f'{marker} end '):
+            name, _, rc = line[len(f'{marker} end '):].rpartition(' ')
+            if name == current and rc.lstrip('-').isdigit():
+                returncodes[name] = int(rc)
+            current = None
+        elif current is not None:
+            outputs[current].append(line)
+
+    results = []
+    for name, command in steps:
+        output = '\n'.join(outputs.get(name, [])).strip()
+        results.append(StepResult(name, returncodes.get(name), output))
+    return results
+
+def run_batch(pool, IP, steps):
+    """
+    Run a list of (name, command) steps on an RPi in one SSH call.
+
+    Step names must not contain spaces.
+
+    :param pool: rigtools.ssh_pool.SSHPool used to reach the RPi
+    :return: list of StepResult, one per step
+    :raises subprocess.CalledProcessError: if SSH itself failed before any step started
+    """
+    marker = f'@@step-{uuid.uuid4().hex}'
+    script = compose_script(steps, marker)
+    result = pool.run(IP, script, check=False)
+
+    stdout = result.stdout.decode(errors='replace')
+    if marker not in stdout:
+        raise subprocess.CalledProcessError(result.returncode, 'remote batch', output=result.stdout, stderr=result.stderr)
+
+    return parse_output(steps, stdout, marker)
+
+def first_failure(results):
+    # the step that stopped the batch, or None if every step worked
+    for step in results:
+        if step.returncode != 0:
+            return step
+    return None
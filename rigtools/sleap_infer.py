@@ -0,0 +1,180 @@
+## Batched SLEAP inference
+# loads the centroid and centered-instance models once per worker and runs them over many images/videos,
+# instead of starting the environment and loading the models in a separate sleap-track call per image
+# run it inside the sleap conda environment
+
+# Two modes:
+#  - shard: predict a fixed list of inputs, or one shard of it (one SLURM array task per shard)
+#  - queue: a persistent worker that claims inputs dropped into a queue folder (or symlinks to them) until
+#           the folder holds a STOP file, or nothing arrived for --idle-timeout seconds; several workers can share a queue
+
+# Example usage
+# python sleap_infer.py shard -l images.txt --shard $SLURM_ARRAY_TASK_ID --shards 4 -m model.centroid -m model.centered_instance -o predictions
+# python sleap_infer.py queue -q queue_folder -m model.centroid -m model.centered_instance -o predictions
+
+# Predictions are written as {output}/{input name without its last extension}.predictions.slp,
+# or next to the input as {input}.predictions.slp (like sleap-track) when no output folder is given
+# (in queue mode: next to the input in queue_folder/done or queue_folder/failed)
+
+import argparse
+import os
+import socket
+import time
+
+import sleap
+
+# files a queue worker picks up
+input_extensions = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.mp4', '.avi', '.h264')
+
+def load_predictor(model_paths, batch_size=4):
+    # the expensive part, done once per worker
+    return sleap.load_model(model_paths, batch_size=batch_size)
+
+def prediction_path(input_path, output_dir=None):
+    if output_dir is None:
+        return f'{input_path}.predictions.slp'
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    return f'{output_dir}/{name}.predictions.slp'
+
+def predict_file(predictor, input_path, output_dir=None, write_json=False):
+    """
+    Predict one image or video and save the predictions.
+
+    :param write_json: also write a .json next to the .slp (what sleap-convert --format json produced)
+    :return: path of the .slp
+    """
+    labels = predictor.predict(sleap.load_video(input_path))
+    output_path = prediction_path(input_path, output_dir)
+    labels.save(output_path)
+    if write_json:
+        labels.save(output_path.replace('.slp', '.json'))
+    return output_path
+
+def shard_items(items, shard, shards):
+    # every shards-th item, starting at 1-based shard (so SLURM_ARRAY_TASK_ID can be used directly)
+    return items[shard - 1::shards]
+
+def run_shard(predictor, inputs, output_dir=None, write_json=False):
+    """
+    :return: list of (input, output or '', error or '')
+    """
+    results = []
+    for input_path in inputs:
+        start = time.monotonic()
+        try:
+            output_path = predict_file(predictor, input_path, output_dir, write_json)
+        except Exception as e:
+            print(f'Failed to predict {input_path}: {e}')
+            results.append((input_path, '', str(e)))
+            continue
+        print(f'Predicted {input_path} -> {output_path} ({time.monotonic() - start:.1f}s)')
+        results.append((input_path, output_path, ''))
+    return results
+
+def claim(queue_dir, claim_dir):
+    """
+    Move the next input out of the queue folder into this worker's folder.
+
+    os.rename is atomic, so when several workers race for the same file exactly one of them gets it.
+
+    :return: the claimed path, or None if the queue is empty
+    """
+    for f in sorted(os.listdir(queue_dir)):
+        if not f.lower().endswith(input_extensions):
+            continue
+        claimed = os.path.join(claim_dir, f)
+        try:
+            os.rename(os.path.join(queue_dir, f), claimed)
+        except FileNotFoundError:
+            continue
+        return claimed
+    return None
+
+def run_queue(predictor, queue_dir, output_dir, write_json=False, poll_interval=10, idle_timeout=600):
+    """
+    Predict inputs from queue_dir as they arrive; claimed inputs are moved to queue_dir/done or queue_dir/failed.
+    Without an output_dir, the predictions are written next to the claimed input and move along with it.
+
+    :return: number of inputs predicted
+    """
+    claim_dir = os.path.join(queue_dir, 'claimed', f'{socket.gethostname()}-{os.getpid()}')
+    done_dir = os.path.join(queue_dir, 'done')
+    failed_dir = os.path.join(queue_dir, 'failed')
+    for folder in [claim_dir, done_dir, failed_dir]:
+        os.makedirs(folder, exist_ok=True)
+
+    predicted = 0
+    last_claim = time.monotonic()
+    while True:
+        claimed = claim(queue_dir, claim_dir)
+        if claimed is None:
+            if os.path.exists(os.path.join(queue_dir, 'STOP')):
+                print('STOP file found and queue empty, stopping')
+                break
+            if time.monotonic() - last_claim > idle_timeout:
+                print(f'Nothing queued for {idle_timeout}s, stopping')
+                break
+            time.sleep(poll_interval)
+            continue
+
+        last_claim = time.monotonic()
+        result = run_shard(predictor, [claimed], output_dir, write_json)[0]
+        destination = done_dir if result[2] == '' else failed_dir
+        if result[2] == '':
+            predicted += 1
+
+        # the input, plus its predictions (or partial output) if they were written next to it
+        name = os.path.basename(claimed)
+        for f in os.listdir(claim_dir):
+            if f == name or f.startswith(f'{name}.'):
+                os.rename(os.path.join(claim_dir, f), os.path.join(destination, f))
+
+    os.rmdir(claim_dir)
+    return predicted
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run SLEAP models over many images/videos with the models loaded once')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for subparser in [subparsers.add_parser('shard', help='predict a list of inputs, or one shard of it'),
+                      subparsers.add_parser('queue', help='predict inputs dropped into a queue folder until told to stop')]:
+        subparser.add_argument('-m', '--model', type=str, action='append', required=True, help='model folder; give centroid and centered-instance models as two -m options')
+        subparser.add_argument('-o', '--output', type=str, default=None, help='folder for the predictions (default: next to each input)')
+        subparser.add_argument('-b', '--batch-size', type=int, default=4, help='inference batch size')
+        subparser.add_argument('--json', action='store_true', help='also write predictions as JSON')
+
+    parser_shard = subparsers.choices['shard']
+    parser_shard.add_argument('-i', '--inputs', type=str, nargs='*', default=[], help='images/videos to predict')
+    parser_shard.add_argument('-l', '--list', type=str, default=None, help='text file with one input path per line')
+    parser_shard.add_argument('--shard', type=int, default=1, help='1-based shard to predict (e.g. $SLURM_ARRAY_TASK_ID)')
+    parser_shard.add_argument('--shards', type=int, default=1, help='number of shards the inputs are split into')
+
+    parser_queue = subparsers.choices['queue']
+    parser_queue.add_argument('-q', '--queue', type=str, required=True, help='queue folder')
+    parser_queue.add_argument('--poll-interval', type=float, default=10, help='seconds between looks at an empty queue')
+    parser_queue.add_argument('--idle-timeout', type=float, default=600, help='stop after this many seconds without new inputs')
+
+    args = parser.parse_args()
+
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+
+    predictor = load_predictor(args.model, batch_size=args.batch_size)
+
+    if args.command == 'shard':
+        inputs = list(args.inputs)
+        if args.list is not None:
+            with open(args.list) as f:
+                inputs += [line.strip() for line in f if line.strip() != '']
+        inputs = shard_items(inputs, args.shard, args.shards)
+
+        print(f'Predicting {len(inputs)} inputs (shard {args.shard} of {args.shards})')
+        results = run_shard(predictor, inputs, args.output, args.json)
+        failed = [input_path for input_path, _, error in results if error != '']
+        print(f'{len(results) - len(failed)} of {len(results)} inputs predicted')
+        if len(failed) > 0:
+            exit(1)
+
+    if args.command == 'queue':
+        predicted = run_queue(predictor, args.queue, args.output, args.json, args.poll_interval, args.idle_timeout)
+        print(f'{predicted} inputs predicted')
@@ -0,0 +1,121 @@
+## Submitting SLURM jobs and waiting for them
+# shared by the pipeline driver scripts, replacing the copies of is_job_array_completed
+# jobs can be chained with --dependency=afterok so SLURM starts a stage as soon as its inputs finish,
+# or waited on with sbatch --wait / polling sacct with exponential backoff; either way the final state of
+# every array task is returned
+
+# Example usage
+# job_id = submit_job(shell_script_content)
+# states = wait_for_job(job_id)
+# failed = failed_tasks(states)
+# next_job_id = submit_job(next_script_content, dependency=job_id)
+
+import subprocess
+import tempfile
+import os
+import time
+from collections import Counter
+
+# states after which a job or array task will not change any more
+terminal_states = ['COMPLETED', 'FAILED', 'CANCELLED', 'TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL', 'PREEMPTED', 'BOOT_FAIL', 'DEADLINE']
+
+def submit_job(script_content, dependency=None, wait=False, extra_args=()):
+    """
+    Submit an SBATCH script.
+
+    :param dependency: job id, or list of job ids, that must all finish successfully before this job starts (afterok);
+                       if one of them fails, this job is cancelled instead of waiting forever
+    :param wait: block until the job (every array task) has finished, like sbatch --wait
+    :param extra_args: further sbatch options
+    :return: job id
+    """
+    # Create a temporary file to hold the SBATCH script
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.sh', delete=False) as tmp_script:
+        tmp_script.write(script_content)
+        tmp_script_path = tmp_script.name
+
+    command = ['sbatch', '--parsable']
+    if dependency is not None:
+        dependencies = [dependency] if isinstance(dependency, str) else list(dependency)
+        command += [f'--dependency=afterok:{":".join(dependencies)}', '--kill-on-invalid-dep=yes']
+    if wait:
+        command.append('--wait')
+    command += list(extra_args) + [tmp_script_path]
+
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    finally:
+        os.unlink(tmp_script_path)
+
+    # --parsable prints 'jobid' or 'jobid;cluster'; with --wait the exit code is the job's, so only a missing id is a submission failure
+    job_id = process.stdout.strip().split(';')[0]
+    if job_id == '' or (process.returncode != 0 and not wait):
+        print('Failed to submit job')
+        print(process.stderr)
+        raise subprocess.CalledProcessError(process.returncode, command, process.stdout, process.stderr)
+
+    print(f'Submitted batch job {job_id}')
+    return job_id
+
+def job_states(job_id):
+    """
+    :return: dict of job/array task id (e.g. '12345678_3') -> state; empty if sacct does not know the job yet
+    """
+    cmd = ['sacct', '-j', f'{job_id}', '-X', '--noheader', '--parsable2', '--format=JobID,State']
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    states = {}
+    for line in result.stdout.strip().split('\n'):
+        parts = line.split('|')
+        if len(parts) < 2 or parts[1] == '':
+            continue  # Skip any malformed lines
+        # e.g. 'CANCELLED by 1234' -> 'CANCELLED'
+        states[parts[0]] = parts[1].split()[0]
+    return states
+
+def is_finished(states):
+    return len(states) > 0 and all(state in terminal_states for state in states.values())
+
+def failed_tasks(states):
+    # tasks that finished in any state other than COMPLETED
+    return sorted(task for task, state in states.items() if state != 'COMPLETED')
+
+def summarize(states):
+    return ', '.join(f'{count} {state}' for state, count in sorted(Counter(states.values()).items()))
+
+def wait_for_job(job_id, initial_delay=10, max_delay=300, factor=2):
+    """
+    Wait for a job (every array task) to finish, checking sacct less and less often.
+
+    :param initial_delay: seconds before the first check
+    :param max_delay: longest gap between two checks
+    :return: dict of job/array task id -> final state
+    """
+    delay = initial_delay
+    print(f'Waiting for slurm job {job_id} to complete...')
+    while True:
+        time.sleep(delay)
+        states = job_states(job_id)
+        if is_finished(states):
+            break
+        print(f'Slurm job {job_id}: {summarize(states) or "not in sacct yet"}; checking again in {min(delay * factor, max_delay)}s')
+        delay = min(delay * factor, max_delay)
+
+    print(f'Slurm job {job_id} has completed: {summarize(states)}\n')
+    return states
+
+def run_job(script_content, dependency=None, extra_args=()):
+    """
+    Submit a job and block until it has finished with sbatch --wait (no polling), then read the final states.
+
+    sacct can lag behind sbatch --wait, so it is re-read with backoff until every task shows a final state.
+
+    :return: (job id, dict of job/array task id -> final state)
+    """
+    job_id = submit_job(script_content, dependency=dependency, wait=True, extra_args=extra_args)
+    states = job_states(job_id)
+    if not is_finished(states):
+        print(f'Slurm job {job_id} finished, waiting for sacct to catch up')
+        return job_id, wait_for_job(job_id, initial_delay=2, max_delay=60)
+    print(f'Slurm job {job_id} has completed: {summarize(states)}\n')
+    return job_id, states
@@ -0,0 +1,199 @@
+## Persistent SSH sessions to the RPis
+# opens one OpenSSH ControlMaster connection per rig and reuses it for every command in a run,
+# so only the first command pays the TCP + authentication handshake (the slow part on Pi Zero 2 W rigs)
+
+# Example usage
+# pool = SSHPool(username='plugcamera', password=password, timeout=10)
+# pool.run(IP, ['date'])
+# pool.rsync(IP, 'data/', 'data', options=['-avh', '--progress'], remote_source=True)
+# pool.close_all()
+
+import subprocess
+import shlex
+import re
+import os
+import atexit
+import tempfile
+import threading
+import shutil
+
+class SSHPool:
+    def __init__(self, username, password=None, timeout=10, persist=600, control_dir=None):
+        """
+        :param username: username for SSH connections
+        :param password: SSH password, passed to sshpass through the environment; None if using SSH keys
+        :param timeout: seconds to attempt each new SSH connection
+        :param persist: seconds an idle connection is kept open after the last command
+        :param control_dir: folder for the control sockets; a short temporary folder by default
+        """
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.persist = persist
+
+        # socket paths must be short (~100 characters), so keep them out of long macOS temp folders
+        self.own_control_dir = control_dir is None
+        if control_dir is None:
+            control_dir = tempfile.mkdtemp(prefix='rigssh-', dir='/tmp' if os.path.isdir('/tmp') else None)
+        self.control_dir = control_dir
+
+        self.env = os.environ.copy()
+        if password is not None:
+            self.env['SSHPASS'] = password
+
+        self.connected = set()
+        self.failed = set()  # rigs whose connection failed; not retried until close(IP) or connect(IP, retry=True)
+        self.errors = {}     # IP -> why its last connection attempt failed (ssh's stderr, 'TIMEOUT' or the exit code)
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        atexit.register(self.close_all)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close_all()
+
+    def ssh_options(self):
+        # options shared by ssh and rsync's ssh transport
+        return [
+            '-o', 'StrictHostKeyChecking=no',
+            '-o', f'ConnectTimeout={self.timeout}',
+            '-o', 'ControlMaster=auto',
+            '-o', f'ControlPath={self.control_dir}/%C',
+            '-o', f'ControlPersist={self.persist}',
+        ]
+
+    def ssh_args(self, IP):
+        prefix = ['sshpass', '-e'] if self.password is not None else []
+        return prefix + ['ssh'] + self.ssh_options() + [f'{self.username}@{IP}']
+
+    def lock(self, IP):
+        with self.locks_lock:
+            return self.locks.setdefault(IP, threading.Lock())
+
+    def connect(self, IP, retry=False):
+        """
+        Open the shared connection to an RPi, if not already open.
+
+        :param retry: try again even if connecting already failed in this run (e.g. while waiting for a reboot)
+        :return: True if the connection works
+        """
+        with self.lock(IP):
+            if IP in self.connected:
+                return True
+            if IP in self.failed and not retry:
+                return False
+            os.makedirs(self.control_dir, exist_ok=True)  # in case close_all already removed it
+
+            # stdout goes to /dev/null and stderr to a temporary file: the background master would otherwise keep our pipes open
+            # the extra seconds stop a half-open connection from hanging the caller
+            with tempfile.TemporaryFile() as stderr_file:
+                try:
+                    result = subprocess.run(self.ssh_args(IP) + ['true'], env=self.env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr_file, timeout=self.timeout + 5)
+                except subprocess.TimeoutExpired:
+                    self.failed.add(IP)
+                    self.errors[IP] = 'TIMEOUT'
+                    return False
+                stderr_file.seek(0)
+                error = stderr_file.read().decode(errors='replace').strip().replace('\n', ' | ')
+
+            if result.returncode == 0:
+                self.connected.add(IP)
+                self.failed.discard(IP)
+                self.errors.pop(IP, None)
+                return True
+            self.failed.add(IP)
+            self.errors[IP] = error or f'exit code {result.returncode}'
+            return False
+
+    def connection_failed(self, IP, command, check):
+        # what ssh itself reports when it cannot connect: exit code 255
+        stderr = f'Could not connect to {IP}: {self.errors.get(IP, "unknown error")}'.encode()
+        if check:
+            raise subprocess.CalledProcessError(255, command, b'', stderr)
+        return subprocess.CompletedProcess(command, 255, b'', stderr)
+
+    def run(self, IP, command, check=True, timeout=None):
+        """
+        Run a command on an RPi over its shared connection.
+
+        :param command: list of arguments (quoted for the remote shell) or a shell string
+        :param check: raise subprocess.CalledProcessError on a non-zero exit code
+        :return: subprocess.CompletedProcess with stdout/stderr as bytes
+        """
+        if not isinstance(command, str):
+            command = shlex.join(command)
+
+        if not self.connect(IP):
+            return self.connection_failed(IP, command, check)
+        return subprocess.run(self.ssh_args(IP) + [command], env=self.env, check=check, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+
+    def rsync_shell(self):
+        # the -e argument that makes rsync reuse the shared connection
+        return shlex.join(['ssh'] + self.ssh_options())
+
+    def rsync(self, IP, source, destination, options=('-avh',), remote_source=True, check=True, stdout=subprocess.PIPE, on_output=None):
+        """
+        rsync to or from an RPi over its shared connection.
+
+        :param source: source path; on the RPi if remote_source=True
+        :param destination: destination path; on the RPi if remote_source=False
+        :param options: list of rsync options
+        :param on_output: optional function(line) called with every stdout line while rsync runs (lines end at newlines or at the
+                          carriage returns of --progress updates); stdout is still returned in full
+        """
+        if remote_source:
+            source = f'{self.username}@{IP}:{source}'
+        else:
+            destination = f'{self.username}@{IP}:{destination}'
+
+        prefix = ['sshpass', '-e'] if self.password is not None else []
+        command = prefix + ['rsync', '-e', self.rsync_shell()] + list(options) + [source, destination]
+        if not self.connect(IP):
+            return self.connection_failed(IP, command, check)
+        if on_output is None:
+            return subprocess.run(command, env=self.env, check=check, stdin=subprocess.DEVNULL, stdout=stdout, stderr=subprocess.PIPE)
+        return self.stream(command, check, on_output)
+
+    def stream(self, command, check, on_output):
+        # stderr goes to a temporary file, so a full stderr pipe can never block rsync while we read stdout
+        with tempfile.TemporaryFile() as stderr_file:
+            process = subprocess.Popen(command, env=self.env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr_file)
+            chunks = []
+            line = b''
+            for chunk in iter(lambda: process.stdout.read1(4096), b''):
+                chunks.append(chunk)
+                line += chunk
+                parts = re.split(rb'[\r\n]', line)
+                line = parts.pop()
+                for part in parts:
+                    if part.strip():
+                        on_output(part.decode(errors='replace'))
+            if line.strip():
+                on_output(line.decode(errors='replace'))
+            process.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+
+        stdout = b''.join(chunks)
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+    def close(self, IP):
+        # ask the master to exit; harmless if it is already gone
+        # also forgets a failed connection, so the next command tries again (e.g. after a restart)
+        with self.lock(IP):
+            self.failed.discard(IP)
+            self.errors.pop(IP, None)
+            if IP not in self.connected:
+                return
+            subprocess.run(['ssh'] + self.ssh_options() + ['-O', 'exit', f'{self.username}@{IP}'], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.connected.discard(IP)
+
+    def close_all(self):
+        for IP in list(self.connected):
+            self.close(IP)
+        if self.own_control_dir:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
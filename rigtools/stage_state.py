@@ -0,0 +1,121 @@
+## Completion markers for resumable pipeline stages
+# each stage keeps a JSON file of completed items: for every item, fingerprints (size + mtime, or a content hash)
+# of the inputs it was made from and of the outputs it wrote
+# on a rerun an item is skipped if its outputs are still there and unchanged and its inputs (those that still exist;
+# e.g. converted .h264 files are deleted) have not changed, so a failed 48-hour run only redoes what is missing
+
+# Example usage
+# state = StageState(f'{save_path}/.stage_state', 'convert_mp4')
+# todo = [f for f in h264_files if not state.is_done(f, inputs=[f'{f}.h264'], outputs=[f'{f}.mp4'])]
+# ... process todo ...
+# state.mark_done(f, inputs=[f'{f}.h264'], outputs=[f'{f}.mp4'])
+#
+# for items that delete their inputs (e.g. a SLURM job that removes the .h264 after converting it), take the
+# input fingerprints before the item runs:
+# inputs = state.fingerprints([f'{f}.h264'])
+# ... convert and remove f.h264 ...
+# state.mark_done(f, inputs=inputs, outputs=[f'{f}.mp4'])
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+def fingerprint(path, content=False):
+    """
+    :param content: use an md5 of the contents instead of size + mtime (slower, but survives copies that reset mtimes)
+    :return: string fingerprint of a file or folder, or None if it does not exist; a folder's is taken over its files
+    """
+    if not os.path.exists(path):
+        return None
+
+    if os.path.isdir(path):
+        entries = sorted((entry for entry in os.scandir(path) if entry.is_file()), key=lambda entry: entry.name)
+        if content:
+            return hashlib.md5(''.join(f'{entry.name}:{fingerprint(entry.path, True)};' for entry in entries).encode()).hexdigest()
+        return f'{len(entries)}|{sum(entry.stat().st_size for entry in entries)}|{max([entry.stat().st_mtime_ns for entry in entries], default=0)}'
+
+    if content:
+        h = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+    stat = os.stat(path)
+    return f'{stat.st_size}|{stat.st_mtime_ns}'
+
+class StageState:
+    """
+    Completion markers for one stage, stored in {state_dir}/{stage}.json.
+
+    Markers are written by the driver process only (its threads may share one StageState), never by worker processes.
+    """
+    def __init__(self, state_dir, stage, content=False):
+        self.path = os.path.join(state_dir, f'{stage}.json')
+        self.content = content
+        self.lock = threading.Lock()
+        os.makedirs(state_dir, exist_ok=True)
+        self.done = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.done = json.load(f)
+
+    def is_done(self, key, inputs=(), outputs=()):
+        """
+        True if key was marked done, every output still matches its marker, and every input that still exists matches.
+        """
+        marker = self.done.get(key)
+        if marker is None:
+            return False
+        if sorted(marker['outputs']) != sorted(outputs):
+            return False
+        for path, recorded in marker['outputs'].items():
+            if recorded is None or fingerprint(path, self.content) != recorded:
+                return False
+        for path in inputs:
+            current = fingerprint(path, self.content)
+            if current is not None and current != marker['inputs'].get(path):
+                return False
+        return True
+
+    def pending(self, keys, inputs_for, outputs_for):
+        """
+        :param inputs_for: function key -> list of input paths
+        :param outputs_for: function key -> list of output paths
+        :return: the keys that still need to run, in order
+        """
+        return [key for key in keys if not self.is_done(key, inputs_for(key), outputs_for(key))]
+
+    def fingerprints(self, paths):
+        """
+        :return: dict path -> fingerprint, to pass to mark_done as inputs once the item has finished
+        """
+        return {path: fingerprint(path, self.content) for path in paths}
+
+    def mark_done(self, key, inputs=(), outputs=()):
+        """
+        :param inputs: input paths, fingerprinted now; or a dict from fingerprints(), taken before the item ran,
+                       when the item deletes its inputs (a deleted input would otherwise be recorded as None,
+                       and the item redone once the same input is delivered again)
+        """
+        # output fingerprints are taken now, so mark right after the item finished
+        marker = {
+            'inputs': dict(inputs) if isinstance(inputs, dict) else self.fingerprints(inputs),
+            'outputs': {path: fingerprint(path, self.content) for path in outputs},
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with self.lock:
+            self.done[key] = marker
+            self.save()
+
+    def forget(self, key):
+        with self.lock:
+            self.done.pop(key, None)
+            self.save()
+
+    def save(self):
+        # written to a temporary file first, so a crash never leaves a half-written state file
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(self.done, f, indent=1)
+        os.replace(f'{self.path}.tmp', self.path)
@@ -0,0 +1,111 @@
+## Cached strip layouts for unwrapping rotating-vial videos
+# the rotator is mechanically fixed, so the offsets between neighbouring strips only depend on the rig and the
+# video geometry; they are registered (phase correlation) once, stored in a JSON cache, and reused for every
+# later video after a cheap check of a few strip pairs
+
+# Example usage
+# key = layout_key(rig='192.168.1.100', strip_shape=strips[0].shape, count=len(strips), interval=5)
+# offsets = layout_for(strips, key, cache_path=f'{save_path}/tile_layouts.json')
+# panorama = stitch_strips(strips, offsets)
+
+import fcntl
+import json
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+def layout_key(rig, strip_shape, count, interval):
+    # rig plus everything about the video that changes the layout
+    return f'{rig}|{strip_shape[0]}x{strip_shape[1]}|{count}|interval-{interval}'
+
+def to_gray(strip):
+    if strip.ndim == 3:
+        strip = cv2.cvtColor(strip, cv2.COLOR_BGR2GRAY)
+    return strip.astype(np.float32)
+
+def register_pair(strip_a, strip_b):
+    """
+    Offset (x, y) at which strip_b is placed relative to strip_a, by phase correlation.
+
+    :return: (x, y, response); response is the height of the correlation peak (higher = more reliable)
+    """
+    (dx, dy), response = cv2.phaseCorrelate(to_gray(strip_a), to_gray(strip_b))
+    # phaseCorrelate gives the shift of the content, strips are placed opposite to it
+    return -dx, -dy, response
+
+def register_strips(strips):
+    # offsets of every strip, chaining the registration of each neighbouring pair
+    offsets = [(0.0, 0.0)]
+    for strip_a, strip_b in zip(strips[:-1], strips[1:]):
+        x, y, _ = register_pair(strip_a, strip_b)
+        offsets.append((offsets[-1][0] + x, offsets[-1][1] + y))
+    return offsets
+
+def validate_layout(strips, offsets, pairs=3, tolerance=2.0):
+    """
+    Check a layout against a few evenly spaced neighbouring strip pairs.
+
+    :param tolerance: maximum difference (pixels) between the registered and the stored offset of a pair
+    """
+    if len(offsets) != len(strips):
+        return False
+    if len(strips) < 2:
+        return True
+
+    for i in np.linspace(0, len(strips) - 2, min(pairs, len(strips) - 1)).astype(int):
+        x, y, _ = register_pair(strips[i], strips[i + 1])
+        expected_x = offsets[i + 1][0] - offsets[i][0]
+        expected_y = offsets[i + 1][1] - offsets[i][1]
+        if abs(x - expected_x) > tolerance or abs(y - expected_y) > tolerance:
+            return False
+    return True
+
+def read_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+def write_cache(cache, cache_path):
+    # written to a temporary file first, so a crash never leaves a half-written cache;
+    # the temporary file is unique, as unwrap workers in other processes may write at the same time
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)), prefix='.tile_layouts-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def update_cache(cache_path, key, offsets):
+    # read-modify-write under an exclusive lock, so concurrent re-registrations do not drop each other's layouts
+    with open(f'{cache_path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            cache = read_cache(cache_path)
+            cache[key] = [list(offset) for offset in offsets]
+            write_cache(cache, cache_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def layout_for(strips, key, cache_path, pairs=3, tolerance=2.0):
+    """
+    Offsets for the strips of one video: the cached layout for key if it still validates, otherwise a fresh
+    registration of every strip pair, which then replaces the cached layout.
+
+    :return: list of (x, y), one per strip
+    """
+    cache = read_cache(cache_path)
+    offsets = cache.get(key)
+    if offsets is not None and validate_layout(strips, offsets, pairs, tolerance):
+        return [tuple(offset) for offset in offsets]
+
+    print(f'Registering strip layout for {key}')
+    offsets = register_strips(strips)
+
+    update_cache(cache_path, key, offsets)
+    return offsets
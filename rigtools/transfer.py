@@ -0,0 +1,224 @@
+## Concurrent rsync transfers from many RPis
+# runs up to N rsyncs at once, splits a total bandwidth cap between them,
+# optionally limits how many rigs sharing an access point transfer at the same time,
+# and records per-rig throughput, plus progress rows while rsyncs run, to a CSV as they come
+# each rsync's share of the cap is set when it starts, from how many rsyncs can still run at the same time
+# (workers, rigs left and access-point limits); that number only shrinks as rigs finish, so later rsyncs get
+# larger shares, and every rsync running at the same time as another had both counted, so the cap is never exceeded
+
+# Example usage
+# log = TransferLog('transfers.csv')
+# rows = run_transfers(pool, rigs, 'data/', 'data', options=['-av', '--remove-source-files'], workers=4, total_bwlimit=40, ap_limit=2,
+#                      progress_interval=30, on_row=log)
+# log.close()
+
+import csv
+import re
+import threading
+import time
+from datetime import datetime
+
+# column names for the rows returned by run_transfers
+# status is 'done' or 'failed' for the final row of a rig, and 'running' for progress rows, whose end, counts and
+# MB_per_s are so far (files are only counted once complete)
+transfer_columns = ['rig_number', 'IP', 'access_point', 'start', 'end', 'seconds', 'files_transferred', 'bytes_transferred', 'MB_per_s', 'exit_code', 'error', 'status']
+
+def parse_rsync_stats(stdout):
+    """
+    Pull the number of files and bytes transferred out of `rsync --stats` output.
+
+    :return: (files transferred, bytes transferred); 0 for anything not found
+    """
+    files = re.search(r'Number of (?:regular )?files transferred: ([\d,.]+)', stdout)
+    size = re.search(r'Total transferred file size: ([\d,.]+) bytes', stdout)
+    files = int(files.group(1).replace(',', '').replace('.', '')) if files else 0
+    size = int(size.group(1).replace(',', '').replace('.', '')) if size else 0
+    return files, size
+
+def bwlimit_option(total_bwlimit, running):
+    # rsync --bwlimit is in KiB/s; the total cap (MB/s) is shared evenly between concurrent rsyncs
+    if not total_bwlimit or total_bwlimit <= 0:
+        return []
+    per_rsync = total_bwlimit * 1e6 / 1024 / max(1, running)
+    return [f'--bwlimit={max(1, int(per_rsync))}']
+
+def possible_concurrency(rigs, workers, ap_limit):
+    """
+    :param rigs: the rigs not finished yet (running or waiting), as (rig_number, IP, access_point)
+    :return: the most rsyncs that can run at the same time from now on
+    """
+    per_ap = {}
+    unlimited = 0
+    for rig in rigs:
+        if ap_limit <= 0 or rig[2] == '':
+            unlimited += 1
+        else:
+            per_ap[rig[2]] = per_ap.get(rig[2], 0) + 1
+    return min(workers, unlimited + sum(min(ap_limit, count) for count in per_ap.values()))
+
+def parse_size(text):
+    # '1,234,567' (or '1.234.567' in some locales) bytes, or '1.23M' with rsync -h
+    units = {'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+    if text[-1] in units:
+        return int(float(text[:-1].replace(',', '')) * units[text[-1]])
+    return int(text.replace(',', '').replace('.', ''))
+
+def transfer_row(rig, start, start_time, files, size, exit_code, error, status):
+    # one row of transfer_columns; start is on the monotonic clock
+    seconds = time.monotonic() - start
+    rate = size / 1e6 / seconds if seconds > 0 else 0
+    return [rig[0], rig[1], rig[2], start_time, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), round(seconds, 1), files, size, round(rate, 3), exit_code, error, status]
+
+class ProgressReporter:
+    # turns rsync --progress output into a per-rig progress report (a printed line and a 'running' row),
+    # at most every interval seconds
+    def __init__(self, rig, interval, start, start_time, on_row=None):
+        """
+        :param start: monotonic time the rsync started
+        :param start_time: the same as a date string, for the rows
+        :param on_row: optional function(row) called with each progress row
+        """
+        self.rig = rig
+        self.rig_number = rig[0]
+        self.IP = rig[1]
+        self.interval = interval
+        self.start = start
+        self.start_time = start_time
+        self.on_row = on_row
+        self.last_print = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+        self.to_check = ''
+        self.rate = ''
+
+    def __call__(self, line):
+        update = re.match(r'\s*([\d,.]+[KMGT]?)\s+(\d+)%\s+(\S+/s)', line)
+        if update is None:
+            return
+        self.rate = update.group(3)
+        finished = re.search(r'xfe?r#(\d+), to-che?c?k=(\d+)/(\d+)', line)
+        if finished is not None:
+            self.files = int(finished.group(1))
+            self.bytes += parse_size(update.group(1))
+            self.to_check = f', {finished.group(2)} of {finished.group(3)} entries left to check'
+
+        if time.monotonic() - self.last_print >= self.interval:
+            self.last_print = time.monotonic()
+            print(f'rsync on {self.rig_number} [{self.IP}]: {self.files} files, {self.bytes/1e6:.1f} MB so far at {self.rate}{self.to_check}')
+            if self.on_row is not None:
+                self.on_row(transfer_row(self.rig, self.start, self.start_time, self.files, self.bytes, '', '', 'running'))
+
+def transfer_rig(pool, rig, source, destination, options, bwlimit, progress_interval=0, on_row=None):
+    """
+    :param on_row: optional function(row) called with every progress row and the final row
+    :return: final row (see transfer_columns)
+    """
+    rig_number, IP, access_point = rig
+    start = time.monotonic()
+    start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f'Starting rsync on {rig_number} [{IP}]{" (" + bwlimit[0] + ")" if bwlimit else ""}')
+
+    try:
+        if progress_interval > 0:
+            result = pool.rsync(IP, source, destination, options=list(options) + ['--stats', '--progress'] + bwlimit, check=False,
+                                on_output=ProgressReporter(rig, progress_interval, start, start_time, on_row))
+        else:
+            result = pool.rsync(IP, source, destination, options=list(options) + ['--stats'] + bwlimit, check=False)
+        exit_code = result.returncode
+        stdout = result.stdout.decode(errors='replace')
+        error = result.stderr.decode(errors='replace').strip().replace('\n', ' | ') if exit_code != 0 else ''
+    except Exception as e:
+        exit_code, stdout, error = -1, '', str(e)
+
+    files, size = parse_rsync_stats(stdout)
+    row = transfer_row(rig, start, start_time, files, size, exit_code, error, 'done' if exit_code == 0 else 'failed')
+    seconds, rate = row[transfer_columns.index('seconds')], row[transfer_columns.index('MB_per_s')]
+
+    if exit_code == 0:
+        print(f'Finished rsync on {rig_number} [{IP}]: {files} files, {size/1e6:.1f} MB in {seconds:.0f}s ({rate:.2f} MB/s)')
+    else:
+        print(f'rsync failed on {rig_number} [{IP}] with error: {error}')
+
+    if on_row is not None:
+        on_row(row)
+    return row
+
+class TransferLog:
+    # writes rows (transfer_columns) to a CSV as they come from the worker threads, so progress can be followed
+    # while the transfers run and nothing is lost if the script is stopped
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.lock = threading.Lock()
+        self.writer.writerow(transfer_columns)
+        self.file.flush()
+
+    def __call__(self, row):
+        with self.lock:
+            self.writer.writerow(row)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def run_transfers(pool, rigs, source, destination, options=('-av',), workers=4, total_bwlimit=0, ap_limit=0, after=None, progress_interval=0, on_row=None):
+    """
+    rsync the same source folder from many RPis concurrently.
+
+    :param pool: rigtools.ssh_pool.SSHPool used to reach the RPis
+    :param rigs: list of (rig_number, IP, access_point); access_point may be '' if unknown
+    :param workers: maximum number of rsyncs running at the same time
+    :param total_bwlimit: total bandwidth cap in MB/s shared by all rsyncs; 0 for no cap
+    :param ap_limit: maximum number of rsyncs at the same time per access point; 0 for no limit
+    :param after: optional function(rig, row) run on the same worker once a rig's rsync has finished
+    :param progress_interval: report each running rsync's progress at most every this many seconds; 0 for none
+    :param on_row: optional function(row) called with every progress row and every final row as they come, e.g. a TransferLog
+    :return: list of final rows (see transfer_columns), in the same order as rigs
+    """
+    rigs = list(rigs)
+    workers = max(1, min(workers, len(rigs))) if len(rigs) > 0 else 1
+
+    pending = list(range(len(rigs)))
+    active = set()
+    active_per_ap = {}
+    rows = [None] * len(rigs)
+    condition = threading.Condition()
+
+    def next_rig():
+        # first waiting rig whose access point has a free slot, and its bandwidth share; None once everything has been handed out
+        with condition:
+            while len(pending) > 0:
+                for k in pending:
+                    ap = rigs[k][2]
+                    if ap_limit <= 0 or ap == '' or active_per_ap.get(ap, 0) < ap_limit:
+                        pending.remove(k)
+                        active.add(k)
+                        active_per_ap[ap] = active_per_ap.get(ap, 0) + 1
+                        unfinished = [rigs[j] for j in list(active) + pending]
+                        return k, bwlimit_option(total_bwlimit, possible_concurrency(unfinished, workers, ap_limit))
+                condition.wait()
+            return None, []
+
+    def worker():
+        while True:
+            k, bwlimit = next_rig()
+            if k is None:
+                return
+            try:
+                rows[k] = transfer_rig(pool, rigs[k], source, destination, options, bwlimit, progress_interval, on_row)
+                if after is not None:
+                    after(rigs[k], rows[k])
+            finally:
+                with condition:
+                    active.discard(k)
+                    active_per_ap[rigs[k][2]] -= 1
+                    condition.notify_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return rows
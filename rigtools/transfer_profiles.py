@@ -0,0 +1,120 @@
+## rsync options picked by the type of data being transferred
+# JPEG, H.264 and MP4 are already compressed, so compressing them again on the wire (-z) gains nothing
+# and makes the RPi CPU the bottleneck; these profiles only compress what can actually shrink
+
+# Example usage
+# options = ['-avh', '--progress'] + rsync_options('media')
+#
+# Benchmark each profile against a local directory pair (or a remote source with --host):
+# python transfer_profiles.py -src /path/to/source -dst /path/to/scratch [--host user@IP] [-o results.csv]
+
+import argparse
+import csv
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+# file types that do not compress further
+media_extensions = ['jpg', 'jpeg', 'png', 'h264', 'mp4', 'mkv', 'avi', 'gz', 'zip', 'slp']
+
+profiles = {
+    # new, already-compressed files: no compression, and no delta algorithm since there is nothing to diff against
+    'media': ['--whole-file'],
+    # large already-compressed files that may be resumed with --partial: keep the delta algorithm
+    'media-resume': [],
+    # a mix of media and text/raw files: compress everything except media
+    'mixed': ['-z', f"--skip-compress={'/'.join(media_extensions)}"],
+    # the previous default for every transfer
+    'compress': ['-z'],
+    # like media, but compare file contents rather than size and modification time
+    'checksum': ['--whole-file', '--checksum'],
+}
+
+def rsync_options(profile):
+    """
+    :param profile: name of a profile in `profiles`
+    :return: list of rsync options to add to a transfer's base options (which should not include -z)
+    """
+    if profile not in profiles:
+        raise ValueError(f"Unknown transfer profile '{profile}', choose from: {', '.join(profiles)}")
+    return list(profiles[profile])
+
+def profile_for(extensions):
+    """
+    Pick a profile from the file types in a transfer.
+
+    :param extensions: list of file extensions, with or without the leading dot
+    """
+    extensions = [e.lower().lstrip('.') for e in extensions]
+    media = [e in media_extensions for e in extensions]
+    if len(media) > 0 and all(media):
+        return 'media'
+    if any(media):
+        return 'mixed'
+    return 'compress'
+
+def profile_for_folder(folder_path):
+    # profile for the files currently in a local folder
+    extensions = []
+    for root, dirs, files in os.walk(folder_path):
+        extensions += [os.path.splitext(f)[1] for f in files if os.path.splitext(f)[1] != '']
+    return profile_for(set(extensions))
+
+def folder_size(folder_path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(folder_path) for f in files)
+
+def benchmark(source, scratch, host=None, names=None):
+    """
+    Time an rsync of source into a fresh folder inside scratch for each profile.
+
+    :param host: optional user@IP; source is then a path on that host, so -z actually goes over the network
+    :return: list of [profile, seconds, MB, MB_per_s, exit_code] rows
+    """
+    names = list(profiles) if names is None else names
+    if host is None:
+        total = folder_size(source)
+
+    rows = []
+    for name in names:
+        destination = tempfile.mkdtemp(prefix=f'bench-{name}-', dir=scratch)
+        src = f'{host}:{source.rstrip("/")}/' if host is not None else f'{source.rstrip("/")}/'
+        command = ['rsync', '-a'] + rsync_options(name) + [src, destination]
+
+        start = time.monotonic()
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        seconds = time.monotonic() - start
+
+        size = folder_size(destination) if host is not None else total
+        rate = size / 1e6 / seconds if seconds > 0 else 0
+        print(f'{name:>13}: {size/1e6:.1f} MB in {seconds:.2f}s ({rate:.2f} MB/s)')
+        if result.returncode != 0:
+            print(f'\trsync failed: {result.stderr.decode(errors="replace").strip()}')
+        rows.append([name, round(seconds, 3), round(size / 1e6, 3), round(rate, 3), result.returncode])
+
+        shutil.rmtree(destination, ignore_errors=True)
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark rsync transfer profiles (MB/s per profile)')
+    parser.add_argument('-src', '--source', type=str, required=True, help='folder to transfer; a path on --host if given')
+    parser.add_argument('-dst', '--scratch', type=str, required=True, help='local folder to transfer into; emptied copies are made inside it')
+    parser.add_argument('--host', type=str, default=None, help='user@IP of an RPi to pull from, to include the network and the Pi CPU')
+    parser.add_argument('-p', '--profiles', nargs='+', default=list(profiles), choices=list(profiles), help='profiles to benchmark')
+    parser.add_argument('-o', '--output', type=str, default=None, help='optional CSV path for the results')
+    args = parser.parse_args()
+
+    os.makedirs(args.scratch, exist_ok=True)
+    if args.host is None:
+        print(f'Suggested profile for {args.source}: {profile_for_folder(args.source)}')
+        print('Note: without --host nothing goes over the network, so -z profiles only show their CPU overhead\n')
+
+    rows = benchmark(args.source, args.scratch, host=args.host, names=args.profiles)
+
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['profile', 'seconds', 'MB', 'MB_per_s', 'exit_code'])
+            writer.writerows(rows)
+        print(f'Results written to: {args.output}')
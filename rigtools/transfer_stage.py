@@ -0,0 +1,82 @@
+## Transfer -> verify -> delete stage for SBATCH transfer jobs
+# builds the bash for one rig: a single rsync pass that also records a manifest of the RPi's files,
+# a local verification of the copy against that manifest, and, only if everything verified,
+# deletion of exactly the verified files from the RPi
+# the RPi walks its data folder once, instead of once per rsync pass
+# with manifest_source='pi', the manifest the RPi kept while recording (rigtools/manifest.py) is used instead,
+# so rsync does not need to itemize and the RPi only stats files that the recording scripts did not record
+
+# Example usage
+# stage = transfer_stage_script(username='plugcamera', source='/home/plugcamera/data/', destination=f'{save_path}/raw_data',
+#                               log_dir=f'{save_path}/transfer_logs', rsync_opts=['-avh', '--whole-file'], remove_files=True)
+# shell_script_content = header + stage
+# the script must define $ip and $rig before the stage
+
+import os
+import shlex
+
+from rigtools.manifest import rsync_manifest_options, manifest_name
+
+manifest_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifest.py')
+
+def transfer_stage_script(username, source, destination, log_dir, rsync_opts, remove_files=False, fail_file='FAILED-rsync_${rig}_IP-${ip}.out', after_success='', manifest_source='rsync', check_hash=False):
+    """
+    :param source: folder on the RPi, ending in '/'
+    :param destination: local folder to copy into
+    :param log_dir: local folder for rsync logs, manifests and verified-file lists
+    :param rsync_opts: list of rsync options (without --remove-source-files)
+    :param remove_files: delete verified files (and then empty folders) from the RPi
+    :param fail_file: file written if the transfer or verification fails
+    :param after_success: extra bash run only if everything verified (e.g. shutting the RPi down)
+    :param manifest_source: 'rsync' to build the manifest from the transfer's own output, 'pi' to use the RPi's recorded manifest
+    :param check_hash: also compare xxh64 hashes recorded in an RPi manifest (needs xxhash on the cluster)
+    """
+    if manifest_source not in ['rsync', 'pi']:
+        raise ValueError(f"manifest_source must be 'rsync' or 'pi', not '{manifest_source}'")
+
+    source_dir = source.rstrip('/')
+    remove = 'True' if remove_files else 'False'
+    hash_option = ' --hash' if check_hash else ''
+
+    if manifest_source == 'rsync':
+        rsync_opts = ' '.join(list(rsync_opts) + [shlex.quote(option) for option in rsync_manifest_options])
+        manifest_step = f'''# single transfer pass; the itemized output doubles as a manifest of every file on the RPi
+rsync {rsync_opts} --progress {username}@$ip:{source} "{destination}/" | tee "$rsync_log"
+s1=${{PIPESTATUS[0]}}
+python3 {manifest_script} from-rsync -i "$rsync_log" -o "$manifest"
+s0=$?'''
+        prune_step = ''
+    else:
+        rsync_opts = ' '.join(list(rsync_opts) + [f'--exclude={manifest_name}', f'--exclude={manifest_name}.tmp'])
+        manifest_step = f'''# manifest recorded on the RPi; files it does not list yet are added with a local stat on the RPi
+ssh {username}@$ip "python3 - update {source_dir}" < {manifest_script} > "$manifest"
+s0=$?
+
+rsync {rsync_opts} --progress {username}@$ip:{source} "{destination}/" | tee "$rsync_log"
+s1=${{PIPESTATUS[0]}}'''
+        prune_step = f'''
+    ssh {username}@$ip "python3 - prune {source_dir}" < {manifest_script}'''
+
+    return f'''
+mkdir -p "{log_dir}" "{destination}"
+rsync_log="{log_dir}/${{rig}}_rsync.log"
+manifest="{log_dir}/${{rig}}_manifest.tsv"
+verified="{log_dir}/${{rig}}_verified.txt"
+
+{manifest_step}
+
+python3 {manifest_script} verify -m "$manifest" -r "{destination}" -v "$verified"{hash_option}
+s2=$?
+
+if [ $s0 -ne 0 ] || [ $s1 -ne 0 ] || [ $s2 -ne 0 ]; then
+    echo "Rsync/verify failed for IP: $ip (manifest=$s0 transfer=$s1 verify=$s2), no files removed" > "{fail_file}"
+    exit 1
+fi
+
+# only files that verified locally are removed from the RPi
+if [ "{remove}" = "True" ]; then
+    ssh {username}@$ip "cd {source_dir} && xargs -0 -r rm -f --" < "$verified"{prune_step}
+    ssh {username}@$ip "find {source_dir}/ -mindepth 1 -type d -empty -delete"
+fi
+{after_success}
+'''
@@ -0,0 +1,157 @@
+## Unwrapping rotating-vial videos into a flat image of the vial surface
+# frames are decoded as a stream: only the frames that are kept are retrieved, decoding stops at stop_frame,
+# and each frame is cropped to its centre strip as soon as it is decoded, so memory stays bounded by one frame
+
+# the strips are then placed side by side at fixed offsets (a Fiji TileConfiguration.txt layout, or an even grid)
+# and linearly blended where they overlap, in NumPy, replacing Fiji's Grid/Collection stitching plugin
+
+# Example usage
+# for index, strip in iter_strips(video_path, interval=5):
+#     ...
+# paths = extract_frames(video_path, interval=5, save_path=video_path)
+# panorama = stitch_strips([cv2.imread(path) for path in paths], read_tile_configuration('TileConfiguration.txt'))
+
+import os
+
+import cv2
+import numpy as np
+
+# overlap between neighbouring strips (%), as given to the Fiji stitcher
+tile_overlap = 86
+
+# width of the unwrapped image; heuristically defined by looking at uncropped images
+panorama_width = 1045
+
+def iter_frames(video_path, interval=1, stop_frame=250, seek=False):
+    """
+    Yield (frame index, frame) for every 'interval'-th frame up to and including stop_frame.
+
+    Skipped frames are only grabbed (decoded without being converted or copied into Python).
+
+    :param seek: jump straight to each kept frame with CAP_PROP_POS_FRAMES instead of grabbing the frames in between;
+                 only worth it for large intervals, and only frame-accurate for containers with a frame index (e.g. .mp4)
+    """
+    vidcap = cv2.VideoCapture(video_path)
+    try:
+        count = 0
+        while count <= stop_frame:
+            if seek and count > 0:
+                vidcap.set(cv2.CAP_PROP_POS_FRAMES, count)
+
+            success, image = vidcap.read()
+            if not success:
+                break
+            yield count, image
+
+            if not seek:
+                # grab the frames up to the next kept frame
+                for _ in range(interval - 1):
+                    if not vidcap.grab():
+                        return
+            count += interval
+    finally:
+        vidcap.release()
+
+def iter_strips(video_path, interval=1, crop=(525, 675), stop_frame=250, seek=False):
+    """
+    Yield (strip index, strip) with each kept frame cropped to columns crop[0]:crop[1].
+
+    The strip is copied out of the frame, so the full frame can be freed before the next one is decoded.
+    """
+    for i, (_, frame) in enumerate(iter_frames(video_path, interval, stop_frame, seek)):
+        yield i, frame[:, crop[0]:crop[1]].copy()
+
+# extract frames from video and crop centre 150 pixels
+def extract_frames(video_path, interval=1, save_path='', crop=(525, 675), stop_frame=250, seek=False):
+    """
+    Extract frames from a video, writing each cropped strip to {save_path}/sequence/NNN.jpg as it is decoded.
+
+    :param video_path: Path to the video file.
+    :param interval: Interval of frames to extract (1 = every frame, 2 = every other frame, etc.)
+    :return: paths of the written strips
+    """
+    os.makedirs(f'{save_path}/sequence/', exist_ok=True)
+
+    paths = []
+    for i, strip in iter_strips(video_path, interval, crop, stop_frame, seek):
+        path = f'{save_path}/sequence/{str(i).zfill(3)}.jpg'
+        cv2.imwrite(path, strip)
+        paths.append(path)
+
+    return paths
+
+def grid_offsets(count, strip_width, overlap=tile_overlap):
+    # (x, y) of each strip for a single row of strips with a fixed overlap
+    step = strip_width * (1 - overlap / 100)
+    return [(i * step, 0.0) for i in range(count)]
+
+def read_tile_configuration(path):
+    """
+    Read strip offsets from a Fiji TileConfiguration.txt (lines such as '000.jpg; ; (21.3, -0.4)').
+
+    :return: list of (x, y), in the order of the file
+    """
+    offsets = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#') or ';' not in line:
+                continue
+            coordinates = line.split(';')[-1].strip().strip('()')
+            x, y = coordinates.split(',')[:2]
+            offsets.append((float(x), float(y)))
+    return offsets
+
+def write_tile_configuration(offsets, path):
+    # same format as Fiji, so layouts can still be inspected or reused there
+    with open(path, 'w') as f:
+        f.write('# Define the number of dimensions we are working on\ndim = 2\n\n# Define the image coordinates\n')
+        for i, (x, y) in enumerate(offsets):
+            f.write(f'{str(i).zfill(3)}.jpg; ; ({x}, {y})\n')
+
+def blend_weights(height, width):
+    # linear blending: each pixel is weighted by its distance to the nearest edge of its strip
+    ramp_y = np.minimum(np.arange(height), np.arange(height)[::-1]) + 1
+    ramp_x = np.minimum(np.arange(width), np.arange(width)[::-1]) + 1
+    return np.outer(ramp_y, ramp_x).astype(np.float32)
+
+def stitch_strips(strips, offsets, width=panorama_width):
+    """
+    Place strips at their offsets and blend the overlaps linearly.
+
+    Offsets are rounded to whole pixels and shifted so the smallest is (0, 0).
+
+    :param strips: list of equally sized HxW or HxWx3 uint8 arrays (channel order is kept, so OpenCV strips stay BGR)
+    :param offsets: list of (x, y), one per strip
+    :param width: crop the panorama to this width from the left (None keeps the full width)
+    :return: the panorama as a uint8 array
+    """
+    if len(strips) == 0:
+        raise ValueError('no strips to stitch')
+    if len(offsets) < len(strips):
+        raise ValueError(f'{len(strips)} strips but only {len(offsets)} offsets')
+
+    offsets = np.round(np.asarray(offsets[:len(strips)], dtype=np.float64)).astype(int)
+    offsets -= offsets.min(axis=0)
+
+    height, strip_width = strips[0].shape[:2]
+    channels = strips[0].shape[2:]
+    canvas_height = height + offsets[:, 1].max()
+    canvas_width = strip_width + offsets[:, 0].max()
+
+    weights = blend_weights(height, strip_width)
+    total = np.zeros((canvas_height, canvas_width) + channels, dtype=np.float32)
+    weight_sum = np.zeros((canvas_height, canvas_width), dtype=np.float32)
+
+    strip_weights = weights if len(channels) == 0 else weights[:, :, None]
+    for strip, (x, y) in zip(strips, offsets):
+        total[y:y + height, x:x + strip_width] += strip * strip_weights
+        weight_sum[y:y + height, x:x + strip_width] += weights
+
+    weight_sum[weight_sum == 0] = 1
+    panorama = total / (weight_sum if len(channels) == 0 else weight_sum[:, :, None])
+    panorama = np.clip(np.round(panorama), 0, 255).astype(np.uint8)
+
+    if width is not None:
+        panorama = panorama[:, :width]
+    return panorama
@@ -0,0 +1,36 @@
+## Single-pass ffmpeg conversions
+# each video is decoded once and every output is written directly from that decode,
+# with no intermediate files on shared storage
+
+# Example usage
+# subprocess.run(h264_to_mp4_command(f'{path}.h264', f'{path}_{condition}.mp4', f'{path}_{condition}_1fps_24fps-playback.mp4'), shell=True)
+
+def quote(path):
+    # double quotes, so bash variables such as ${file} still expand inside SBATCH templates
+    return f'"{path}"'
+
+def h264_to_mp4_command(input_path, remux_path, playback_path, sample_fps=1, playback_fps=24, crf=18):
+    """
+    ffmpeg command producing, from one read of a raw .h264 file:
+     - remux_path: the full-rate video copied into an .mp4 container (no re-encode)
+     - playback_path: one frame every 1/sample_fps seconds, re-encoded and played back at playback_fps
+
+    This replaces remux -> 1 fps re-encode -> setpts re-encode, which decoded each video twice and
+    wrote three files. Every frame is still decoded (once): the fps filter drops frames after decoding,
+    so only the encoder's work shrinks to the sampled frames.
+    """
+    return (
+        f'ffmpeg -y -i {quote(input_path)} '
+        f'-map 0:v -c:v copy {quote(remux_path)} '
+        f'-map 0:v -vf "fps={sample_fps},setpts=N/({playback_fps}*TB)" -r {playback_fps} '
+        f'-c:v libx264 -preset slow -crf {crf} -pix_fmt yuv420p {quote(playback_path)}'
+    )
+
+def jpgs_to_mp4_command(directory_path, output_path, framerate=7, crop=None):
+    """
+    ffmpeg command encoding a folder of JPEGs into an .mp4, cropping in the same pass.
+
+    :param crop: optional ffmpeg crop string 'w:h:x:y'
+    """
+    crop_filter = f"-filter:v 'crop={crop}' " if crop is not None else ''
+    return f"ffmpeg -y -framerate {framerate} -pattern_type glob -i '{directory_path}/*.jpg' {crop_filter}-c:v libx264 -pix_fmt yuv420p {quote(output_path)}"
@@ -6,22 +6,26 @@
 # Usage: sbatch --export=MODEL="sideview",JOB="pcd" sleap-track_batch.sh
 # optional parameters: sbatch --export=MODEL="sideview",JOB='ptcd',TRACK="False",FRAMES="0-10" sleap-track_batch.sh
 # for JOB, p = predict with SLEAP, t = track with SLEAP, c = convert .slp to .feather, and d = DSCAN clustering
+# TRANSFER_JOB is passed to sideview_transfer-data.py -j (default p: transfer and convert each rig as its own pipeline)
 
 # *** MAKE SURE TO USE A REMOTELY-TRAINED MODEL!!!! ***
 # we have experienced issues with locally trained models running remotely...
 
-#SBATCH --job-name=slp-master
+# this driver only orchestrates: the transfer and conversion run as their own SLURM jobs, which it waits on with
+# sbatch --wait, and the SLEAP stage (sideview_sbatch-sleap.sh) is submitted with its own large allocation
+# once they are done, so nothing sits on 400 GB while waiting
+#SBATCH --job-name=sv-pipeline
 #SBATCH --ntasks=1
-#SBATCH --cpus-per-task=32
+#SBATCH --cpus-per-task=2
 #SBATCH --partition=ncpu
-#SBATCH --mem=400G
+#SBATCH --mem=8G
 #SBATCH --time=48:00:00
 #SBATCH --mail-user=$(whoami)@crick.ac.uk
 #SBATCH --mail-type=FAIL
 
 ml purge
 ml Anaconda3/2023.09-0
-ml FFmpeg/6.0-GCCcore-12.3.0
+ml FFmpeg/6.0-GCCcore-12.3.0 # inherited by the conversion jobs, which run with this environment
 source /camp/apps/eb/software/Anaconda/conda.env.sh
 
 conda activate pyimagej-env
@@ -29,11 +33,14 @@ conda activate pyimagej-env
 ##### STEP 1: TRANSFER DATA AND CONVERT TO MP4 #######
 ######################################################
 
+# Set TRANSFER_JOB to p if not entered by user; only modes that run as SLURM jobs suit this small driver (t, a, p)
+: ${TRANSFER_JOB:='p'}
+
 # Convert RIG_NUMBERS into an array
 IFS=' ' read -r -a rig_numbers_array <<< "$RIGS"
 
 # Construct the python command
-python_cmd="python -u sideview_transfer-data.py -ip inventory.csv -e "$EXP" -c "$CON" -l "${rig_numbers_array[@]}""
+python_cmd="python -u sideview_transfer-data.py -j "$TRANSFER_JOB" -ip inventory.csv -e "$EXP" -c "$CON" -l "${rig_numbers_array[@]}""
 if [ "$REMOVE" = "True" ]; then
     python_cmd="$python_cmd -r"
 fi
@@ -46,28 +53,5 @@ eval $python_cmd > python-output_"$BASENAME".log 2>&1
 
 ##### STEP 2: SLEAP PREDICTIONS, FEATHER CONVERSION, DBSCAN CLUSTERING #######
 ##############################################################################
-conda deactivate
-conda activate /camp/lab/windingm/home/shared/conda-envs/sleap #use shared conda env on NEMO
-
-# directory with mp4s within
-DIR="/camp/lab/windingm/data/instruments/behavioural_rigs/${MODEL}/${EXP}"
-
-# Set TRACK to True if not entered by user
-: ${TRACK:='True'}
-
-# Set FRAMES to all if not entered by user
-: ${FRAMES:='all'}
-
-# Set JOB to ptc if not entered by user; p = predict, t = track, c = convert to feather output
-: ${JOB:='ptc'}
-
-echo "model type: $MODEL"
-echo "videos directory path: $DIR"
-echo "jobs, p=prediction, t=track, c=convert to feather: $JOB"
-echo "frames: $FRAMES"
-
-# run python script
-# save output to log file in case there is an issue
-# adding -u makes sure the python_output.log is dynamically written to
-cmd="python -u /camp/lab/windingm/home/shared/Crick-HPC-files/sbatch-files/sleap-track_batch.py -m "$MODEL" -p "$DIR" -j "$JOB" -f "$FRAMES"" 
-eval $cmd > python_output.log 2>&1
\ No newline at end of file
+# its own job with its own allocation; EXP, MODEL, JOB, TRACK and FRAMES are passed on
+sbatch --export=ALL sideview_sbatch-sleap.sh
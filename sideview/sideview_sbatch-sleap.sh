@@ -0,0 +1,51 @@
+#!/bin/bash
+
+# step 2 of sideview_pipeline.sh, submitted by it once the transfer and mp4 conversion are done,
+# so only this stage holds the large allocation
+# can also be run on its own:
+# sbatch --export=EXP=Michael/2024-11-21_test-exp,MODEL="sideview",JOB="ptc" sideview_sbatch-sleap.sh
+# optional parameters: sbatch --export=EXP=...,MODEL="sideview",JOB='ptcd',TRACK="False",FRAMES="0-10" sideview_sbatch-sleap.sh
+# for JOB, p = predict with SLEAP, t = track with SLEAP, c = convert .slp to .feather, and d = DSCAN clustering
+
+# *** MAKE SURE TO USE A REMOTELY-TRAINED MODEL!!!! ***
+# we have experienced issues with locally trained models running remotely...
+
+#SBATCH --job-name=slp-master
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=32
+#SBATCH --partition=ncpu
+#SBATCH --mem=400G
+#SBATCH --time=48:00:00
+#SBATCH --mail-user=$(whoami)@crick.ac.uk
+#SBATCH --mail-type=FAIL
+
+##### STEP 2: SLEAP PREDICTIONS, FEATHER CONVERSION, DBSCAN CLUSTERING #######
+##############################################################################
+ml purge
+ml Anaconda3/2023.09-0
+source /camp/apps/eb/software/Anaconda/conda.env.sh
+
+conda activate /camp/lab/windingm/home/shared/conda-envs/sleap #use shared conda env on NEMO
+
+# directory with mp4s within
+DIR="/camp/lab/windingm/data/instruments/behavioural_rigs/${MODEL}/${EXP}"
+
+# Set TRACK to True if not entered by user
+: ${TRACK:='True'}
+
+# Set FRAMES to all if not entered by user
+: ${FRAMES:='all'}
+
+# Set JOB to ptc if not entered by user; p = predict, t = track, c = convert to feather output
+: ${JOB:='ptc'}
+
+echo "model type: $MODEL"
+echo "videos directory path: $DIR"
+echo "jobs, p=prediction, t=track, c=convert to feather: $JOB"
+echo "frames: $FRAMES"
+
+# run python script
+# save output to log file in case there is an issue
+# adding -u makes sure the python_output.log is dynamically written to
+cmd="python -u /camp/lab/windingm/home/shared/Crick-HPC-files/sbatch-files/sleap-track_batch.py -m "$MODEL" -p "$DIR" -j "$JOB" -f "$FRAMES""
+eval $cmd > python_output.log 2>&1
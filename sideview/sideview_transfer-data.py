@@ -4,13 +4,23 @@ import pandas as pd
 from datetime import datetime
 import os
 import argparse
-import time
-import tempfile
+import sys
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rigtools.transfer_profiles import rsync_options, profiles
+from rigtools.transfer_stage import transfer_stage_script
+from rigtools.video_convert import h264_to_mp4_command
+from rigtools.slurm import run_job, failed_tasks
+from rigtools.dag import DAG
+from rigtools.stage_state import StageState
 
 # default argument values
 username = 'sideview'
 ip_path = 'inventory.csv'
 remove_files = False
+check_hash = False
+transfer_profile = 'media-resume' # long .h264 files do not compress further and may be resumed with --partial
 
 # pulling user-input variables from command line
 parser = argparse.ArgumentParser(description='rsync transfer to NEMO and mp4 conversion for sideview rigs')
@@ -20,7 +30,9 @@ parser.add_argument('-c', '--condition', type=str, required=True, help='name of
 parser.add_argument('-l', '--list-of-rig-names', nargs='+', type=int, default=[], help='list of rig names')
 parser.add_argument('-u', '--username', type=str, default=username, help='username for SSH attempts')
 parser.add_argument('-r', '--remove-files', action='store_true', help='whether to remove files from RPi source')
-parser.add_argument('-j', '--job', dest='job', action='store', type=str, default=None, help='t=transfer, c=convert to mp4')
+parser.add_argument('-tp', '--transfer-profile', type=str, default=transfer_profile, choices=list(profiles), help='rsync compression/checksum profile')
+parser.add_argument('--hash', dest='check_hash', action='store_true', help='also verify xxh64 hashes recorded in the RPi manifest (needs xxhash)')
+parser.add_argument('-j', '--job', dest='job', action='store', type=str, default=None, help='t=transfer, c=convert to mp4, a=convert to mp4 as an array job, p=transfer and convert each rig as its own pipeline')
 #parser.add_argument('-s', '--slurm-command', type=str, help='whether to remove files from RPi source')
 
 # ingesting user-input arguments
@@ -36,6 +48,8 @@ job = args.job
 #slurm_command = args.slurm_command
 
 remove_files = args.remove_files
+transfer_profile = args.transfer_profile
+check_hash = args.check_hash
 
 # change whether the input path is acceptable
 if '/' not in experiment_name:
@@ -66,55 +80,35 @@ if(len(list_names)>0):
 if not os.path.exists(save_path):
     os.makedirs(save_path, exist_ok=True)
 
-# Function to check if the array job is completed
-def is_job_array_completed(job_id):
-    cmd = ["sacct", "-j", f"{job_id}", "--format=JobID,State", "--noheader"]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
-    lines = result.stdout.strip().split('\n')
-
-    # Initialize flags
-    all_completed = True
-
-    for line in lines:
-        parts = line.split()
-        if len(parts) < 2:
-            continue  # Skip any malformed lines
-
-        # Extract and ignore array job steps (e.g., "12345678_1") for simplicity
-        job_id_part, job_state = parts[0], parts[1]
-        if "_" in job_id_part and not job_id_part.endswith("batch"):  # Focus on array tasks excluding batch job steps
-            if job_state not in ["COMPLETED", "FAILED", "CANCELLED"]:
-                all_completed = False
-                break
-
-    return all_completed
-
 #########################
 #### TRANSFER DATA ######
 # transfer raw data from RPis to NEMO
 
-start_transfer = datetime.now()
-
-if 't' in job:
-    print(f'Running rsync on {len(IPs)} IPs, {IPs}') 
-    IPs_string = ' '.join(IPs)
-    rig_num_str = [f'sv{x}' for x in rig_num]
-    rigs_string = ' '.join(rig_num_str)
-
-    # remove source files from RPi or not, is a user-input parameter
-    if remove_files==True: remove_files_option = '--remove-source-files '  
-    if remove_files==False: remove_files_option = '' 
+log_dir = f'{save_path}/transfer_logs'
+rig_num_str = [f'sv{x}' for x in rig_num]
+
+# one rsync pass per rig, verified locally against the manifest the RPi kept while recording
+# (no second rsync scan of the RPi); only verified files are removed, and the RPi is only shut down if everything verified
+transfer_stage = transfer_stage_script(
+    username=username,
+    source=f'/home/{username}/data/',
+    destination=save_path,
+    log_dir=log_dir,
+    rsync_opts=['-rlht', '-O', '--no-perms', '--no-owner', '--no-group', '--delay-updates', '--partial'] + rsync_options(transfer_profile),
+    remove_files=remove_files,
+    fail_file=f'FAILED-rsync_{experiment_name_base}_${{rig}}_IP-${{ip}}.out',
+    after_success=f'ssh {username}@$ip "sudo shutdown -h now"',
+    manifest_source='pi',
+    check_hash=check_hash,
+)
 
-    print('\nremove_files variable:')
-    print(remove_files_option)
-    print('\n')
+def transfer_job_script(ips, rigs):
+    # SBATCH script for the transfer stage; an array job with one task per rig when there are several rigs
+    ips_string = ' '.join(ips)
+    rigs_string = ' '.join(rigs)
 
-    if len(IPs) == 0:
-        print("No IP addresses found. Check your inventory.csv or filtering logic.")
-        exit(1)
-
-    if len(IPs) == 1:
-        shell_script_content = f'''#!/bin/bash
+    if len(ips) == 1:
+        return f'''#!/bin/bash
 #SBATCH --job-name=rsync_pis
 #SBATCH --ntasks=1
 #SBATCH --cpus-per-task=16
@@ -123,7 +117,7 @@ if 't' in job:
 #SBATCH --time=20:00:00
 
 # Single IP setup
-IFS=' ' read -r -a ip_array <<< "{IPs_string}"
+IFS=' ' read -r -a ip_array <<< "{ips_string}"
 IFS=' ' read -r -a rig_array <<< "{rigs_string}"
 
 # Directly assign the single IP and rig
@@ -133,42 +127,20 @@ rig="${{rig_array[0]}}"
 echo "Job started at: $(date)"
 echo "Using IP: $ip and Rig: $rig"
 
-rsync -rlhzt -O --progress --no-perms --no-owner --no-group --delay-updates --partial \
-  {username}@$ip:/home/{username}/data/ "{save_path}/"
-s1=$?
-
-verify_out=$(rsync -rlhzt -O --dry-run --itemize-changes --out-format="%i %n%L" --no-perms --no-owner --no-group \
-  {username}@$ip:/home/{username}/data/ "{save_path}/"
-)
-s2=$?
-
-if [ $s1 -ne 0 ] || [ $s2 -ne 0 ] || [ -n "$verify_out" ]; then
-    echo "Rsync/verify failed for IP: $ip (transfer=$s1 verify=$s2) — NOT shutting down" \
-      > "FAILED-rsync_{experiment_name_base}_${{rig}}_IP-${{ip}}.out"
-    exit 1
-fi
-
-if [ "{remove_files}" = "True" ]; then
-    ssh {username}@$ip "find data/ -type f -mindepth 1 -delete"
-    ssh {username}@$ip "find data/ -mindepth 1 -type d -empty -delete"
-fi
-
-ssh {username}@$ip "sudo shutdown -h now"
+{transfer_stage}
         '''
 
-
-    elif len(IPs) > 1:
-        shell_script_content = f'''#!/bin/bash
+    return f'''#!/bin/bash
 #SBATCH --job-name=rsync_pis
 #SBATCH --ntasks=1
 #SBATCH --cpus-per-task=16
 #SBATCH --partition=ncpu
 #SBATCH --mem=120G
 #SBATCH --time=20:00:00
-#SBATCH --array=1-{len(IPs)}
+#SBATCH --array=1-{len(ips)}
 
 # Multiple IP setup
-IFS=' ' read -r -a ip_array <<< "{IPs_string}"
+IFS=' ' read -r -a ip_array <<< "{ips_string}"
 IFS=' ' read -r -a rig_array <<< "{rigs_string}"
 
 # Get the IP and rig for the current task ID
@@ -178,64 +150,144 @@ rig="${{rig_array[$SLURM_ARRAY_TASK_ID-1]}}"
 echo "Job started at: $(date)"
 echo "Using IP: $ip and Rig: $rig"
 
-rsync -rlhzt -O --progress --no-perms --no-owner --no-group --delay-updates --partial \
-  {username}@$ip:/home/{username}/data/ "{save_path}/"
-s1=$?
+{transfer_stage}
+        '''
 
-verify_out=$(rsync -rlhzt -O --dry-run --itemize-changes --out-format="%i %n%L" --no-perms --no-owner --no-group \
-  {username}@$ip:/home/{username}/data/ "{save_path}/"
-)
-s2=$?
+def convert_job_script(h264_files):
+    # SBATCH array job converting each .h264 (given without its extension) to mp4s
+    h264_files_string = '\n'.join(h264_files)
+    convert_command = h264_to_mp4_command('${file}.h264', f'${{file}}_{condition}.mp4', f'${{file}}_{condition}_1fps_24fps-playback.mp4')
+
+    # Array job script for processing each .h264 file
+    return f"""#!/bin/bash
+#SBATCH --job-name=sv_process
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=32
+#SBATCH --array=1-{len(h264_files)}
+#SBATCH --partition=ncpu
+#SBATCH --mem=120G
+#SBATCH --time=10:00:00
 
-if [ $s1 -ne 0 ] || [ $s2 -ne 0 ] || [ -n "$verify_out" ]; then
-    echo "Rsync/verify failed for IP: $ip (transfer=$s1 verify=$s2) — NOT shutting down" \
-      > "FAILED-rsync_{experiment_name_base}_${{rig}}_IP-${{ip}}.out"
-    exit 1
-fi
+# Convert h264_files_string to an array
+IFS=$'\n' read -r -a files <<< "$(echo "{h264_files_string}" | tr ' ' '\n')"
 
-if [ "{remove_files}" = "True" ]; then
-    ssh {username}@$ip "find data/ -type f -mindepth 1 -delete"
-    ssh {username}@$ip "find data/ -mindepth 1 -type d -empty -delete"
-fi
+# Debugging info
+echo 'SLURM_ARRAY_TASK_ID: $SLURM_ARRAY_TASK_ID'
+echo 'Files array: ${{files[@]}}'
 
-ssh {username}@$ip "sudo shutdown -h now"
-        '''
+# Assign file based on task ID
+file="${{files[$SLURM_ARRAY_TASK_ID-1]}}"
+echo "Processing file: $file"
 
-    # Create a temporary file to hold the SBATCH script
-    with tempfile.NamedTemporaryFile(mode="w", delete=False) as tmp_script:
-        tmp_script.write(shell_script_content)
-        tmp_script_path = tmp_script.name
+# convert .h264 to .mp4, and to 1fps with 24fps playback, in a single ffmpeg pass
+convert_mp4='{convert_command}'
 
-    # Submit the SBATCH script
-    process = subprocess.run(["sbatch", tmp_script_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+# Execute commands with error checks
+eval "$convert_mp4" || {{ echo "Failed at convert_mp4"; exit 1; }}
+rm "${{file}}.h264" || {{ echo "Failed at remove_h264"; exit 1; }}
 
-    # Optionally, delete the temporary file after submission
-    os.unlink(tmp_script_path)
+echo "Finished processing file: $file"
+    """
 
-    # Check the result and extract job ID from the output
-    if process.returncode == 0:
-        job_id_output = process.stdout.strip()
-        print(job_id_output)
+# files converted by an earlier run, whose outputs are unchanged since, are skipped on a rerun
+convert_state = StageState(f'{save_path}/.stage_state', 'convert_mp4')
 
-        job_id = job_id_output.split()[-1]
+def convert_outputs(file):
+    return [f'{file}_{condition}.mp4', f'{file}_{condition}_1fps_24fps-playback.mp4']
 
-        print(process.stdout)
-    else:
-        print("Failed to submit job")
-        print(process.stderr)
+def convert_h264_files(h264_files):
+    """
+    Convert .h264 files (given without their extension) with an array job, skipping files already converted.
+
+    :return: files whose conversion did not complete
+    """
+    todo = []
+    for file in h264_files:
+        if convert_state.is_done(file, [f'{file}.h264'], convert_outputs(file)):
+            # converted before, only removing the .h264 did not happen
+            os.remove(f'{file}.h264')
+        else:
+            todo.append(file)
+
+    if len(todo) < len(h264_files):
+        print(f'{len(h264_files) - len(todo)} files were already converted, skipping them')
+    if len(todo) == 0:
+        return []
+
+    # the job removes each .h264 once converted, so its fingerprint is taken now, while it is still there
+    inputs = {file: convert_state.fingerprints([f'{file}.h264']) for file in todo}
+
+    process_script_content = convert_job_script(todo)
+
+    print('sh file:')
+    print(process_script_content)
+
+    # submit and block until every array task has finished (sbatch --wait, no polling)
+    process_job_id, process_states = run_job(process_script_content)
+
+    # array task n converted todo[n-1]
+    failed = []
+    for i, file in enumerate(todo):
+        if process_states.get(f'{process_job_id}_{i + 1}') == 'COMPLETED':
+            convert_state.mark_done(file, inputs[file], convert_outputs(file))
+        else:
+            failed.append(file)
+    return failed
+
+start_transfer = datetime.now()
+
+if 't' in job:
+    print(f'Running rsync on {len(IPs)} IPs, {IPs}') 
+    print(f'\nremove_files variable: {remove_files}\n')
+
+    if len(IPs) == 0:
+        print("No IP addresses found. Check your inventory.csv or filtering logic.")
         exit(1)
 
-    seconds = 60
-    print(f"Wait for {seconds} seconds before checking if array job has completed")
-    time.sleep(seconds)
+    shell_script_content = transfer_job_script(IPs, rig_num_str)
 
-    # Wait for the array job to complete
-    print(f"Waiting for array job {job_id} to complete...")
-    while not is_job_array_completed(job_id):
-        print(f"Array job {job_id} is still running. Waiting...")
-        time.sleep(30)  # Check every 30 seconds
+    # submit and block until every array task has finished (sbatch --wait, no polling)
+    job_id, states = run_job(shell_script_content)
+    failed = failed_tasks(states)
+    if len(failed) > 0:
+        print(f'Transfer tasks that did not complete: {failed}')
 
-    print(f"Array job {job_id} has completed.\n")
+if 'p' in job: # per-rig pipeline
+    # each rig is its own branch: its .h264 files are converted as soon as its own transfer has verified,
+    # without waiting for the slowest rig; a failed transfer only skips that rig's conversion
+    if len(IPs) == 0:
+        print("No IP addresses found. Check your inventory.csv or filtering logic.")
+        exit(1)
+
+    def transfer_rig(ip, rig):
+        job_id, states = run_job(transfer_job_script([ip], [rig]))
+        if len(failed_tasks(states)) > 0:
+            raise RuntimeError(f'transfer job {job_id} did not complete: {states}')
+
+    def convert_rig(rig):
+        # the files this rig's transfer verified (NUL-separated, relative to save_path)
+        with open(f'{log_dir}/{rig}_verified.txt') as f:
+            verified = [path for path in f.read().split('\0') if path.endswith('.h264')]
+        h264_files = [f"{save_path}/{path[:-len('.h264')]}" for path in verified]
+        if len(h264_files) == 0:
+            print(f'No .h264 files transferred from {rig}')
+            return 0
+
+        failed = convert_h264_files(h264_files)
+        if len(failed) > 0:
+            raise RuntimeError(f'conversion did not complete for {failed}')
+        return len(h264_files)
+
+    dag = DAG()
+    for ip, rig in zip(IPs, rig_num_str):
+        verified = f'{log_dir}/{rig}_verified.txt'
+        dag.add(f'transfer_{rig}', partial(transfer_rig, ip, rig), outputs=[verified])
+        dag.add(f'convert_{rig}', partial(convert_rig, rig), inputs=[verified])
+
+    results = dag.run(workers=2 * len(IPs))
+    not_done = [name for name, result in results.items() if result.status != 'done']
+    if len(not_done) > 0:
+        print(f'Stages that did not complete: {not_done}')
     
 end_transfer = datetime.now()
 
@@ -260,25 +312,24 @@ if 'c' in job:
         
         return contents
 
-    # generate and crop mp4 videos for each directory
+    # generate mp4 videos for each .h264
     def run_commands_in_directory(path):
-        # Define the commands
-
-        # convert .h264 to .mp4
-        # convert .h264 to .mp4 1fps, 30fps playback
+        # convert .h264 to .mp4, and to 1fps with 24fps playback, in a single ffmpeg pass
+        convert_mp4 = h264_to_mp4_command(f'{path}.h264', f'{path}_{condition}.mp4', f'{path}_{condition}_1fps_24fps-playback.mp4')
 
-        convert_mp4 = f'ffmpeg -i "{path}.h264" -c:v copy -c:a copy {path}_{condition}.mp4'
-        convert_mp4_1fps = f'ffmpeg -i {path}_{condition}.mp4 -vf "fps=1" -c:v libx264 -preset slow -crf 18 -pix_fmt yuv420p -c:a copy {path}_{condition}_1fps.mp4'
-        convert_mp4_30fps_playback = f'ffmpeg -i {path}_{condition}_1fps.mp4 -filter:v "setpts=PTS/24" -r 24 {path}_{condition}_1fps_24fps-playback.mp4'
-        remove_h264 = f'rm {path}.h264'
-        remove_mp4 = f'rm {path}_{condition}_1fps.mp4'
+        if convert_state.is_done(path, [f'{path}.h264'], convert_outputs(path)):
+            print(f'Already converted: {path}.h264')
+            os.remove(f'{path}.h264')
+            return
 
-        # Run the commands using subprocess
-        subprocess.run(convert_mp4, shell=True)
-        subprocess.run(convert_mp4_1fps, shell=True)
-        subprocess.run(convert_mp4_30fps_playback, shell=True)
-        subprocess.run(remove_h264, shell=True)
-        subprocess.run(remove_mp4, shell=True)
+        # only remove the .h264 once both outputs were written
+        inputs = convert_state.fingerprints([f'{path}.h264'])
+        result = subprocess.run(convert_mp4, shell=True)
+        if result.returncode == 0:
+            convert_state.mark_done(path, inputs, convert_outputs(path))
+            os.remove(f'{path}.h264')
+        else:
+            print(f'Conversion failed for {path}.h264, keeping it')
 
     # Path to the parent directory with the folders you want to list
     directory_contents = list_directory_contents(save_path)
@@ -318,89 +369,15 @@ if 'a' in job: # array-job transfer
     directory_contents = list_directory_contents(save_path)
 
     h264_files = [f"{save_path}/{file.replace('.h264', '')}" for file in directory_contents if file.endswith('.h264')]
-    h264_files_string = '\n'.join(h264_files)
-
     if len(h264_files) == 0:
         print("No .h264 files found in the directory. Ensure the save_path is correct and contains files.")
         exit(1)
 
-    print(f'Running array job for mp4 conversion on:\n {h264_files_string}')
-
-    # Array job script for processing each .h264 file
-    process_script_content = f"""#!/bin/bash
-#SBATCH --job-name=sv_process
-#SBATCH --ntasks=1
-#SBATCH --cpus-per-task=32
-#SBATCH --array=1-{len(h264_files)}
-#SBATCH --partition=ncpu
-#SBATCH --mem=120G
-#SBATCH --time=10:00:00
-
-# Convert h264_files_string to an array
-IFS=$'\n' read -r -a files <<< "$(echo "{h264_files_string}" | tr ' ' '\n')"
-
-# Debugging info
-echo 'SLURM_ARRAY_TASK_ID: $SLURM_ARRAY_TASK_ID'
-echo 'Files array: ${{files[@]}}'
-
-# Assign file based on task ID
-file="${{files[$SLURM_ARRAY_TASK_ID-1]}}"
-echo "Processing file: $file"
-
-# Commands to process each file
-convert_mp4="ffmpeg -i \"${{file}}.h264\" -c:v copy -c:a copy \"${{file}}_{condition}.mp4\""
-convert_mp4_1fps="ffmpeg -i \"${{file}}_{condition}.mp4\" -vf 'fps=1' -c:v libx264 -preset slow -crf 18 -pix_fmt yuv420p -c:a copy \"${{file}}_{condition}_1fps.mp4\""
-convert_mp4_30fps_playback="ffmpeg -i \"${{file}}_{condition}_1fps.mp4\" -filter:v 'setpts=PTS/24' -r 24 \"${{file}}_{condition}_1fps_24fps-playback.mp4\""
-remove_h264="rm \"${{file}}.h264\""
-remove_mp4="rm \"${{file}}_{condition}_1fps.mp4\""
-
-# Execute commands with error checks
-eval "$convert_mp4" || {{ echo "Failed at convert_mp4"; exit 1; }}
-eval "$convert_mp4_1fps" || {{ echo "Failed at convert_mp4_1fps"; exit 1; }}
-eval "$convert_mp4_30fps_playback" || {{ echo "Failed at convert_mp4_30fps_playback"; exit 1; }}
-eval "$remove_h264" || {{ echo "Failed at remove_h264"; exit 1; }}
-eval "$remove_mp4" || {{ echo "Failed at remove_mp4"; exit 1; }}
-
-echo "Finished processing file: $file"
-    """
-
-    print('sh file:')
-    print(process_script_content)
-    
-    # Create a temporary file to hold the SBATCH script
-    with tempfile.NamedTemporaryFile(mode="w", delete=False) as tmp_process_script:
-        tmp_process_script.write(process_script_content)
-        tmp_process_script_path = tmp_process_script.name
-
-    # Submit the SBATCH script
-    process_submission = subprocess.run(["sbatch", tmp_process_script_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-    # Optionally, delete the temporary file after submission
-    os.unlink(tmp_process_script_path)
-
-    # Check the result and extract job ID from the output
-    if process_submission.returncode == 0:
-        process_job_id_output = process_submission.stdout.strip()
-        print(process_job_id_output)
-
-        process_job_id = process_job_id_output.split()[-1]
-
-        print(process_submission.stdout)
-    else:
-        print("Failed to submit processing job array")
-        print(process_submission.stderr)
-        exit(1)
-
-    seconds = 60
-    print(f"Wait for {seconds} seconds before checking if array job has completed")
-    time.sleep(seconds)
-
-    print(f"Waiting for processing array job {process_job_id} to complete...")
-    while not is_job_array_completed(process_job_id):
-        print(f"Processing array job {process_job_id} is still running. Waiting...")
-        time.sleep(30)  # Check every 30 seconds
+    print(f'Running array job for mp4 conversion on:\n {h264_files}')
 
-    print(f"Processing array job {process_job_id} has completed.\n")
+    failed = convert_h264_files(h264_files)
+    if len(failed) > 0:
+        print(f'Conversions that did not complete: {failed}')
     
 end_processing = datetime.now()
 
@@ -10,13 +10,17 @@
 # 
 # optional arguments:   -t [timeout for SSH connections in seconds, default: 10]
 #                       -u [username for SSH connections, default: 'plugcamera']
+#                       -w [number of RPis probed at the same time, default: 32]
 
-import subprocess
 import pandas as pd
 from datetime import datetime
 import os
+import sys
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rigtools.fleet import probe_hosts, probe_columns
+
 # pulling user-input variables from command line
 # note that the default timeout = 10 and default username = 'plugcamera' for SSH connections
 parser = argparse.ArgumentParser(description='Batch SSH test, requires SSH password, path of IP addresses to test, and a save path for the connectivity data')
@@ -25,6 +29,7 @@ parser.add_argument('-i', '--ip-path', dest='ip_path', action='store', type=str,
 parser.add_argument('-s', '--save-path', dest='save_path', action='store', type=str, default='data', help='The path to save folder for SSH connectivity data')
 parser.add_argument('-t', '--timeout', dest='timeout', action='store', type=int, default=10, help='Number of seconds to attempt SSH connection')
 parser.add_argument('-u', '--username', dest='username', action='store', type=str, default='plugcamera', help='username for SSH attempts')
+parser.add_argument('-w', '--workers', dest='workers', action='store', type=int, default=32, help='number of RPis probed at the same time')
 
 # ingesting user-input arguments
 args = parser.parse_args()
@@ -33,6 +38,10 @@ ip_path = args.ip_path
 save_path = args.save_path
 timeout = args.timeout
 username = args.username
+workers = args.workers
+
+if workers < 1:
+    parser.error('--workers must be a positive integer')
 
 # pull IP address data
 data = pd.read_csv(ip_path)
@@ -44,25 +53,15 @@ now = datetime.now()
 now = now.strftime("%Y-%m-%d_%H-%M-%S")
 
 # check how many IPs could be connected to
-IPs_connected = []
-for i, IP in enumerate(IPs):
-    ssh_command = f'sshpass -p "{password}" ssh -o StrictHostKeyChecking=no -o ConnectTimeout={timeout} {username}@{IP} echo Connection to {IP} successful'    
-    result = subprocess.run(ssh_command, shell=True)
-
-    if result.returncode == 0:
-        result = 1
-    else:
-        print(f"Failed to connect to {rig_num[i]} [{IP}]")
-        result = 0
-
-    IPs_connected.append([f'pc{rig_num[i]}', IP, result])
+# all RPis are probed concurrently, so a full sweep takes about one timeout period
+IPs_connected = probe_hosts(IPs, rig_num, password, username, timeout, workers=workers)
 
 # Check if a save folder exists already and create it if not
 if not os.path.exists(save_path):
     os.makedirs(save_path)
 
 # export data on SSH connectivity
-IPs_connected = pd.DataFrame(IPs_connected, columns=['rig_number','IP', 'SSH_worked'])
+IPs_connected = pd.DataFrame(IPs_connected, columns=probe_columns)
 frac_connected = sum(IPs_connected.SSH_worked==1)/len(IPs_connected.SSH_worked)
 IPs_connected.to_csv(f'{save_path}/{now}_IPs-connected_{frac_connected*100:.0f}%.csv', index=0)
 
@@ -1,144 +1,143 @@
 # %%
-# testing time using adaptive interval
+# benchmark for the timelapse capture scheduler (time-lapses/capture_scheduler.py)
 
 # Time.sleep() is accurately quite accurate on the scale of seconds
-# We have experienced that it is inconsistent in practice though, 
-# suggesting there is a delay introduced by camera acquisition. 
-# Below I test what happens when we add a 
-# randomised camera delay between 150-300ms. 
-# I then used an adaptive interval between acquisitions to take 
-# into account the measured delay at each frame.
+# We have experienced that it is inconsistent in practice though,
+# suggesting there is a delay introduced by camera acquisition.
+# Below the naive fixed sleep, the old adaptive interval and the monotonic scheduler
+# are run against a simulated camera delay (randomised between 0.75x and 1.5x of --delay),
+# optionally with occasional stalls longer than the interval, to compare drift, jitter and missed slots
 
-import time
+# Example usage
+# python time-delay_timing.py -i 1 -d 20 --delay 0.2
+# python time-delay_timing.py -i 1 -d 600 --delay 0.2 --stall 2.5 --stall-every 50 --virtual   # instant, on a simulated clock
+
+import argparse
 import os
 import random
+import sys
+import time
+
 import numpy as np
 
-# normal use of time to add delay interval to timelapse
-def time_test(expected_interval, duration, simulated_camera_delay):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'time-lapses'))
+from capture_scheduler import CaptureScheduler, missed_policies
+
+class VirtualClock:
+    # simulated clock: sleeping just advances time, so long runs finish instantly
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0, seconds)
+
+class SimulatedCamera:
+    def __init__(self, delay, stall=0, stall_every=0, add_noise=True, sleep=time.sleep):
+        """
+        :param delay: typical capture + save time, in seconds
+        :param stall: extra delay added every stall_every captures (0 = never)
+        """
+        self.delay = delay
+        self.stall = stall
+        self.stall_every = stall_every
+        self.add_noise = add_noise
+        self.sleep = sleep
+        self.count = 0
+
+    def capture(self):
+        delay = random.uniform(0.75 * self.delay, 1.5 * self.delay) if self.add_noise else self.delay
+        if self.stall_every > 0 and self.count > 0 and self.count % self.stall_every == 0:
+            delay += self.stall
+        self.count += 1
+        self.sleep(delay)
 
-    # Calculate the number of captures based on the duration and expected interval
+# normal use of time to add delay interval to timelapse
+def time_test(expected_interval, duration, camera, clock=time.monotonic, sleep=time.sleep):
     num_captures = int(duration / expected_interval)
-
-    # Record the start time for reference
-    start_time = time.time()
+    start_time = clock()
 
     captures = []
     for i in range(num_captures + 1):
+        captures.append(clock() - start_time)
+        camera.capture()
+        sleep(expected_interval)
 
-        # simulated camera delay
-        time.sleep(simulated_camera_delay)
-
-        # Calculate the elapsed time from the start of the time-lapse
-        elapsed_time = time.time() - start_time
-        captures.append(elapsed_time)
-        print(f"capture at: {elapsed_time:0.5f}")
+    return captures
 
-        time.sleep(expected_interval)
-
-    return(captures)
-
-# adding adaptive time intervals after measuring camera acquisition
-def adaptive_time_test(expected_interval, duration, simulated_camera_delay, add_noise=True):
-
-    # Calculate the number of captures based on the duration and expected interval
+# adaptive interval after measuring camera acquisition (the previous timelapse loop)
+def adaptive_time_test(expected_interval, duration, camera, clock=time.monotonic, sleep=time.sleep):
     num_captures = int(duration / expected_interval)
-
-    # Record the start time for reference
-    start_time = time.time()
+    start_time = clock()
 
     captures = []
     for i in range(num_captures + 1):
-        # Generate a unique filename for each capture
-        #filename = f"{output_directory}/image_{i:04d}.jpg"
-
-        # Capture an image and save it with the generated filename
-        #camera.capture(filename)
+        captures.append(clock() - start_time)
+        camera.capture()
 
-        # simulated camera delay
-        if(add_noise):
-            simulated_camera_delay_rand = random.uniform(0.75*simulated_camera_delay, 1.5*simulated_camera_delay)
-            time.sleep(simulated_camera_delay_rand)
-        if(add_noise==False):
-            time.sleep(simulated_camera_delay)
-
-        # Calculate the elapsed time from the start of the time-lapse
-        elapsed_time = time.time() - start_time
-        captures.append(elapsed_time)
-        print(f"capture at: {elapsed_time:0.5f}")
-
-        # Calculate the expected time for the next capture
+        elapsed_time = clock() - start_time
         expected_next_capture_time = (i + 1) * expected_interval
+        sleep(max(0, expected_next_capture_time - elapsed_time))
 
-        # Calculate the time to sleep for the next capture
-        sleep_duration = max(0, expected_next_capture_time - elapsed_time)
-
-        # Wait for the adjusted delay before capturing the next image
-        time.sleep(sleep_duration)
-
-    return(captures)
+    return captures
 
-# Example usage
-expected_interval = 1  # Expected interval between captures (in seconds)
-duration = 20  # Capture images for 20 seconds (20 images in this example)
-delay = 0.2 # 200ms camera delay for testing
-
-captures_control = time_test(expected_interval, duration, simulated_camera_delay=0)
-captures_delay = time_test(expected_interval, duration, simulated_camera_delay=delay)
-captures_delay_adaptive = adaptive_time_test(expected_interval, duration, simulated_camera_delay=delay)
-
-print(f'Median interval in control: {np.median(np.diff(captures_control)):0.5f} +/- {np.std(np.diff(captures_control)):0.5f}')
-print(f'Median interval with camera delay: {np.median(np.diff(captures_delay)):0.5f} +/- {np.std(np.diff(captures_delay)):0.5f}')
-print(f'Median adaptive interval with camera delay: {np.median(np.diff(captures_delay_adaptive)):0.5f} +/- {np.std(np.diff(captures_delay_adaptive)):0.5f}')
-
-# %%
-# example timelapse script
-# adaptive interval
-
-def capture_time_lapse_with_adjusted_delay(expected_interval, duration, output_directory):
-    try:
-        # Create the output directory if it doesn't exist
-        os.makedirs(output_directory, exist_ok=True)
-
-        # Initialize the PiCamera
-        with picamera.PiCamera() as camera:
-            camera.resolution = (1280, 720)  # Set the resolution as per your requirement
-
-            # Calculate the number of captures based on the duration and expected interval
-            num_captures = int(duration / expected_interval)
-
-            # Record the initial time for reference
-            last_capture_time = time.time()
+# monotonic scheduler, as used by plug-camera_timelapse.py
+def scheduler_test(expected_interval, duration, camera, missed_policy, clock=time.monotonic, sleep=time.sleep):
+    num_captures = int(duration / expected_interval) + 1
+    scheduler = CaptureScheduler(expected_interval, num_captures, missed_policy=missed_policy, clock=clock, sleep=sleep, verbose=False)
 
-            captures = []
-            for i in range(num_captures):
-                # Generate a unique filename for each capture
-                filename = f"{output_directory}/image_{i:04d}.jpg"
-
-                # Capture an image and save it with the generated filename
-                camera.capture(filename)
-
-                # Calculate the elapsed time from the start of the time-lapse
-                elapsed_time = time.time() - start_time
-                captures.append(elapsed_time)
-                
-                # Calculate the expected time for the next capture
-                expected_next_capture_time = (i + 1) * expected_interval
-
-                # Calculate the time to sleep for the next capture
-                sleep_duration = max(0, expected_next_capture_time - elapsed_time)
-
-                # Wait for the adjusted delay before capturing the next image
-                time.sleep(sleep_duration)
-
-        print("Time-lapse capture completed.")
-        return(captures)
-    except Exception as e:
-        print(f"Error: {e}")
-
-# Example usage
-expected_interval_seconds = 5  # Expected interval between captures (in seconds)
-duration_seconds = 60  # Capture images for 60 seconds (10 images in this example)
-output_dir = "time_lapse_output_with_adjustment"
-
-capture_time_lapse_with_adjusted_delay(expected_interval_seconds, duration_seconds, output_dir)
+    captures = []
+    for slot in scheduler:
+        captures.append(slot.started)
+        camera.capture()
+
+    return captures, scheduler.summary()
+
+def interval_stats(captures, expected_interval):
+    captures = np.asarray(captures)
+    intervals = np.diff(captures)
+    # offset of each capture from the nearest slot on the grid; the last one shows the accumulated drift
+    slots = np.round(captures / expected_interval)
+    return {
+        'captures': len(captures),
+        'median_interval_s': np.median(intervals),
+        'std_interval_s': np.std(intervals),
+        'min_interval_s': np.min(intervals),
+        'max_abs_offset_from_grid_s': np.max(np.abs(captures - slots * expected_interval)),
+        'end_drift_s': captures[-1] - slots[-1] * expected_interval,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark timelapse capture timing against a simulated camera delay')
+    parser.add_argument('-i', '--interval', type=float, default=1, help='expected interval between captures, in seconds')
+    parser.add_argument('-d', '--duration', type=float, default=20, help='duration of each test, in seconds')
+    parser.add_argument('--delay', type=float, default=0.2, help='typical simulated camera delay, in seconds')
+    parser.add_argument('--stall', type=float, default=0, help='extra delay of an occasional stall, in seconds')
+    parser.add_argument('--stall-every', type=int, default=0, help='stall every N captures (0 = never)')
+    parser.add_argument('--no-noise', action='store_true', help='use a fixed camera delay')
+    parser.add_argument('--virtual', action='store_true', help='run on a simulated clock instead of in real time')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the simulated delays')
+    args = parser.parse_args()
+
+    def run(name, test, *test_args):
+        random.seed(args.seed)
+        virtual = VirtualClock() if args.virtual else None
+        clock = virtual.clock if virtual else time.monotonic
+        sleep = virtual.sleep if virtual else time.sleep
+        camera = SimulatedCamera(args.delay, args.stall, args.stall_every, add_noise=not args.no_noise, sleep=sleep)
+
+        result = test(args.interval, args.duration, camera, *test_args, clock=clock, sleep=sleep)
+        captures, summary = result if isinstance(result, tuple) else (result, None)
+
+        print(f'\n{name}')
+        for key, value in interval_stats(captures, args.interval).items():
+            print(f'\t{key}: {value:0.5f}' if isinstance(value, float) else f'\t{key}: {value}')
+        if summary is not None:
+            print(f'\tscheduler: {summary}')
+
+    run('fixed sleep', time_test)
+    run('adaptive interval', adaptive_time_test)
+    for missed_policy in missed_policies:
+        run(f'scheduler ({missed_policy})', scheduler_test, missed_policy)
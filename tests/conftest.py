@@ -0,0 +1,7 @@
+# the scripts add the repository root (and, on the RPi, the time-lapses folder) to sys.path; the tests do the same
+import os
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'time-lapses'))
@@ -0,0 +1,68 @@
+import pytest
+
+from capture_scheduler import CaptureScheduler
+
+class SimulatedClock:
+    # sleeping just advances time, so schedules run instantly and deterministically
+    def __init__(self):
+        self.now = 100.0  # the monotonic clock does not start at 0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0, seconds)
+
+def run(missed_policy, work, interval=1.0, num_captures=10):
+    """
+    :param work: function(slot index) -> seconds the capture takes
+    :return: (scheduler, list of slots as yielded)
+    """
+    clock = SimulatedClock()
+    scheduler = CaptureScheduler(interval, num_captures, missed_policy=missed_policy, clock=clock.clock, sleep=clock.sleep, verbose=False)
+    slots = []
+    for slot in scheduler:
+        slots.append(slot)
+        clock.sleep(work(slot.index))
+    return scheduler, slots
+
+@pytest.mark.parametrize('missed_policy', ['skip', 'catchup'])
+def test_stays_on_grid_without_drift(missed_policy):
+    scheduler, slots = run(missed_policy, lambda i: 0.3)
+    assert [slot.index for slot in slots] == list(range(10))
+    assert [slot.started for slot in slots] == pytest.approx([float(i) for i in range(10)])
+    assert all(slot.lateness == pytest.approx(0) for slot in slots)
+    assert scheduler.summary()['missed'] == 0
+    assert scheduler.summary()['overruns'] == 0
+
+def test_skip_drops_missed_slots():
+    # slot 2 stalls for 2.5 s, so slots 3 and 4 have passed by the time it returns
+    scheduler, slots = run('skip', lambda i: 2.5 if i == 2 else 0.1)
+    assert [slot.index for slot in slots] == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert scheduler.missed == [3]
+    assert slots[3].lateness == pytest.approx(0.5)
+    # back on the grid after the stall
+    assert slots[4].started == pytest.approx(5.0)
+    summary = scheduler.summary()
+    assert summary['captures'] == 9
+    assert summary['missed'] == 1
+    assert summary['overruns'] == 1
+
+def test_catchup_runs_every_slot():
+    scheduler, slots = run('catchup', lambda i: 2.5 if i == 2 else 0.1)
+    assert [slot.index for slot in slots] == list(range(10))
+    assert scheduler.missed == []
+    # slots 3 and 4 fire back to back until the schedule is met again
+    assert slots[3].started == pytest.approx(4.5)
+    assert slots[4].started == pytest.approx(4.6)
+    assert slots[5].started == pytest.approx(5.0)
+    assert scheduler.summary()['lateness_max_s'] == pytest.approx(1.5)
+
+def test_skip_never_runs_past_the_last_slot():
+    scheduler, slots = run('skip', lambda i: 100, num_captures=5)
+    assert [slot.index for slot in slots] == [0, 4]
+    assert scheduler.missed == [1, 2, 3]
+
+def test_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        CaptureScheduler(1, 10, missed_policy='wait')
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from capture_writer import CaptureWriter, still_configuration
+
+class FakeRequest:
+    # a completed capture request; save waits for `ready` so a test can hold the writer thread
+    def __init__(self, ready=None, error=None):
+        self.ready = ready
+        self.error = error
+        self.saved_to = None
+        self.released = False
+
+    def save(self, stream, path):
+        if self.ready is not None:
+            self.ready.wait(5)
+        if self.error is not None:
+            raise self.error
+        self.saved_to = (stream, path)
+
+    def release(self):
+        self.released = True
+
+def wait_until_taken(writer):
+    # the writer thread has taken everything queued (and is now waiting in save)
+    while not writer.queue.empty():
+        time.sleep(0.001)
+
+def test_every_request_is_saved_and_released():
+    writer = CaptureWriter(queue_size=2, verbose=False)
+    requests = [FakeRequest() for _ in range(10)]
+    for i, request in enumerate(requests):
+        assert writer.submit(request, f'image{i}.jpg', i)
+    writer.close()
+    assert [request.saved_to for request in requests] == [('main', f'image{i}.jpg') for i in range(10)]
+    assert all(request.released for request in requests)
+    assert [image.index for image in writer.saved] == list(range(10))
+    summary = writer.summary()
+    assert (summary['saved'], summary['dropped'], summary['failed']) == (10, 0, 0)
+    assert summary['max_queued'] <= 2
+
+def test_drop_releases_the_new_request_when_full():
+    ready = threading.Event()
+    done = []
+    writer = CaptureWriter(queue_size=1, full_policy='drop', verbose=False, on_done=lambda info, status, *times: done.append((info['index'], status)))
+    requests = [FakeRequest(ready) for _ in range(4)]
+    results = [writer.submit(requests[0], 'image0.jpg', 0)]
+    # once the writer holds request 0, exactly one more fits in the queue
+    wait_until_taken(writer)
+    results += [writer.submit(request, f'image{i}.jpg', i) for i, request in enumerate(requests[1:], 1)]
+    ready.set()
+    writer.close()
+
+    assert results == [True, True, False, False]
+    assert writer.dropped == [2, 3] and all(request.released for request in requests)
+    assert requests[2].saved_to is None
+    assert sorted(done) == [(0, 'saved'), (1, 'saved'), (2, 'dropped'), (3, 'dropped')]
+
+def test_block_waits_for_a_free_place():
+    ready = threading.Event()
+    writer = CaptureWriter(queue_size=1, full_policy='block', verbose=False)
+    writer.submit(FakeRequest(ready), 'image0.jpg', 0)
+    wait_until_taken(writer)
+    writer.submit(FakeRequest(ready), 'image1.jpg', 1)
+
+    blocked = threading.Thread(target=writer.submit, args=(FakeRequest(ready), 'image2.jpg', 2))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    ready.set()
+    blocked.join(5)
+    writer.close()
+    assert [image.index for image in writer.saved] == [0, 1, 2] and writer.dropped == []
+    assert writer.blocked_seconds > 0
+
+def test_failed_save_still_releases_the_buffer():
+    done = []
+    writer = CaptureWriter(verbose=False, on_done=lambda info, status, *times: done.append(status))
+    failing, good = FakeRequest(error=OSError('No space left on device')), FakeRequest()
+    writer.submit(failing, 'image0.jpg', 0)
+    writer.submit(good, 'image1.jpg', 1)
+    writer.close()
+    assert failing.released and good.released
+    assert writer.failed == [(0, 'No space left on device')]
+    assert done == ['failed', 'saved']
+
+def test_on_done_errors_do_not_stop_the_writer():
+    writer = CaptureWriter(verbose=False, on_done=lambda *args: 1 / 0)
+    writer.submit(FakeRequest(), 'image0.jpg', 0)
+    writer.submit(FakeRequest(), 'image1.jpg', 1)
+    writer.close()
+    assert len(writer.saved) == 2
+
+def test_configuration():
+    class Picamera2:
+        def create_still_configuration(self, **kwargs):
+            return kwargs
+    assert still_configuration(Picamera2(), queue_size=2, lores={'size': (320, 240)}) == {'buffer_count': 4, 'lores': {'size': (320, 240)}}
+    with pytest.raises(ValueError, match='full_policy'):
+        CaptureWriter(full_policy='skip')
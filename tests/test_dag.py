@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from rigtools.dag import DAG
+
+def run_with_timeout(dag, workers=4, timeout=10):
+    # a deadlocked run would hang the test suite; run it on a thread and fail instead
+    outcome = {}
+    thread = threading.Thread(target=lambda: outcome.setdefault('results', dag.run(workers=workers)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'DAG.run did not finish'
+    return outcome['results']
+
+def touch(path):
+    open(path, 'w').close()
+
+def test_runs_tasks_after_their_inputs(tmp_path):
+    order = []
+    lock = threading.Lock()
+
+    def task(name, output=None, delay=0):
+        def func():
+            time.sleep(delay)
+            if output is not None:
+                touch(output)
+            with lock:
+                order.append(name)
+        return func
+
+    a, b = str(tmp_path / 'a'), str(tmp_path / 'b')
+    dag = DAG()
+    dag.add('last', task('last'), inputs=[a, b])
+    dag.add('make_b', task('make_b', b), inputs=[a], outputs=[b])
+    dag.add('make_a', task('make_a', a, delay=0.05), outputs=[a])
+
+    results = run_with_timeout(dag)
+    assert order == ['make_a', 'make_b', 'last']
+    assert all(result.status == 'done' for result in results.values())
+
+def test_after_orders_tasks_without_files():
+    order = []
+    dag = DAG()
+    dag.add('second', lambda: order.append('second'), after=['first'])
+    dag.add('first', lambda: order.append('first'))
+    run_with_timeout(dag)
+    assert order == ['first', 'second']
+
+def test_consumer_added_before_instant_producer(tmp_path):
+    # regression: an instant producer can finish inside the scheduling pass (its done callback runs in the
+    # scheduling thread); the run must not then wait for a notification that never comes
+    for i in range(50):
+        output = str(tmp_path / f'out{i}')
+        dag = DAG()
+        dag.add('consumer', lambda: None, inputs=[output])
+        dag.add('producer', lambda output=output: touch(output), outputs=[output])
+        results = run_with_timeout(dag, workers=1, timeout=5)
+        assert results['producer'].status == 'done'
+        assert results['consumer'].status == 'done'
+
+def test_failure_skips_downstream_only(tmp_path):
+    def fail():
+        raise ValueError('broken rig')
+
+    dag = DAG()
+    dag.add('transfer_1', fail, outputs=[str(tmp_path / '1')])
+    dag.add('convert_1', lambda: None, inputs=[str(tmp_path / '1')])
+    dag.add('count_1', lambda: None, after=['convert_1'])
+    dag.add('transfer_2', lambda: touch(str(tmp_path / '2')), outputs=[str(tmp_path / '2')])
+    dag.add('convert_2', lambda: None, inputs=[str(tmp_path / '2')])
+
+    results = run_with_timeout(dag)
+    assert results['transfer_1'].status == 'failed'
+    assert 'broken rig' in results['transfer_1'].error
+    assert results['convert_1'].status == 'skipped'
+    assert results['count_1'].status == 'skipped'
+    assert results['transfer_2'].status == 'done'
+    assert results['convert_2'].status == 'done'
+
+def test_missing_output_fails_task(tmp_path):
+    dag = DAG()
+    dag.add('lazy', lambda: None, outputs=[str(tmp_path / 'never_written')])
+    results = run_with_timeout(dag)
+    assert results['lazy'].status == 'failed'
+
+def test_rejects_cycles_and_unknown_tasks():
+    dag = DAG()
+    dag.add('a', lambda: None, after=['b'])
+    dag.add('b', lambda: None, after=['a'])
+    with pytest.raises(ValueError):
+        dag.run()
+
+    dag = DAG()
+    dag.add('a', lambda: None, after=['missing'])
+    with pytest.raises(ValueError):
+        dag.run()
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('libcamera')
+
+from focus_manager import FocusManager, sharpness
+
+class Picamera2:
+    # autofocus cycles end at the next of positions; None for a failed cycle
+    def __init__(self, positions):
+        self.positions = list(positions)
+        self.lens_position = None
+        self.controls = []
+        self.cycles = 0
+
+    def set_controls(self, controls):
+        self.controls.append(controls)
+
+    def autofocus_cycle(self):
+        self.cycles += 1
+        self.lens_position = self.positions.pop(0)
+        return self.lens_position is not None
+
+    def capture_metadata(self):
+        return {'LensPosition': self.lens_position}
+
+class Request:
+    def __init__(self, yuv):
+        self.yuv = yuv
+
+    def make_array(self, stream):
+        assert stream == 'lores'
+        return self.yuv
+
+def frame(sharp, height=24, width=32):
+    # lores YUV420: a checkerboard (sharp) or a flat grey (blurred) luminance above the chroma rows
+    y = np.full((height, width), 128, dtype=np.uint8)
+    if sharp:
+        y[::2, ::2] = y[1::2, 1::2] = 200
+    return np.vstack([y, np.full((height // 2, width), 128, dtype=np.uint8)])
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_sharpness_ignores_chroma_and_brightness():
+    assert sharpness(frame(True)) > 0 and sharpness(frame(False)) == 0
+    yuv = frame(True)
+    yuv[24:] = 0
+    assert sharpness(yuv) == sharpness(frame(True))
+    assert sharpness(frame(True) // 2) == pytest.approx(sharpness(frame(True)), rel=0.05)
+
+def test_start_focuses_and_caches(tmp_path):
+    cache_path = str(tmp_path / 'focus_cache.json')
+    picam2 = Picamera2([2.5])
+    FocusManager(picam2, 'pc1', cache_path).start()
+    assert picam2.cycles == 1 and picam2.controls[-1]['LensPosition'] == 2.5
+    with open(cache_path) as f:
+        assert json.load(f)['pc1']['lens_position'] == 2.5
+
+def test_start_uses_the_cache(tmp_path):
+    cache_path = str(tmp_path / 'focus_cache.json')
+    FocusManager(Picamera2([2.5]), 'pc1', cache_path).start()
+
+    picam2 = Picamera2([])
+    FocusManager(picam2, 'pc1', cache_path, use_cached=True).start()
+    assert picam2.cycles == 0 and picam2.controls == [{'AfMode': picam2.controls[0]['AfMode'], 'LensPosition': 2.5}]
+
+    # a failed cycle falls back to the cached position
+    picam2 = Picamera2([None])
+    focus = FocusManager(picam2, 'pc1', cache_path)
+    focus.start()
+    assert picam2.cycles == 1 and focus.lens_position == 2.5
+
+def test_scheduled_refocus(tmp_path):
+    clock = Clock()
+    focus = FocusManager(Picamera2([2.5, 3.0]), 'pc1', str(tmp_path / 'focus_cache.json'), refocus_every=3600, sharpness_drop=0, clock=clock)
+    focus.start()
+    clock.now = 3599
+    assert focus.check(Request(frame(True))) is None
+    clock.now = 3600
+    assert focus.check(Request(frame(True))) == 'scheduled'
+    focus.refocus('scheduled')
+    assert focus.lens_position == 3.0 and focus.refocus_count == 1
+    assert focus.check(Request(frame(True))) is None
+
+def test_refocus_after_patience_low_frames(tmp_path):
+    focus = FocusManager(Picamera2([2.5, 3.0]), 'pc1', str(tmp_path / 'focus_cache.json'), patience=3, clock=Clock())
+    focus.start()
+    sharp, blurred = Request(frame(True)), Request(frame(False))
+    # the first frame after focusing is the reference; a sharp frame resets the count of blurred ones
+    assert [focus.check(r) for r in [sharp, blurred, blurred, sharp, blurred, blurred]] == [None] * 6
+    assert focus.check(blurred).startswith('sharpness 0 < 0.7 x')
+    # refocusing takes a new reference
+    focus.refocus('sharpness')
+    assert focus.check(blurred) is None and focus.check(blurred) is None
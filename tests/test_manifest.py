@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from rigtools import manifest
+from rigtools.manifest import (append_entry, format_mtime, from_rsync, manifest_name, prune, read_manifest, update, verify,
+                               write_manifest)
+
+mtime = 1760000000  # whole seconds, as rsync -t keeps them
+
+def write(path, data, file_mtime=mtime):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(path, (file_mtime, file_mtime))
+
+@pytest.fixture
+def copy(tmp_path):
+    # the local copy of a transfer
+    root = tmp_path / 'copy'
+    write(str(root / 'exp1' / 'video 1.h264'), b'x' * 100)
+    write(str(root / 'exp1' / 'a|b.h264'), b'y' * 50)
+    return str(root)
+
+def test_from_rsync(tmp_path):
+    log = tmp_path / 'rsync.log'
+    log.write_text('receiving incremental file list\n'
+                   'MANIFEST|cd+++++++++|4096|2025/10/09-10:13:20|exp1\n'
+                   f'MANIFEST|>f+++++++++|100|{format_mtime(mtime)}|exp1/video 1.h264\n'
+                   '        100 100%    0.00kB/s    0:00:00 (xfr#1, to-chk=2/4)\n'
+                   f'MANIFEST|.f         |1,234,567|{format_mtime(mtime)}|exp1/a|b.h264\n'
+                   f'MANIFEST|cL+++++++++|7|{format_mtime(mtime)}|exp1/latest -> video 1.h264\n'
+                   '\n'
+                   'Number of files: 4 (reg: 2, dir: 1, link: 1)\n')
+    assert from_rsync(str(log)) == [
+        ('exp1/video 1.h264', 100, format_mtime(mtime), ''),
+        ('exp1/a|b.h264', 1234567, format_mtime(mtime), ''),
+    ]
+
+def test_manifest_round_trip(tmp_path):
+    entries = [('exp1/video 1.h264', 100, str(mtime), ''), ('exp1/a|b.h264', 50, format_mtime(mtime), 'ef46db3751d8e999')]
+    write_manifest(entries, str(tmp_path / 'manifest.tsv'))
+    assert read_manifest(str(tmp_path / 'manifest.tsv')) == entries
+    assert not os.path.exists(tmp_path / 'manifest.tsv.tmp')
+
+def test_verify(copy):
+    entries = [
+        ('exp1/video 1.h264', 100, str(mtime), ''),         # epoch seconds, from the RPi
+        ('exp1/a|b.h264', 50, format_mtime(mtime), ''),     # rsync's %M
+    ]
+    assert verify(entries, copy) == (['exp1/video 1.h264', 'exp1/a|b.h264'], [])
+
+@pytest.mark.parametrize('entry, problem', [
+    (('exp1/video 1.h264', 101, str(mtime), ''), 'size 100 != 101'),
+    (('exp1/video 1.h264', 100, str(mtime + 1), ''), f'mtime {mtime} != {mtime + 1}'),
+    (('exp1/a|b.h264', 50, format_mtime(mtime - 60), ''), f'mtime {mtime} != {format_mtime(mtime - 60)}'),
+    (('exp1/not transferred.h264', 10, str(mtime), ''), 'missing'),
+])
+def test_verify_mismatches(copy, entry, problem):
+    good = ('exp1/video 1.h264', 100, str(mtime), '') if entry[0] != 'exp1/video 1.h264' else ('exp1/a|b.h264', 50, str(mtime), '')
+    verified, problems = verify([entry, good], copy)
+    assert verified == [good[0]]
+    assert problems == [(entry[0], problem)]
+
+def test_verify_hashes(copy, monkeypatch):
+    entries = [('exp1/video 1.h264', 100, str(mtime), 'aaaa'), ('exp1/a|b.h264', 50, str(mtime), 'bbbb')]
+    monkeypatch.setattr(manifest, 'xxhash', object())
+    monkeypatch.setattr(manifest, 'hash_file', lambda path: 'aaaa')
+    assert verify(entries, copy, check_hash=True) == (['exp1/video 1.h264'], [('exp1/a|b.h264', 'hash mismatch')])
+    # hashes are only compared when asked for
+    assert verify(entries, copy)[1] == []
+
+def test_verify_without_xxhash_falls_back_to_size_and_mtime(copy, monkeypatch):
+    monkeypatch.setattr(manifest, 'xxhash', None)
+    entries = [('exp1/video 1.h264', 100, str(mtime), 'aaaa')]
+    assert verify(entries, copy, check_hash=True) == (['exp1/video 1.h264'], [])
+
+def test_verify_command_only_lists_verified_files(copy, tmp_path):
+    # the NUL-separated list is what the transfer stage deletes on the RPi with xargs -0 rm
+    manifest_path, verified_path = str(tmp_path / 'manifest.tsv'), str(tmp_path / 'verified.txt')
+    write_manifest([('exp1/video 1.h264', 100, str(mtime), ''),
+                    ('exp1/a|b.h264', 51, str(mtime), ''),
+                    ('exp1/missing.h264', 10, str(mtime), '')], manifest_path)
+    result = subprocess.run([sys.executable, manifest.__file__, 'verify', '-m', manifest_path, '-r', copy, '-v', verified_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    assert result.returncode == 1
+    assert 'NOT VERIFIED: exp1/a|b.h264 (size 50 != 51)' in result.stdout
+    with open(verified_path) as f:
+        assert f.read() == 'exp1/video 1.h264\0'
+
+def test_rpi_manifest(tmp_path):
+    # the recording scripts append finished files; update adds the rest and re-stats changed ones; prune drops deleted ones
+    root = str(tmp_path / 'data')
+    write(os.path.join(root, 'exp1', 'video1.h264'), b'x' * 10)
+    append_entry(root, 'exp1/video1.h264')
+    write(os.path.join(root, 'exp1', 'video 2.h264'), b'y' * 20)
+    write(os.path.join(root, 'exp1', 'video1.h264'), b'x' * 30, mtime + 5)
+
+    entries = sorted(update(root))
+    assert entries == [('exp1/video 2.h264', 20, str(mtime), ''), ('exp1/video1.h264', 30, str(mtime + 5), '')]
+    assert sorted(read_manifest(os.path.join(root, manifest_name))) == entries
+    assert verify(entries, root) == ([path for path, *_ in entries], [])
+
+    os.remove(os.path.join(root, 'exp1', 'video1.h264'))
+    assert prune(root) == [('exp1/video 2.h264', 20, str(mtime), '')]
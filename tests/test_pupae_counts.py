@@ -0,0 +1,69 @@
+import csv
+import json
+
+import pytest
+
+from rigtools import pupae_counts
+from rigtools.pupae_counts import count_folder, count_json, count_predictions, count_slp, prediction_files
+
+# the 'frames' table of a SLEAP .slp file; each row points at its instances by an index range
+frames_dtype = [('frame_id', '<u8'), ('video', '<u4'), ('frame_idx', '<u8'), ('instance_id_start', '<u8'), ('instance_id_end', '<u8')]
+
+def write_slp(path, ranges):
+    h5py = pytest.importorskip('h5py')
+    np = pytest.importorskip('numpy')
+    frames = np.array([(i, 0, i, start, end) for i, (start, end) in enumerate(ranges)], dtype=frames_dtype)
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('frames', data=frames, maxshape=(None,))
+
+def write_json(path, counts):
+    with open(path, 'w') as f:
+        json.dump({'labels': [{'_instances': [{}] * count} for count in counts]}, f)
+
+def test_count_slp_counts_the_first_frame(tmp_path):
+    path = str(tmp_path / 'vial1.predictions.slp')
+    write_slp(path, [(0, 37), (37, 40)])
+    assert count_slp(path) == 37
+
+def test_count_slp_index_range_does_not_start_at_zero(tmp_path):
+    path = str(tmp_path / 'vial1.predictions.slp')
+    write_slp(path, [(120, 163)])
+    assert count_slp(path) == 43
+
+def test_count_slp_without_frames(tmp_path):
+    path = str(tmp_path / 'empty.predictions.slp')
+    write_slp(path, [])
+    assert count_slp(path) == 0
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_count_json(tmp_path, monkeypatch, streaming):
+    if streaming:
+        pytest.importorskip('ijson')
+    else:
+        monkeypatch.setattr(pupae_counts, 'ijson', None)
+    path = str(tmp_path / 'vial1.predictions.json')
+    write_json(path, [12, 3])
+    assert count_json(path) == 12
+    write_json(path, [])
+    assert count_json(path) == 0
+
+def test_prediction_files_prefer_slp(tmp_path):
+    write_slp(str(tmp_path / 'a.predictions.slp'), [(0, 1)])
+    write_json(str(tmp_path / 'a.json'), [1])  # sleap-convert output of a.predictions.slp
+    write_slp(str(tmp_path / 'b.predictions.slp'), [(0, 1)])
+    write_json(str(tmp_path / 'b.predictions.json'), [1])
+    write_json(str(tmp_path / 'c.json'), [2])
+    (tmp_path / 'pupae_counts.csv').write_text('')
+    assert [p.rsplit('/', 1)[-1] for p in prediction_files(str(tmp_path))] == ['a.predictions.slp', 'b.predictions.slp', 'c.json']
+
+def test_count_folder(tmp_path):
+    write_slp(str(tmp_path / 'a.predictions.slp'), [(0, 5)])
+    write_json(str(tmp_path / 'b.predictions.json'), [7])
+    (tmp_path / 'c.predictions.slp').write_text('not an HDF5 file')
+    output = str(tmp_path / 'pupae_counts.csv')
+
+    rows = count_folder(str(tmp_path), output, workers=2)
+    assert rows == [[5, str(tmp_path / 'a.predictions.slp')], [7, str(tmp_path / 'b.predictions.json')]]
+    with open(output) as f:
+        assert list(csv.reader(f)) == [['pupae_count', 'dataset']] + [[str(count), path] for count, path in rows]
+    assert count_predictions(str(tmp_path / 'b.predictions.json')) == 7
@@ -0,0 +1,92 @@
+import shutil
+import subprocess
+
+import pytest
+
+from rigtools.remote_batch import StepResult, compose_script, first_failure, parse_output, run_batch
+
+marker = '@@step-test'
+
+class LocalPool:
+    # runs the batch script in a local bash, as SSHPool.run would on the RPi
+    def __init__(self, returncode=None):
+        self.returncode = returncode
+
+    def run(self, IP, script, check=True):
+        if self.returncode is not None:
+            # ssh itself failed, nothing ran
+            return subprocess.CompletedProcess(['ssh', IP], self.returncode, b'', b'ssh: connect to host: Connection refused\n')
+        return subprocess.run(['bash', '-c', script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+needs_bash = pytest.mark.skipif(shutil.which('bash') is None, reason='needs bash')
+
+def test_parse_output():
+    steps = [('set_date', 'sudo date'), ('read_date', 'date'), ('remove_log', 'rm -f python.log')]
+    stdout = (f'{marker} begin set_date\n\n{marker} end set_date 0\n'
+              f'{marker} begin read_date\nFri 17 Oct\n\n{marker} end read_date 0\n'
+              f'{marker} begin remove_log\nrm: cannot remove\n\n{marker} end remove_log 1\n')
+    assert parse_output(steps, stdout, marker) == [
+        StepResult('set_date', 0, ''),
+        StepResult('read_date', 0, 'Fri 17 Oct'),
+        StepResult('remove_log', 1, 'rm: cannot remove'),
+    ]
+
+def test_steps_without_markers_never_ran():
+    steps = [('first', 'false'), ('second', 'true')]
+    results = parse_output(steps, f'{marker} begin first\n\n{marker} end first 1\n', marker)
+    assert results[1] == StepResult('second', None, '')
+    assert first_failure(results) == StepResult('first', 1, '')
+
+def test_no_markers_at_all():
+    steps = [('first', 'true')]
+    assert parse_output(steps, 'Welcome to Raspberry Pi OS\n', marker) == [StepResult('first', None, '')]
+
+def test_truncated_stream():
+    steps = [('copy', 'cp a b'), ('start', 'python run.py')]
+    # cut off in the middle of the first step's output
+    results = parse_output(steps, f'{marker} begin copy\nline one\nline t', marker)
+    assert results == [StepResult('copy', None, 'line one\nline t'), StepResult('start', None, '')]
+    assert first_failure(results).name == 'copy'
+
+def test_truncated_end_marker():
+    steps = [('copy', 'cp a b')]
+    for cut in [f'{marker} end co', f'{marker} end copy', f'{marker} end copy ']:
+        results = parse_output(steps, f'{marker} begin copy\nok\n{cut}', marker)
+        assert results == [StepResult('copy', None, 'ok')]
+
+def test_output_that_looks_like_markers():
+    # only lines starting with this batch's own marker count; a different run's marker, or the marker text
+    # in the middle of a line, is output
+    steps = [('echo', 'echo')]
+    output = '@@step-other begin echo\nsays @@step-test end echo 0\nbegin echo'
+    results = parse_output(steps, f'{marker} begin echo\n{output}\n\n{marker} end echo 3\n', marker)
+    assert results == [StepResult('echo', 3, output)]
+
+def test_end_marker_of_another_step_is_ignored():
+    steps = [('first', 'true'), ('second', 'true')]
+    results = parse_output(steps, f'{marker} begin first\n{marker} end second 0\n', marker)
+    assert results == [StepResult('first', None, ''), StepResult('second', None, '')]
+
+@needs_bash
+def test_composed_script_round_trip():
+    steps = [('no_newline', 'printf partial'), ('both_streams', 'echo out; echo err >&2'), ('fails', '(exit 4)'), ('skipped', 'echo never')]
+    result = LocalPool().run('local', compose_script(steps, marker))
+    assert result.returncode == 4
+    results = parse_output(steps, result.stdout.decode(), marker)
+    assert results == [
+        StepResult('no_newline', 0, 'partial'),
+        StepResult('both_streams', 0, 'out\nerr'),
+        StepResult('fails', 4, ''),
+        StepResult('skipped', None, ''),
+    ]
+
+@needs_bash
+def test_run_batch():
+    results = run_batch(LocalPool(), '192.168.1.10', [('date', 'echo today'), ('count', 'echo 3')])
+    assert results == [StepResult('date', 0, 'today'), StepResult('count', 0, '3')]
+    assert first_failure(results) is None
+
+def test_run_batch_ssh_failure():
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_batch(LocalPool(returncode=255), '192.168.1.10', [('date', 'date')])
+    assert error.value.returncode == 255
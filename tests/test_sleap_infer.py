@@ -0,0 +1,93 @@
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('sleap')
+
+from rigtools import sleap_infer
+from rigtools.sleap_infer import claim, prediction_path, run_queue, run_shard, shard_items
+
+@pytest.fixture
+def predicted(monkeypatch):
+    # predict_file without the models: writes an empty prediction, fails for inputs named bad*
+    calls = []
+    def predict_file(predictor, input_path, output_dir=None, write_json=False):
+        calls.append(input_path)
+        if os.path.basename(input_path).startswith('bad'):
+            raise RuntimeError('no frames')
+        output_path = prediction_path(input_path, output_dir)
+        open(output_path, 'w').close()
+        return output_path
+    monkeypatch.setattr(sleap_infer, 'predict_file', predict_file)
+    return calls
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+    return str(path)
+
+def test_prediction_path():
+    assert prediction_path('/data/vial1.jpg') == '/data/vial1.jpg.predictions.slp'
+    assert prediction_path('/data/vial1.jpg', '/predictions') == '/predictions/vial1.predictions.slp'
+
+def test_shards_cover_every_input_once():
+    items = [f'{i}.jpg' for i in range(10)]
+    shards = [shard_items(items, shard, 3) for shard in [1, 2, 3]]
+    assert shards[0] == ['0.jpg', '3.jpg', '6.jpg', '9.jpg']
+    assert sorted(sum(shards, [])) == sorted(items)
+
+def test_run_shard_keeps_going_after_a_failure(tmp_path, predicted):
+    inputs = [touch(tmp_path / 'a.jpg'), touch(tmp_path / 'bad.jpg'), touch(tmp_path / 'c.jpg')]
+    assert run_shard(None, inputs, str(tmp_path)) == [
+        (inputs[0], f'{tmp_path}/a.predictions.slp', ''),
+        (inputs[1], '', 'no frames'),
+        (inputs[2], f'{tmp_path}/c.predictions.slp', ''),
+    ]
+
+def test_claim_skips_other_files(tmp_path):
+    queue, claimed = tmp_path / 'queue', tmp_path / 'claimed'
+    touch(queue / 'notes.txt')
+    touch(queue / 'b.JPG')
+    touch(queue / 'a.mp4')
+    os.makedirs(claimed)
+    assert claim(str(queue), str(claimed)) == str(claimed / 'a.mp4')
+    assert claim(str(queue), str(claimed)) == str(claimed / 'b.JPG')
+    assert claim(str(queue), str(claimed)) is None
+    assert sorted(os.listdir(queue)) == ['notes.txt']
+
+def test_racing_workers_claim_each_input_once(tmp_path):
+    queue = tmp_path / 'queue'
+    for i in range(200):
+        touch(queue / f'{i:03d}.jpg')
+    claims = []
+    def worker(n):
+        claim_dir = str(tmp_path / f'worker{n}')
+        os.makedirs(claim_dir)
+        while (claimed := claim(str(queue), claim_dir)) is not None:
+            claims.append(os.path.basename(claimed))
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claims) == [f'{i:03d}.jpg' for i in range(200)]
+
+def test_queue_moves_inputs_and_their_predictions(tmp_path, predicted):
+    queue = tmp_path / 'queue'
+    touch(queue / 'a.jpg')
+    touch(queue / 'bad.jpg')
+    touch(queue / 'STOP')
+
+    assert run_queue(None, str(queue), None, poll_interval=0) == 1
+    assert sorted(os.listdir(queue / 'done')) == ['a.jpg', 'a.jpg.predictions.slp']
+    assert os.listdir(queue / 'failed') == ['bad.jpg']
+    # the worker's claim folder is removed when it stops
+    assert os.listdir(queue / 'claimed') == []
+
+def test_queue_stops_when_idle(tmp_path, predicted, monkeypatch):
+    clock = iter(range(0, 10000, 60))
+    monkeypatch.setattr(sleap_infer.time, 'monotonic', lambda: next(clock))
+    monkeypatch.setattr(sleap_infer.time, 'sleep', lambda seconds: None)
+    assert run_queue(None, str(tmp_path / 'queue'), str(tmp_path), idle_timeout=600) == 0
+    assert predicted == []
@@ -0,0 +1,84 @@
+import subprocess
+
+import pytest
+
+from rigtools import slurm
+
+class FakeSlurm:
+    """
+    Stands in for subprocess.run and time.sleep in rigtools.slurm: sbatch prints job_id, and every sacct call
+    returns the next of sacct_outputs (the last one repeats).
+    """
+    def __init__(self, sacct_outputs, job_id='12345', sbatch_returncode=0):
+        self.sacct_outputs = list(sacct_outputs)
+        self.job_id = job_id
+        self.sbatch_returncode = sbatch_returncode
+        self.commands = []
+        self.sleeps = []
+
+    def run(self, command, **kwargs):
+        self.commands.append(command)
+        if command[0] == 'sbatch':
+            return subprocess.CompletedProcess(command, self.sbatch_returncode, f'{self.job_id}\n', '')
+        output = self.sacct_outputs.pop(0) if len(self.sacct_outputs) > 1 else self.sacct_outputs[0]
+        return subprocess.CompletedProcess(command, 0, output, '')
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+@pytest.fixture
+def fake(monkeypatch):
+    def install(*args, **kwargs):
+        fake = FakeSlurm(*args, **kwargs)
+        monkeypatch.setattr(slurm.subprocess, 'run', fake.run)
+        monkeypatch.setattr(slurm.time, 'sleep', fake.sleep)
+        return fake
+    return install
+
+def test_job_states_parses_parsable2(fake):
+    fake(['12345_1|COMPLETED\n12345_2|CANCELLED by 1234\n12345_3|\nnot a state line\n12345_[4-5]|PENDING\n'])
+    assert slurm.job_states('12345') == {'12345_1': 'COMPLETED', '12345_2': 'CANCELLED', '12345_[4-5]': 'PENDING'}
+
+def test_job_states_unknown_job(fake):
+    fake([''])
+    assert slurm.job_states('12345') == {}
+
+def test_finished_and_failed():
+    assert not slurm.is_finished({})
+    assert not slurm.is_finished({'1_1': 'COMPLETED', '1_2': 'RUNNING'})
+    states = {'1_1': 'COMPLETED', '1_2': 'TIMEOUT', '1_3': 'OUT_OF_MEMORY'}
+    assert slurm.is_finished(states)
+    assert slurm.failed_tasks(states) == ['1_2', '1_3']
+
+def test_wait_for_job_backs_off_up_to_max_delay(fake):
+    running = '12345_1|RUNNING\n12345_2|PENDING\n'
+    f = fake([''] + [running] * 6 + ['12345_1|COMPLETED\n12345_2|FAILED\n'])
+    states = slurm.wait_for_job('12345', initial_delay=10, max_delay=300)
+    assert f.sleeps == [10, 20, 40, 80, 160, 300, 300, 300]
+    assert states == {'12345_1': 'COMPLETED', '12345_2': 'FAILED'}
+
+def test_submit_job_with_dependencies(fake):
+    f = fake([''])
+    assert slurm.submit_job('#!/bin/bash\n', dependency=['1', '2']) == '12345'
+    command = f.commands[0]
+    assert command[:2] == ['sbatch', '--parsable']
+    assert '--dependency=afterok:1:2' in command and '--kill-on-invalid-dep=yes' in command
+    assert '--wait' not in command
+
+def test_submit_job_failure_raises(fake):
+    fake([''], job_id='', sbatch_returncode=1)
+    with pytest.raises(subprocess.CalledProcessError):
+        slurm.submit_job('#!/bin/bash\n')
+
+def test_run_job_waits_with_sbatch_wait(fake):
+    # with --wait a failed job makes sbatch exit non-zero; that is the job's state, not a submission failure
+    f = fake(['12345|FAILED\n'], sbatch_returncode=1)
+    assert slurm.run_job('#!/bin/bash\n') == ('12345', {'12345': 'FAILED'})
+    assert '--wait' in f.commands[0]
+    assert f.sleeps == []
+
+def test_run_job_waits_for_sacct_to_catch_up(fake):
+    f = fake(['12345_1|COMPLETED\n12345_2|RUNNING\n', '12345_1|COMPLETED\n12345_2|RUNNING\n', '12345_1|COMPLETED\n12345_2|COMPLETED\n'])
+    job_id, states = slurm.run_job('#!/bin/bash\n')
+    assert states == {'12345_1': 'COMPLETED', '12345_2': 'COMPLETED'}
+    assert f.sleeps == [2, 4]
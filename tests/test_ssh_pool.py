@@ -0,0 +1,81 @@
+import os
+import stat
+import subprocess
+
+import pytest
+
+from rigtools.fleet import probe_hosts, probe_ssh, run_parallel
+from rigtools.ssh_pool import SSHPool
+
+# stands in for ssh: logs the remote command, fails like ssh does for rigs listed in $FAKE_SSH_DENY,
+# and otherwise runs the remote command locally
+fake_ssh = '''#!/bin/sh
+for last; do :; done
+echo "$last" >> "$FAKE_SSH_LOG"
+case "$*" in *"-O exit"*) exit 0;; esac
+for host in $FAKE_SSH_DENY; do
+    case "$*" in *"@$host "*) echo "Permission denied (publickey,password)." >&2; exit 255;; esac
+done
+exec sh -c "$last"
+'''
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'ssh').write_text(fake_ssh)
+    (bin_dir / 'ssh').chmod(stat.S_IRWXU)
+    monkeypatch.setenv('PATH', f'{bin_dir}:{os.environ["PATH"]}')
+    monkeypatch.setenv('FAKE_SSH_LOG', str(tmp_path / 'ssh.log'))
+    monkeypatch.setenv('FAKE_SSH_DENY', '10.0.0.9')
+    pool = SSHPool(username='plugcamera', timeout=1)
+    yield pool
+    pool.close_all()
+
+def ssh_calls(tmp_path):
+    with open(tmp_path / 'ssh.log') as f:
+        return f.read().splitlines()
+
+def test_run_reuses_the_connection(pool, tmp_path):
+    assert pool.run('10.0.0.1', ['echo', 'hello world']).stdout == b'hello world\n'
+    assert pool.run('10.0.0.1', 'echo again').stdout == b'again\n'
+    # one connect ('true'), then the two commands
+    assert ssh_calls(tmp_path) == ['true', "echo 'hello world'", 'echo again']
+
+def test_failed_connect_is_cached_and_reported(pool, tmp_path):
+    assert not pool.connect('10.0.0.9')
+    assert 'Permission denied' in pool.errors['10.0.0.9']
+
+    result = pool.run('10.0.0.9', 'date', check=False)
+    assert result.returncode == 255
+    assert b'Permission denied' in result.stderr
+    with pytest.raises(subprocess.CalledProcessError):
+        pool.run('10.0.0.9', 'date')
+    # the failure was cached: only the first connect reached ssh
+    assert ssh_calls(tmp_path) == ['true']
+
+    # retry (e.g. after a reboot) tries again
+    pool.env['FAKE_SSH_DENY'] = ''
+    assert pool.connect('10.0.0.9', retry=True)
+    assert '10.0.0.9' not in pool.errors
+
+def test_close_all_removes_its_control_folder(pool):
+    assert pool.connect('10.0.0.1')
+    control_dir = pool.control_dir
+    pool.close_all()
+    assert not os.path.exists(control_dir)
+    assert pool.connected == set()
+
+def test_probe_keeps_the_ssh_error(pool):
+    worked, latency, error = probe_ssh('10.0.0.9', None, 'plugcamera', 1, pool=pool)
+    assert not worked and 'Permission denied (publickey,password)' in error
+    assert probe_ssh('10.0.0.1', None, 'plugcamera', 1, pool=pool)[::2] == (True, '')
+
+def test_probe_hosts(pool):
+    rows = probe_hosts(['10.0.0.1', '10.0.0.9'], [1, 9], None, 'plugcamera', 1, pool=pool)
+    assert [row[:3] for row in rows] == [['pc1', '10.0.0.1', 1], ['pc9', '10.0.0.9', 0]]
+    assert rows[0][4] == '' and 'Permission denied' in rows[1][4]
+
+def test_run_parallel_keeps_order():
+    assert run_parallel(lambda x: x * x, range(20), workers=4) == [x * x for x in range(20)]
+    assert run_parallel(lambda x: x, []) == []
@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+from rigtools.stage_state import StageState, fingerprint
+
+def write(path, text, mtime_ns=None):
+    with open(path, 'w') as f:
+        f.write(text)
+    if mtime_ns is not None:
+        # mtimes can be coarse; set them explicitly so size + mtime fingerprints always change
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+@pytest.fixture
+def item(tmp_path):
+    source, result = str(tmp_path / 'a.h264'), str(tmp_path / 'a.mp4')
+    write(source, 'h264', mtime_ns=1_000_000_000)
+    write(result, 'mp4', mtime_ns=2_000_000_000)
+    return str(tmp_path / 'state'), source, result
+
+def test_not_done_until_marked(item):
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert')
+    assert not state.is_done('a', [source], [result])
+    state.mark_done('a', [source], [result])
+    assert state.is_done('a', [source], [result])
+
+def test_marks_persist_across_instances(item):
+    state_dir, source, result = item
+    StageState(state_dir, 'convert').mark_done('a', [source], [result])
+    assert os.path.exists(os.path.join(state_dir, 'convert.json'))
+    assert StageState(state_dir, 'convert').is_done('a', [source], [result])
+    # stages are kept apart
+    assert not StageState(state_dir, 'unwrap').is_done('a', [source], [result])
+
+def test_changed_output_invalidates(item):
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert')
+    state.mark_done('a', [source], [result])
+    write(result, 'mp4', mtime_ns=3_000_000_000)
+    assert not state.is_done('a', [source], [result])
+
+def test_deleted_output_invalidates(item):
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert')
+    state.mark_done('a', [source], [result])
+    os.remove(result)
+    assert not state.is_done('a', [source], [result])
+
+def test_missing_output_at_mark_time_is_not_done(item):
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert')
+    os.remove(result)
+    state.mark_done('a', [source], [result])
+    write(result, 'mp4')
+    assert not state.is_done('a', [source], [result])
+
+def test_different_outputs_invalidate(item, tmp_path):
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert')
+    state.mark_done('a', [source], [result])
+    other = str(tmp_path / 'a.avi')
+    write(other, 'avi')
+    assert not state.is_done('a', [source], [other])
+
+def test_changed_input_invalidates(item):
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert')
+    state.mark_done('a', [source], [result])
+    write(source, 'longer h264', mtime_ns=1_000_000_000)
+    assert not state.is_done('a', [source], [result])
+
+def test_deleted_input_still_done(item):
+    # converted .h264 files are deleted after conversion; that must not redo the conversion
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert')
+    state.mark_done('a', [source], [result])
+    os.remove(source)
+    assert state.is_done('a', [source], [result])
+
+def test_input_deleted_by_the_item_then_delivered_again(item):
+    # the convert job removes the .h264 itself; rsync -t later delivers the same file again
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert')
+    inputs = state.fingerprints([source])
+    os.remove(source)
+    state.mark_done('a', inputs, [result])
+    assert state.is_done('a', [source], [result])
+
+    write(source, 'h264', mtime_ns=1_000_000_000)
+    assert state.is_done('a', [source], [result])
+    assert StageState(state_dir, 'convert').is_done('a', [source], [result])
+
+    # a different recording under the same name is converted again
+    write(source, 'new h264', mtime_ns=4_000_000_000)
+    assert not state.is_done('a', [source], [result])
+
+def test_content_mode_ignores_mtime(item):
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert', content=True)
+    state.mark_done('a', [source], [result])
+    write(result, 'mp4', mtime_ns=3_000_000_000)
+    assert state.is_done('a', [source], [result])
+    write(result, 'MP4', mtime_ns=3_000_000_000)
+    assert not state.is_done('a', [source], [result])
+
+def test_folder_fingerprint_follows_its_files(tmp_path):
+    folder = tmp_path / 'unwrapped'
+    folder.mkdir()
+    write(str(folder / 'frame0.png'), 'x', mtime_ns=1_000_000_000)
+    before = fingerprint(str(folder))
+    write(str(folder / 'frame1.png'), 'y', mtime_ns=1_000_000_000)
+    assert fingerprint(str(folder)) != before
+    assert fingerprint(str(tmp_path / 'missing')) is None
+
+def test_pending_and_forget(item, tmp_path):
+    state_dir, source, result = item
+    state = StageState(state_dir, 'convert')
+    state.mark_done('a', [source], [result])
+    inputs_for = lambda key: [str(tmp_path / f'{key}.h264')]
+    outputs_for = lambda key: [str(tmp_path / f'{key}.mp4')]
+    assert state.pending(['a', 'b'], inputs_for, outputs_for) == ['b']
+    state.forget('a')
+    assert state.pending(['a', 'b'], inputs_for, outputs_for) == ['a', 'b']
+    assert not StageState(state_dir, 'convert').is_done('a', [source], [result])
@@ -0,0 +1,75 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+from rigtools import tile_layout
+from rigtools.tile_layout import layout_for, layout_key, register_pair, register_strips, update_cache, validate_layout
+
+def scene(height=64, width=200, seed=0):
+    # smooth random texture, so phase correlation has a clear peak
+    image = np.random.default_rng(seed).integers(0, 256, (height, width)).astype(np.uint8)
+    return cv2.GaussianBlur(image, (5, 5), 0)
+
+def strips_of(image, step=12, width=96, count=5):
+    # neighbouring windows of the same scene, each placed step pixels right of the previous one
+    return [np.ascontiguousarray(image[:, i * step:i * step + width]) for i in range(count)]
+
+def test_layout_key():
+    assert layout_key('192.168.1.100', (1750, 86), 120, 5) == '192.168.1.100|1750x86|120|interval-5'
+
+def test_register_pair_gives_the_placement_of_the_second_strip():
+    strip_a, strip_b = strips_of(scene(), step=7, count=2)
+    x, y, response = register_pair(strip_a, strip_b)
+    assert abs(x - 7) < 0.5 and abs(y) < 0.5
+    assert response > 0.1
+
+def test_register_strips_chains_the_offsets():
+    offsets = register_strips(strips_of(scene()))
+    assert np.allclose(offsets, [(12 * i, 0) for i in range(5)], atol=0.5)
+
+def test_validate_layout():
+    strips = strips_of(scene())
+    good = [(12.0 * i, 0.0) for i in range(5)]
+    assert validate_layout(strips, good)
+    # one pair off by more than the tolerance
+    assert not validate_layout(strips, good[:-1] + [(60.0, 0.0)], pairs=4)
+    assert validate_layout(strips, good[:-1] + [(49.0, 0.0)], pairs=4, tolerance=2.0)
+    # a layout for a different number of strips never validates
+    assert not validate_layout(strips, good[:-1])
+    assert validate_layout(strips[:1], [(0.0, 0.0)])
+
+def test_layout_for_registers_once_then_reuses_the_cache(tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'tile_layouts.json')
+    strips = strips_of(scene())
+
+    offsets = layout_for(strips, 'rig1', cache_path)
+    assert np.allclose(offsets, [(12 * i, 0) for i in range(5)], atol=0.5)
+    with open(cache_path) as f:
+        assert list(json.load(f)) == ['rig1']
+
+    # the cached layout validates, so the strips are not registered again
+    monkeypatch.setattr(tile_layout, 'register_strips', lambda strips: pytest.fail('registered again'))
+    assert np.allclose(layout_for(strips, 'rig1', cache_path), offsets)
+
+def test_layout_for_replaces_a_stale_layout(tmp_path):
+    cache_path = str(tmp_path / 'tile_layouts.json')
+    update_cache(cache_path, 'rig1', [(30.0 * i, 0.0) for i in range(5)])
+    update_cache(cache_path, 'rig2', [(1.0, 2.0)])
+
+    offsets = layout_for(strips_of(scene()), 'rig1', cache_path)
+    assert np.allclose(offsets, [(12 * i, 0) for i in range(5)], atol=0.5)
+    cache = tile_layout.read_cache(cache_path)
+    assert np.allclose(cache['rig1'], offsets) and cache['rig2'] == [[1.0, 2.0]]
+
+def test_concurrent_updates_keep_every_layout(tmp_path):
+    cache_path = str(tmp_path / 'tile_layouts.json')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: update_cache(cache_path, f'rig{i}', [(float(i), 0.0)]), range(32)))
+    assert tile_layout.read_cache(cache_path) == {f'rig{i}': [[float(i), 0.0]] for i in range(32)}
+    # no temporary files left behind
+    assert sorted(os.listdir(tmp_path)) == ['tile_layouts.json', 'tile_layouts.json.lock']
@@ -0,0 +1,134 @@
+import math
+from collections import namedtuple
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from capture_writer import CaptureWriter
+from timing_log import TimingLog, columns, frame_info, read_timing_log, sensor_drift
+
+Slot = namedtuple('Slot', ['index', 'deadline', 'started'])
+
+def info(index, interval=10.0, sensor_ns=None):
+    # a frame captured 0.1 s into its slot; the sensor clock is a boot-time clock far from the monotonic one
+    metadata = {'ExposureTime': 5000, 'AnalogueGain': 1.5, 'LensPosition': 2.25}
+    if sensor_ns is not None:
+        metadata['SensorTimestamp'] = sensor_ns
+    slot = Slot(index, index * interval, index * interval + 0.01)
+    return frame_info(slot, index * interval + 0.1, metadata)
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'exp_capture-times.csv')
+    log = TimingLog(path)
+    log.write(info(0, sensor_ns=7_000_000_000), 'saved', queued=0.1, saved=0.35, save_seconds=0.25)
+    log.write(info(1), 'dropped', queued=10.1)
+    log.close()
+
+    with open(path) as f:
+        assert f.readline().strip() == ','.join(columns)
+    times = read_timing_log(path)
+    assert list(times.dtype.names) == columns
+    assert list(times['index']) == [0, 1]
+    assert list(times['status']) == ['saved', 'dropped']
+
+    saved = times[0]
+    assert saved['deadline_s'] == 0.0
+    assert saved['started_s'] == pytest.approx(0.01)
+    assert saved['captured_s'] == pytest.approx(0.1)
+    assert saved['sensor_timestamp_ns'] == 7_000_000_000
+    assert (saved['exposure_us'], saved['analogue_gain'], saved['lens_position']) == (5000, 1.5, 2.25)
+    assert (saved['queued_s'], saved['saved_s'], saved['save_s']) == pytest.approx((0.1, 0.35, 0.25))
+
+    # a dropped frame has no sensor timestamp here and was never saved
+    dropped = times[1]
+    assert dropped['queued_s'] == pytest.approx(10.1)
+    assert math.isnan(dropped['sensor_timestamp_ns'])
+    assert math.isnan(dropped['saved_s']) and math.isnan(dropped['save_s'])
+
+def test_reopening_appends_without_a_second_header(tmp_path):
+    path = str(tmp_path / 'log.csv')
+    for index in range(2):
+        log = TimingLog(path)
+        log.write(info(index), 'saved', 0.0, 0.1, 0.1)
+        log.close()
+    with open(path) as f:
+        assert sum(line.startswith('index,') for line in f) == 1
+    assert list(read_timing_log(path)['index']) == [0, 1]
+
+def test_sorted_by_index(tmp_path):
+    # the writer thread can finish frames after a later dropped frame was logged by the capture loop
+    path = str(tmp_path / 'log.csv')
+    log = TimingLog(path)
+    for index in [1, 3, 0, 2]:
+        log.write(info(index), 'saved')
+    log.close()
+    assert list(read_timing_log(path)['index']) == [0, 1, 2, 3]
+
+def test_ignores_a_truncated_last_row(tmp_path):
+    path = str(tmp_path / 'log.csv')
+    log = TimingLog(path)
+    log.write(info(0), 'saved', 0.0, 0.1, 0.1)
+    log.write(info(1), 'saved', 0.0, 0.1, 0.1)
+    log.close()
+    with open(path) as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text[:-8])  # a crash in the middle of the last row
+    assert list(read_timing_log(path)['index']) == [0]
+
+def test_fsyncs_by_rows_and_by_time(tmp_path):
+    now = [0.0]
+    log = TimingLog(str(tmp_path / 'log.csv'), fsync_rows=3, fsync_seconds=60, clock=lambda: now[0])
+    log.write(info(0), 'saved')
+    log.write(info(1), 'saved')
+    assert log.unsynced == 2
+    log.write(info(2), 'saved')
+    assert log.unsynced == 0
+    log.write(info(3), 'saved')
+    now[0] = 61.0
+    log.write(info(4), 'saved')
+    assert log.unsynced == 0 and log.last_sync == 61.0
+    log.close()
+
+def test_sensor_drift(tmp_path):
+    # the sensor clock runs 1 ms per frame fast; frame 2 has no sensor timestamp
+    path = str(tmp_path / 'log.csv')
+    log = TimingLog(path)
+    start_ns = 5_000_000_000
+    for index in [0, 1, 3]:
+        log.write(info(index, sensor_ns=start_ns + index * 10_001_000_000), 'saved')
+    log.write(info(2), 'dropped')
+    log.close()
+
+    index, offset = sensor_drift(read_timing_log(path), interval=10.0)
+    assert list(index) == [0, 1, 3]
+    assert offset == pytest.approx([0.0, 0.001, 0.003])
+
+class FakeRequest:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.released = False
+
+    def save(self, stream, path):
+        if self.fail:
+            raise OSError('No space left on device')
+
+    def release(self):
+        self.released = True
+
+def test_capture_writer_logs_every_frame(tmp_path):
+    path = str(tmp_path / 'log.csv')
+    log = TimingLog(path)
+    writer = CaptureWriter(queue_size=2, verbose=False, on_done=log.write)
+    requests = [FakeRequest(), FakeRequest(fail=True), FakeRequest()]
+    for index, request in enumerate(requests):
+        writer.submit(request, f'image{index}.jpg', index, info(index))
+    writer.close()
+    log.close()
+
+    assert all(request.released for request in requests)
+    times = read_timing_log(path)
+    assert list(times['index']) == [0, 1, 2]
+    assert list(times['status']) == ['saved', 'failed', 'saved']
+    assert not np.isnan(times['save_s']).any()
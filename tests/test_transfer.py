@@ -0,0 +1,139 @@
+import csv
+import random
+import subprocess
+import threading
+import time
+
+import pytest
+
+from rigtools.transfer import (ProgressReporter, TransferLog, bwlimit_option, parse_rsync_stats, parse_size,
+                               possible_concurrency, run_transfers, transfer_columns)
+
+stats = b'Number of regular files transferred: 3\nTotal transferred file size: 1,500,000 bytes\n'
+
+def kib(option):
+    # '--bwlimit=N' -> N
+    return int(option[0].split('=')[1])
+
+class FakePool:
+    """
+    Stands in for SSHPool.rsync: each transfer takes a random few milliseconds, and the bandwidth shares
+    and concurrency of the rsyncs running at the same time are recorded.
+    """
+    def __init__(self, rigs, seed=0, fail=()):
+        self.access_points = {IP: ap for _, IP, ap in rigs}
+        self.random = random.Random(seed)
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.active = {}
+        self.max_total_kib = 0
+        self.max_running = 0
+        self.max_per_ap = 0
+        self.bwlimits = []
+
+    def rsync(self, IP, source, destination, options=(), check=True, on_output=None):
+        bwlimit = [option for option in options if option.startswith('--bwlimit=')]
+        with self.lock:
+            self.active[IP] = kib(bwlimit) if bwlimit else 0
+            self.bwlimits.append(self.active[IP])
+            self.max_total_kib = max(self.max_total_kib, sum(self.active.values()))
+            self.max_running = max(self.max_running, len(self.active))
+            aps = [self.access_points[active] for active in self.active if self.access_points[active] != '']
+            self.max_per_ap = max([self.max_per_ap] + [aps.count(ap) for ap in aps])
+            duration = self.random.uniform(0, 0.005)
+        time.sleep(duration)
+        with self.lock:
+            del self.active[IP]
+        if IP in self.fail:
+            return subprocess.CompletedProcess(['rsync'], 23, b'', b'rsync error: some files could not be transferred\n')
+        return subprocess.CompletedProcess(['rsync'], 0, stats, b'')
+
+def fleet(count, access_points=3):
+    return [(f'pc{i}', f'10.0.0.{i}', f'ap{i % access_points}') for i in range(count)]
+
+def test_bwlimit_option():
+    assert bwlimit_option(0, 4) == []
+    # 40 MB/s shared by 4 rsyncs, in KiB/s
+    assert bwlimit_option(40, 4) == [f'--bwlimit={int(40e6 / 1024 / 4)}']
+    assert bwlimit_option(40, 0) == bwlimit_option(40, 1)
+
+def test_possible_concurrency():
+    rigs = [('pc1', 'a', 'ap1'), ('pc2', 'b', 'ap1'), ('pc3', 'c', 'ap1'), ('pc4', 'd', 'ap2'), ('pc5', 'e', '')]
+    assert possible_concurrency(rigs, workers=10, ap_limit=0) == 5
+    # ap1 can only run 1 at a time; rigs without an access point are not limited
+    assert possible_concurrency(rigs, workers=10, ap_limit=1) == 3
+    assert possible_concurrency(rigs, workers=2, ap_limit=1) == 2
+    assert possible_concurrency([], workers=4, ap_limit=1) == 0
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('workers, ap_limit', [(4, 0), (8, 2), (3, 1)])
+def test_total_cap_is_never_exceeded(seed, workers, ap_limit):
+    rigs = fleet(20)
+    pool = FakePool(rigs, seed)
+    rows = run_transfers(pool, rigs, 'data/', 'data', workers=workers, total_bwlimit=40, ap_limit=ap_limit)
+
+    assert pool.max_total_kib <= 40e6 / 1024
+    assert pool.max_running <= workers
+    if ap_limit > 0:
+        assert pool.max_per_ap <= ap_limit
+    # the first rsyncs share the cap between as many as can ever run at once; later ones never get less
+    assert min(pool.bwlimits) == kib(bwlimit_option(40, possible_concurrency(rigs, workers, ap_limit)))
+    assert [row[1] for row in rows] == [IP for _, IP, _ in rigs]
+    assert all(row[transfer_columns.index('status')] == 'done' for row in rows)
+
+def test_rows_and_failures(tmp_path):
+    rigs = fleet(4)
+    log = TransferLog(str(tmp_path / 'transfers.csv'))
+    finished = []
+    rows = run_transfers(FakePool(rigs, fail=['10.0.0.2']), rigs, 'data/', 'data', workers=2, on_row=log,
+                         after=lambda rig, row: finished.append(rig[0]))
+    log.close()
+
+    assert sorted(finished) == ['pc0', 'pc1', 'pc2', 'pc3']
+    row = dict(zip(transfer_columns, rows[0]))
+    assert (row['files_transferred'], row['bytes_transferred'], row['exit_code'], row['status']) == (3, 1500000, 0, 'done')
+    failed = dict(zip(transfer_columns, rows[2]))
+    assert (failed['exit_code'], failed['status']) == (23, 'failed')
+    assert 'some files could not be transferred' in failed['error']
+
+    with open(tmp_path / 'transfers.csv') as f:
+        logged = list(csv.DictReader(f))
+    assert sorted(row['rig_number'] for row in logged) == ['pc0', 'pc1', 'pc2', 'pc3']
+
+def test_progress_rows():
+    rows = []
+    reporter = ProgressReporter(('pc1', '10.0.0.1', 'ap1'), interval=0, start=time.monotonic(), start_time='2026-10-17 12:00:00', on_row=rows.append)
+    for line in ['receiving incremental file list', 'image00001.jpg',
+                 '        32,768   3%    0.00kB/s    0:00:00',
+                 '     1,048,576 100%   10.00MB/s    0:00:00 (xfr#1, to-chk=5/7)',
+                 '        2.10M 100%    9.50MB/s    0:00:00 (xfer#2, to-check=4/7)']:
+        reporter(line)
+
+    assert len(rows) == 3
+    progress = dict(zip(transfer_columns, rows[-1]))
+    assert progress['status'] == 'running' and progress['exit_code'] == ''
+    assert (progress['files_transferred'], progress['bytes_transferred']) == (2, 1048576 + 2100000)
+    # a partial file is not counted until it is complete
+    first = dict(zip(transfer_columns, rows[0]))
+    assert (first['files_transferred'], first['bytes_transferred']) == (0, 0)
+
+def test_progress_with_a_fake_rsync():
+    # run_transfers hands progress rows to on_row while the rsync runs
+    class ProgressPool(FakePool):
+        def rsync(self, IP, source, destination, options=(), check=True, on_output=None):
+            assert '--progress' in options
+            on_output('     1,000,000 100%   10.00MB/s    0:00:00 (xfr#1, to-chk=0/1)')
+            return super().rsync(IP, source, destination, options, check)
+
+    rigs = fleet(2)
+    rows = []
+    run_transfers(ProgressPool(rigs), rigs, 'data/', 'data', workers=2, progress_interval=1e-9, on_row=rows.append)
+    statuses = [row[transfer_columns.index('status')] for row in rows]
+    assert statuses.count('running') == 2 and statuses.count('done') == 2
+
+def test_parse_size_and_stats():
+    assert parse_size('1,234,567') == 1234567
+    assert parse_size('1.234.567') == 1234567
+    assert parse_size('1.5M') == 1500000
+    assert parse_rsync_stats(stats.decode()) == (3, 1500000)
+    assert parse_rsync_stats('') == (0, 0)
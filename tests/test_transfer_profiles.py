@@ -0,0 +1,72 @@
+import os
+import subprocess
+
+import pytest
+
+from rigtools import transfer_profiles
+from rigtools.transfer_profiles import benchmark, profile_for, profile_for_folder, profiles, rsync_options
+
+def test_rsync_options():
+    assert rsync_options('media') == ['--whole-file']
+    assert rsync_options('mixed') == ['-z', '--skip-compress=jpg/jpeg/png/h264/mp4/mkv/avi/gz/zip/slp']
+    # a copy, so callers can extend it without changing the profile
+    rsync_options('compress').append('--partial')
+    assert profiles['compress'] == ['-z']
+    with pytest.raises(ValueError, match='Unknown transfer profile'):
+        rsync_options('fast')
+
+@pytest.mark.parametrize('extensions, profile', [
+    (['.jpg', 'JPG', 'h264'], 'media'),
+    (['jpg', '.csv'], 'mixed'),
+    (['txt', 'csv'], 'compress'),
+    ([], 'compress'),
+])
+def test_profile_for(extensions, profile):
+    assert profile_for(extensions) == profile
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+def test_profile_for_folder(tmp_path):
+    write(str(tmp_path / 'exp1' / 'image.jpg'), 10)
+    write(str(tmp_path / 'exp1' / 'nested' / 'video.h264'), 10)
+    write(str(tmp_path / 'README'), 10)  # no extension: ignored
+    assert profile_for_folder(str(tmp_path)) == 'media'
+    write(str(tmp_path / 'exp1' / 'timing.csv'), 10)
+    assert profile_for_folder(str(tmp_path)) == 'mixed'
+
+def test_benchmark(tmp_path, monkeypatch):
+    source, scratch = str(tmp_path / 'source'), str(tmp_path / 'scratch')
+    write(os.path.join(source, 'a.jpg'), 1500000)
+    write(os.path.join(source, 'b.jpg'), 500000)
+    os.makedirs(scratch)
+
+    commands = []
+    def run(command, **kwargs):
+        commands.append(command)
+        return subprocess.CompletedProcess(command, 23 if '-z' in command else 0, None, b'partial transfer')
+    monkeypatch.setattr(transfer_profiles.subprocess, 'run', run)
+
+    rows = benchmark(source + '/', scratch, names=['media', 'compress'])
+    assert [command[:-2] for command in commands] == [['rsync', '-a', '--whole-file'], ['rsync', '-a', '-z']]
+    # each profile gets its own fresh destination, which is removed afterwards
+    assert all(command[-2] == f'{source}/' and command[-1].startswith(f'{scratch}/bench-') for command in commands)
+    assert commands[0][-1] != commands[1][-1]
+    assert os.listdir(scratch) == []
+
+    assert [[name, size, exit_code] for name, _, size, _, exit_code in rows] == [['media', 2.0, 0], ['compress', 2.0, 23]]
+
+def test_benchmark_remote_source(tmp_path, monkeypatch):
+    commands = []
+    def run(command, **kwargs):
+        commands.append(command)
+        # the size of a remote source is measured on the copy
+        write(os.path.join(command[-1], 'a.h264'), 1000000)
+        return subprocess.CompletedProcess(command, 0, None, b'')
+    monkeypatch.setattr(transfer_profiles.subprocess, 'run', run)
+
+    rows = benchmark('/home/plugcamera/data', str(tmp_path), host='plugcamera@10.0.0.1', names=['media'])
+    assert commands[0][-2] == 'plugcamera@10.0.0.1:/home/plugcamera/data/'
+    assert rows[0][0] == 'media' and rows[0][2] == 1.0
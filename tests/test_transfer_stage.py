@@ -0,0 +1,107 @@
+import os
+import shutil
+import stat
+import subprocess
+import sys
+
+import pytest
+
+from rigtools.manifest import append_entry, manifest_name, read_manifest
+from rigtools.transfer_stage import transfer_stage_script
+
+# stand in for ssh and rsync: the 'RPi' is a local folder, reached through user@IP:path
+fake_ssh = '''#!/bin/sh
+for last; do :; done
+exec sh -c "$last"
+'''
+
+# copies the source into the destination, skipping --exclude'd names and printing --out-format lines the way
+# rsync does; the file named in $FAKE_RSYNC_CORRUPT is truncated after the copy, like a broken transfer
+fake_rsync = f'''#!{sys.executable}
+import os, shutil, sys, time
+args = sys.argv[1:]
+source, destination = args[-2].split(':', 1)[-1], args[-1]
+excludes = [a.split('=', 1)[1] for a in args if a.startswith('--exclude=')]
+out_format = any(a.startswith('--out-format=') for a in args)
+for root, dirs, files in os.walk(source):
+    relative = os.path.relpath(root, source)
+    if relative != '.' and out_format:
+        print(f'MANIFEST|cd+++++++++|4096|2025/01/01-00:00:00|{{relative}}')
+    for name in sorted(files):
+        if name in excludes:
+            continue
+        path = os.path.normpath(os.path.join(relative, name))
+        os.makedirs(os.path.join(destination, relative), exist_ok=True)
+        shutil.copy2(os.path.join(root, name), os.path.join(destination, path))
+        if out_format:
+            st = os.stat(os.path.join(root, name))
+            print(f"MANIFEST|>f+++++++++|{{st.st_size}}|{{time.strftime('%Y/%m/%d-%H:%M:%S', time.localtime(int(st.st_mtime)))}}|{{path}}")
+        if path == os.environ.get('FAKE_RSYNC_CORRUPT'):
+            with open(os.path.join(destination, path), 'r+b') as f:
+                f.truncate(1)
+'''
+
+@pytest.fixture
+def rig(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for name, script in [('ssh', fake_ssh), ('rsync', fake_rsync)]:
+        (bin_dir / name).write_text(script)
+        (bin_dir / name).chmod(stat.S_IRWXU)
+    monkeypatch.setenv('PATH', f'{bin_dir}:{os.environ["PATH"]}')
+    monkeypatch.chdir(tmp_path)
+
+    source = tmp_path / 'pi' / 'data'
+    for path, data in [('exp1/video 1.h264', b'x' * 100), ('exp1/a|b.h264', b'y' * 50), ('exp2/image.jpg', b'z' * 10)]:
+        os.makedirs(source / os.path.dirname(path), exist_ok=True)
+        (source / path).write_bytes(data)
+    return tmp_path
+
+def run_stage(tmp_path, **kwargs):
+    if shutil.which('bash') is None:
+        pytest.skip('bash is not installed')
+    stage = transfer_stage_script(username='plugcamera', source=f'{tmp_path}/pi/data/', destination=f'{tmp_path}/copy',
+                                  log_dir=f'{tmp_path}/logs', rsync_opts=['-a', '--whole-file'], **kwargs)
+    script = 'ip=10.0.0.1\nrig=pc1\n' + stage
+    return subprocess.run(['bash', '-c', script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+def files_in(folder):
+    return sorted(os.path.relpath(os.path.join(root, f), folder) for root, dirs, files in os.walk(folder) for f in files)
+
+def test_transfer_verify_delete(rig):
+    result = run_stage(rig, remove_files=True, after_success='echo shutting down')
+    assert result.returncode == 0, result.stdout
+    assert files_in(rig / 'copy') == ['exp1/a|b.h264', 'exp1/video 1.h264', 'exp2/image.jpg']
+    assert sorted(path for path, *_ in read_manifest(str(rig / 'logs' / 'pc1_manifest.tsv'))) == files_in(rig / 'copy')
+    # the files and then the empty folders are removed from the RPi
+    assert os.listdir(rig / 'pi' / 'data') == []
+    assert 'shutting down' in result.stdout
+    assert not os.path.exists(rig / 'FAILED-rsync_pc1_IP-10.0.0.1.out')
+
+def test_nothing_is_removed_if_a_file_does_not_verify(rig, monkeypatch):
+    monkeypatch.setenv('FAKE_RSYNC_CORRUPT', 'exp1/a|b.h264')
+    result = run_stage(rig, remove_files=True, after_success='echo shutting down')
+    assert result.returncode == 1
+    assert 'NOT VERIFIED: exp1/a|b.h264 (size 1 != 50)' in result.stdout
+    assert files_in(rig / 'pi' / 'data') == ['exp1/a|b.h264', 'exp1/video 1.h264', 'exp2/image.jpg']
+    assert 'shutting down' not in result.stdout
+    with open(rig / 'FAILED-rsync_pc1_IP-10.0.0.1.out') as f:
+        assert 'manifest=0 transfer=0 verify=1' in f.read()
+
+def test_files_are_kept_without_remove_files(rig):
+    assert run_stage(rig, remove_files=False).returncode == 0
+    assert files_in(rig / 'pi' / 'data') == files_in(rig / 'copy')
+
+def test_pi_manifest(rig):
+    source = str(rig / 'pi' / 'data')
+    append_entry(source, 'exp1/video 1.h264')  # recorded while recording; the rest is added by update
+    result = run_stage(rig, remove_files=True, manifest_source='pi')
+    assert result.returncode == 0, result.stdout
+    # the RPi's manifest is not copied, and only lists files that are still on the RPi afterwards
+    assert files_in(rig / 'copy') == ['exp1/a|b.h264', 'exp1/video 1.h264', 'exp2/image.jpg']
+    assert os.listdir(source) == [manifest_name]
+    assert read_manifest(os.path.join(source, manifest_name)) == []
+
+def test_unknown_manifest_source():
+    with pytest.raises(ValueError, match="manifest_source must be 'rsync' or 'pi'"):
+        transfer_stage_script('plugcamera', '/data/', '/copy', '/logs', ['-a'], manifest_source='sftp')
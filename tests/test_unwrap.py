@@ -0,0 +1,86 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+from rigtools.unwrap import (blend_weights, extract_frames, grid_offsets, iter_strips, read_tile_configuration, stitch_strips,
+                             write_tile_configuration)
+
+def strip(value, height=6, width=4, channels=()):
+    return np.full((height, width) + channels, value, dtype=np.uint8)
+
+def test_blend_weights_fall_off_towards_the_edges():
+    weights = blend_weights(4, 5)
+    assert weights.shape == (4, 5)
+    assert list(weights[1]) == [2, 4, 6, 4, 2]
+    assert weights.min() == 1 and weights[0, 0] == 1
+    assert np.array_equal(weights, weights[::-1, ::-1])
+
+def test_single_strip_is_unchanged():
+    image = np.arange(24, dtype=np.uint8).reshape(6, 4)
+    assert np.array_equal(stitch_strips([image], [(10.0, 5.0)], width=None), image)
+
+def test_side_by_side_strips():
+    panorama = stitch_strips([strip(10), strip(20)], [(0, 0), (4, 0)], width=None)
+    assert panorama.shape == (6, 8)
+    assert (panorama[:, :4] == 10).all() and (panorama[:, 4:] == 20).all()
+
+def test_overlap_is_blended_linearly():
+    # the strips overlap by two columns; there the left strip's weights are 2, 1 and the right strip's 1, 2
+    panorama = stitch_strips([strip(100), strip(200)], [(0, 0), (2, 0)], width=None)
+    assert panorama.shape == (6, 6)
+    assert list(panorama[3]) == [100, 100, round((2 * 100 + 200) / 3), round((100 + 2 * 200) / 3), 200, 200]
+    # the vertical ramp is the same for both strips, so every row blends the same way
+    assert (panorama == panorama[3]).all()
+
+def test_offsets_are_rounded_and_shifted_to_zero():
+    panorama = stitch_strips([strip(50), strip(150)], [(-10.4, 3.2), (-6.3, 4.6)], width=None)
+    # (-10, 3) and (-6, 5) become (0, 0) and (4, 2)
+    assert panorama.shape == (8, 8)
+    assert (panorama[:6, :4] == 50).all() and (panorama[2:, 4:] == 150).all()
+    # uncovered corners stay black
+    assert (panorama[:2, 4:] == 0).all() and (panorama[6:, :4] == 0).all()
+
+def test_channels_are_kept_and_width_is_cropped():
+    left = strip(0, channels=(3,))
+    left[:, :, 0] = 255  # blue in OpenCV's BGR
+    panorama = stitch_strips([left, strip(0, channels=(3,))], grid_offsets(2, 4, overlap=0), width=5)
+    assert panorama.shape == (6, 5, 3)
+    assert (panorama[:, :4, 0] == 255).all() and (panorama[:, :, 1:] == 0).all()
+
+def test_stitch_errors():
+    with pytest.raises(ValueError):
+        stitch_strips([], [])
+    with pytest.raises(ValueError):
+        stitch_strips([strip(1), strip(2)], [(0, 0)])
+
+def test_grid_offsets():
+    assert np.allclose(grid_offsets(3, 150, overlap=86), [(0, 0), (21, 0), (42, 0)])
+
+def test_tile_configuration_round_trip(tmp_path):
+    offsets = [(0.0, 0.0), (21.3, -0.4), (42.25, 1.0)]
+    write_tile_configuration(offsets, str(tmp_path / 'TileConfiguration.txt'))
+    assert read_tile_configuration(str(tmp_path / 'TileConfiguration.txt')) == offsets
+
+@pytest.fixture
+def video(tmp_path):
+    # frame i is filled with 10 * i, so the kept frames can be told apart after lossy encoding
+    path = str(tmp_path / 'vial.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+    if not writer.isOpened():
+        pytest.skip('no MJPG encoder in this OpenCV build')
+    for i in range(20):
+        writer.write(np.full((48, 64, 3), 10 * i, dtype=np.uint8))
+    writer.release()
+    return path
+
+def test_iter_strips_keeps_every_interval_th_frame(video):
+    strips = list(iter_strips(video, interval=5, crop=(20, 30), stop_frame=12))
+    assert [i for i, _ in strips] == [0, 1, 2]
+    assert all(s.shape == (48, 10, 3) for _, s in strips)
+    assert [int(round(s.mean() / 10)) for _, s in strips] == [0, 5, 10]
+
+def test_extract_frames_writes_the_strips(video, tmp_path):
+    paths = extract_frames(video, interval=8, save_path=str(tmp_path), crop=(0, 16))
+    assert [p.rsplit('/', 1)[-1] for p in paths] == ['000.jpg', '001.jpg', '002.jpg']
+    assert cv2.imread(paths[1]).shape == (48, 16, 3)
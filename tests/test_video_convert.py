@@ -0,0 +1,26 @@
+import shlex
+
+from rigtools.video_convert import h264_to_mp4_command, jpgs_to_mp4_command
+
+def test_h264_to_mp4_is_one_pass():
+    args = shlex.split(h264_to_mp4_command('/data/a b.h264', '/data/a b_ctrl.mp4', '/data/a b_ctrl_1fps.mp4'))
+    # one input, read once, and both outputs written from it
+    assert args[0] == 'ffmpeg' and args.count('-i') == 1
+    assert args[args.index('-i') + 1] == '/data/a b.h264'
+    remux = args.index('/data/a b_ctrl.mp4')
+    assert args[remux - 2:remux] == ['-c:v', 'copy']
+    assert args[-1] == '/data/a b_ctrl_1fps.mp4'
+    assert 'fps=1,setpts=N/(24*TB)' in args and args[args.index('-r') + 1] == '24'
+
+def test_h264_to_mp4_keeps_bash_variables():
+    # SBATCH templates pass ${file}; the double quotes keep it expandable
+    command = h264_to_mp4_command('${file}.h264', '${file}_c.mp4', '${file}_c_1fps.mp4', sample_fps=2, playback_fps=30, crf=20)
+    assert '"${file}.h264"' in command
+    assert 'fps=2,setpts=N/(30*TB)' in command and '-crf 20' in command
+
+def test_jpgs_to_mp4_crops_in_the_same_pass():
+    args = shlex.split(jpgs_to_mp4_command('/raw/rig1', '/mp4s/rig1.mp4', framerate=7, crop='1750:1750:1430:360'))
+    assert args[args.index('-i') + 1] == '/raw/rig1/*.jpg'
+    assert args[args.index('-filter:v') + 1] == 'crop=1750:1750:1430:360'
+    assert args[-1] == '/mp4s/rig1.mp4'
+    assert '-filter:v' not in jpgs_to_mp4_command('/raw/rig1', '/mp4s/rig1.mp4')
@@ -0,0 +1,60 @@
+import pytest
+
+from video_timelapse import record_segments, segment_paths, video_configuration
+
+class Picamera2:
+    # records what the timelapse asks of the camera
+    def __init__(self):
+        self.calls = []
+
+    def create_video_configuration(self, **kwargs):
+        return kwargs
+
+    def start_encoder(self, encoder, output):
+        self.calls.append(('start', output))
+
+    def stop_encoder(self):
+        self.calls.append(('stop',))
+
+def test_jpg_streams_faster_than_the_timelapse():
+    config = video_configuration(Picamera2(), 'jpg', interval=2, queue_size=3)
+    assert config['main'] == {'size': (2304, 1296)}
+    assert config['buffer_count'] == 5
+    # 10 fps, so a capture slot never waits more than 0.1 s for a frame
+    assert config['controls'] == {'FrameDurationLimits': (100000, 100000)}
+    # above the stream rate the stream follows the timelapse
+    assert video_configuration(Picamera2(), 'jpg', interval=0.05)['controls'] == {'FrameDurationLimits': (50000, 50000)}
+
+def test_h264_streams_at_the_timelapse_rate():
+    config = video_configuration(Picamera2(), 'h264', interval=0.5, lores={'size': (320, 240)})
+    assert config['main'] == {'size': (1920, 1080)} and config['lores'] == {'size': (320, 240)}
+    assert config['controls'] == {'FrameDurationLimits': (500000, 500000)}
+    assert video_configuration(Picamera2(), 'h264', interval=0.5, size=(1280, 720))['main'] == {'size': (1280, 720)}
+
+def test_segment_paths():
+    assert segment_paths('data/exp/exp', 12) == ('data/exp/exp_segment0012.h264', 'data/exp/exp_segment0012_timestamps.txt')
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def test_record_segments(monkeypatch):
+    pytest.importorskip('picamera2')
+    from picamera2 import encoders, outputs
+    monkeypatch.setattr(encoders, 'H264Encoder', lambda bitrate, iperiod: ('encoder', bitrate, iperiod))
+    monkeypatch.setattr(outputs, 'FileOutput', lambda path, pts: (path, pts))
+
+    picam2, clock = Picamera2(), Clock()
+    segments = record_segments(picam2, interval=0.5, duration=150, path_prefix='exp', segment_seconds=100, clock=clock.clock, sleep=clock.sleep)
+    assert segments == [segment_paths('exp', 0), segment_paths('exp', 1)]
+    assert picam2.calls == [('start', segment_paths('exp', 0)), ('stop',), ('start', segment_paths('exp', 1)), ('stop',)]
+    # sleeps of at most a minute, and the last segment ends with the timelapse
+    assert clock.sleeps == [60, 40, 50]
@@ -4,6 +4,10 @@
 # restarting those RPis and waiting before each retry.
 # If any attempt fails, a failure-history CSV is written to the save folder.
 # If rigs still fail at the end, a final-failures CSV is also written.
+# Connectivity tests, launches, checks and restarts run on up to -w/--workers rigs at the same time (16 by default),
+# so first frames across rigs start within seconds of each other; -w 1 runs the rigs one after another as before.
+# After launching, each rig is polled for its first image and marked as started as soon as it appears
+# (or as failed as soon as the timelapse script exits), up to --start-deadline seconds.
 
 # You will need to install `sshpass`. If using macOS, run the following commands to 1) install homebrew and then 2) install sshpass:
 #  1. /bin/bash -c "$(curl -fsSL https://raw.githubusercontent.com/Homebrew/install/HEAD/install.sh)"
@@ -22,7 +26,12 @@ from datetime import datetime
 import os
 import argparse
 import time
-import shlex
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rigtools.fleet import probe_hosts, probe_columns, run_parallel
+from rigtools.ssh_pool import SSHPool
+from rigtools.remote_batch import run_batch, first_failure
 
 # default argument values
 timeout = 10
@@ -34,9 +43,13 @@ duration = 518400 # total time of timelapse, in seconds
 interval = 600 # time between acquisitions, in seconds
 experiment_name ='exp' # will create a folder with this name
 focus_in_loop = False # do you autofocus before each capture, probably won't work for <3s intervals
+capture_mode = 'still' # 'still', or 'jpg'/'h264' from a streaming video configuration for ~1-2 Hz timelapses
 sleep_time = 0 
 retries = 0
 reboot_wait = 120
+workers = 16 # RPis contacted at the same time (never more than there are rigs); 1 for one after another
+start_deadline = 120
+poll_interval = 5
 
 # pulling user-input variables from command line
 # note that the default timeout = 10 and default username = 'plugcamera' for SSH connections
@@ -48,12 +61,16 @@ parser.add_argument('-s', '--save-path', type=str, default=save_path, help='The
 parser.add_argument('-t', '--timeout', type=int, default=timeout, help='Number of seconds to attempt SSH connection')
 parser.add_argument('-u', '--username', type=str, default=username, help='username for SSH attempts')
 parser.add_argument('-d', '--duration', type=int, default=duration, help='acquisition duration in seconds')
-parser.add_argument('-i', '--interval', type=int, default=interval, help='acquisition interval between frames in seconds')
+parser.add_argument('-i', '--interval', type=float, default=interval, help='acquisition interval between frames in seconds')
 parser.add_argument('-e', '--experiment-name', type=str, required=True, default=experiment_name, help='name of experiment, will create a folder')
-parser.add_argument('-f', '--focus-in-loop', type=bool, default=focus_in_loop, help='whether to run an autofocus cycle for each frame acquisition')
-parser.add_argument('-sl', '--sleep-time', type=int, default=sleep_time, help='sleep time between triggering acquisitions on each RPi')
+parser.add_argument('-f', '--focus-in-loop', action='store_true', help='run an autofocus cycle before every frame acquisition')
+parser.add_argument('-c', '--capture-mode', type=str, default=capture_mode, choices=['still', 'jpg', 'h264'], help='still captures, or jpg frames / h264 segments from a streaming video configuration')
+parser.add_argument('-sl', '--sleep-time', type=int, default=sleep_time, help='sleep time between triggering acquisitions on each RPi (per worker when using --workers)')
 parser.add_argument('--retries', type=int, default=retries, help='number of times to retry failed acquisitions')
-parser.add_argument('--reboot-wait', type=int, default=reboot_wait, help='seconds to wait after rebooting failed RPis before retrying')
+parser.add_argument('--reboot-wait', type=int, default=reboot_wait, help='maximum seconds to wait for rebooted RPis to come back before retrying')
+parser.add_argument('--start-deadline', type=int, default=start_deadline, help='maximum seconds to wait for the first image after launching')
+parser.add_argument('--poll-interval', type=int, default=poll_interval, help='seconds between checks for first images and rebooted RPis')
+parser.add_argument('-w', '--workers', type=int, default=workers, help='number of RPis launched/checked at the same time (at most the number of rigs); 1 runs them one after another')
 
 # ingesting user-input arguments
 args = parser.parse_args()
@@ -67,14 +84,24 @@ duration = args.duration
 interval = args.interval
 experiment_name = args.experiment_name
 focus_in_loop = args.focus_in_loop
+capture_mode = args.capture_mode
 sleep_time = args.sleep_time
 retries = args.retries
 reboot_wait = args.reboot_wait
+workers = args.workers
+start_deadline = args.start_deadline
+poll_interval = args.poll_interval
 
 if retries < 0:
     parser.error('--retries must be a non-negative integer')
 if reboot_wait < 0:
     parser.error('--reboot-wait must be a non-negative integer')
+if workers < 1:
+    parser.error('--workers must be a positive integer')
+if start_deadline < 0:
+    parser.error('--start-deadline must be a non-negative integer')
+if poll_interval < 1:
+    parser.error('--poll-interval must be a positive integer')
 
 # pull IP address data
 data = pd.read_csv(ip_path)
@@ -97,24 +124,18 @@ batch_start = now
 
 # check how many IPs could be connected to
 
+# one persistent SSH connection per rig is opened here and reused by every later command
+pool = SSHPool(username=username, password=password, timeout=timeout)
+
 print('\nTESTING SSH CONNECTIVITY...')
-IPs_connected = []
-for i, IP in enumerate(IPs):
-    ssh_command = f'sshpass -p {shlex.quote(password)} ssh -o StrictHostKeyChecking=no -o ConnectTimeout={timeout} {username}@{IP} echo Connection to {IP} successful'
-    result = subprocess.run(ssh_command, shell=True)
-    if result.returncode == 0:
-        result = 1
-    else:
-        print(f"Failed to connect to 'pc{rig_num[i]}' [{IP}]")
-        result = 0
-    IPs_connected.append([f'pc{rig_num[i]}', IP, result])
+IPs_connected = probe_hosts(IPs, rig_num, password, username, timeout, workers=workers, pool=pool)
 
 # Check if a save folder exists already and create it if not
 if not os.path.exists(save_path):
     os.makedirs(save_path)
 
 # export data on SSH connectivity
-IPs_connected = pd.DataFrame(IPs_connected, columns=['rig_number','IP', 'SSH_worked'])
+IPs_connected = pd.DataFrame(IPs_connected, columns=probe_columns)
 frac_connected = sum(IPs_connected.SSH_worked==1)/len(IPs_connected.SSH_worked)
 IPs_connected.to_csv(f'{save_path}/{batch_start}_IPs-connected_{frac_connected*100:.0f}%.csv', index=0)
 
@@ -125,8 +146,7 @@ timings = ['']*len(IPs)
 failure_history = []
 
 def run_remote(IP, remote_command, check=True):
-    ssh_command = f'sshpass -p {shlex.quote(password)} ssh -o StrictHostKeyChecking=no -o ConnectTimeout={timeout} {username}@{IP} {shlex.quote(remote_command)}'
-    return subprocess.run(ssh_command, shell=True, check=check, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return pool.run(IP, remote_command, check=check)
 
 def format_subprocess_error(e):
     err = e.stderr.decode(errors='replace').strip() if e.stderr else ''
@@ -167,27 +187,30 @@ def launch_timelapse(i, attempt):
         if timings[i] == '':
             timings[i] = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
+        # use the first intended time for folder naming, including retries
+        folder_time = timings[i]
+        # -f is a flag: only passed when set ('-f False' used to switch per-frame autofocus on)
+        focus_option = ' -f' if focus_in_loop else ''
+        run_script = f'nohup python plug-camera_timelapse.py -r {rig_name} -e {experiment_name} -d {duration} -i {interval}{focus_option} -c {capture_mode} -t {folder_time} > python.log 2>&1 &'
+
         # pull the current time via local system and change Raspberry Pi time to that
         now = datetime.now().strftime("%m%d%H%M%Y.%S")
-        result = run_remote(IP, f'sudo date {now}')
-
-        #print(f'Changed time to {now} on {rig_num[i]} [{IP}]')
-
-        # check if the date actually changed and print the changed date
-        result = run_remote(IP, 'date')
-
-        # delete any old log files
-        run_remote(IP, 'rm -f python.log')
 
-        #print(f'Time is now {result.stdout}')
-
-        # use the first intended time for folder naming, including retries
-        now = timings[i]
-
-        # actually run the script to acquire timelapse data
-        rig_name = f'pc{rig_num[i]}'
-        run_script = f'nohup python plug-camera_timelapse.py -r {rig_name} -e {experiment_name} -d {duration} -i {interval} -f {focus_in_loop} -t {now} > python.log 2>&1 &'
-        result = run_remote(IP, run_script)
+        # set the date, check it changed, delete any old log files, and run the script to acquire timelapse data
+        # all in a single SSH round trip; the batch stops at the first failing step
+        steps = [
+            ('set_date', f'sudo date {now}'),
+            ('read_date', 'date'),
+            ('remove_log', 'rm -f python.log'),
+            ('launch', run_script),
+        ]
+        results = run_batch(pool, IP, steps)
+
+        failed = first_failure(results)
+        if failed is not None:
+            err = (failed.output or f'exit code {failed.returncode}').replace('\n', ' | ')
+            print(f"Script failed on {rig_name} [{IP}] at step {failed.name} with error: {err}")
+            return False, f'LAUNCH_FAILED: {failed.name}: {err}'
 
         time.sleep(sleep_time)
         return True, ''
@@ -203,24 +226,63 @@ def launch_timelapse(i, attempt):
         print(f"Script failed on {rig_name} [{IP}]")
         return False, 'LAUNCH_UNKNOWN_ERROR'
 
+def first_image_path(i):
+    now = timings[i]
+    rig_name = f'pc{rig_num[i]}'
+    if capture_mode == 'h264':
+        return f'/home/plugcamera/data/{now}_{rig_name}_{experiment_name}/{now}_{rig_name}_{experiment_name}_segment0000.h264'
+    return f'/home/plugcamera/data/{now}_{rig_name}_{experiment_name}/{now}_{rig_name}_{experiment_name}_image00000.jpg'
+
+def poll_timelapse(i):
+    # one cheap round trip: has the first image appeared, and is the timelapse script still running?
+    # '[p]lug...' matches the script but not the remote shell running this command, whose command line contains the pattern
+    poll_script = f"if [ -f {first_image_path(i)} ]; then echo started; elif pgrep -f '[p]lug-camera_timelapse.py' >/dev/null; then echo waiting; else echo stopped; fi"
+    try:
+        return run_remote(IPs[i], poll_script).stdout.decode().strip()
+    except Exception:
+        return 'unreachable'
+
+def wait_for_first_images(launched):
+    """
+    Poll launched rigs until each has acquired its first image, its timelapse script has stopped,
+    or start_deadline has passed.
+
+    :return: list of rigs that have not (yet) acquired an image, to be checked in detail
+    """
+    print(f'Waiting up to {start_deadline} seconds for first images...\n')
+    deadline = time.monotonic() + start_deadline
+    started = set()
+    pending = list(launched)
+
+    while len(pending) > 0:
+        states = run_parallel(poll_timelapse, pending, workers=workers)
+        for i, state in zip(pending, states):
+            if state == 'started':
+                started.add(i)
+                print(f'First image acquired on pc{rig_num[i]} [{IPs[i]}]')
+
+        # rigs whose script already exited are not worth waiting for
+        pending = [i for i, state in zip(pending, states) if state in ['waiting', 'unreachable']]
+        if len(pending) == 0 or time.monotonic() >= deadline:
+            break
+        time.sleep(min(poll_interval, max(0, deadline - time.monotonic())))
+
+    return [i for i in launched if i not in started]
+
 def check_timelapse_started(i, attempt):
     IP = IPs[i]
     rig_name = f'pc{rig_num[i]}'
     try:
         # check if RPi actually acquired an image
-        now = timings[i]
-
-        check_script = f'ls /home/plugcamera/data/{now}_{rig_name}_{experiment_name}/{now}_{rig_name}_{experiment_name}_image00000.jpg >/dev/null 2>&1 && echo "First image acquired on {rig_name} [{IP}]" || echo "No acquisition detected on {rig_name} [{IP}]!"'
+        check_script = f'ls {first_image_path(i)} >/dev/null 2>&1 && echo "First image acquired on {rig_name} [{IP}]" || echo "No acquisition detected on {rig_name} [{IP}]!"'
         check_result = run_remote(IP, check_script)
         feedback = check_result.stdout.decode().strip()
-        #print(f'Checking: /home/plugcamera/data/{now}_{rig_name}_{experiment_name}/{now}_{rig_name}_{experiment_name}_image00000.jpg')
         print(feedback)
 
         if(feedback==f"No acquisition detected on {rig_name} [{IP}]!"):
             output = read_python_log(IP)
-            for line in output.splitlines(): 
-                print(f'\t{line}')
-            print('')
+            # print the log as one block so output from parallel checks doesn't interleave
+            print(''.join(f'\t{line}\n' for line in output.splitlines()))
             return False, 'NO_FIRST_IMAGE', output
 
         return True, '', ''
@@ -236,15 +298,57 @@ def check_timelapse_started(i, attempt):
         print(f"Script failed on {rig_name} [{IP}]")
         return False, 'CHECK_UNKNOWN_ERROR', ''
 
+def read_boot_id(IP):
+    # changes on every boot, so it tells us when a rig has actually restarted
+    try:
+        return run_remote(IP, 'cat /proc/sys/kernel/random/boot_id').stdout.decode().strip()
+    except Exception:
+        return ''
+
 def restart_rig(i):
     IP = IPs[i]
     rig_name = f'pc{rig_num[i]}'
+    # without the current boot id there is no way to tell when the restart happened, so only restart rigs that report one
+    pool.connect(IP, retry=True)
+    boot_id = read_boot_id(IP)
+    if boot_id == '':
+        print(f'Could not read the boot id of {rig_name} [{IP}], not restarting it; waiting for it to be reachable')
+        return boot_id
+
     print(f'Restarting {rig_name} [{IP}] before retry')
     try:
-        run_remote(IP, 'pkill -f plug-camera_timelapse.py || true', check=False)
+        # '[p]lug...' so pkill does not also kill the remote shell running this command
+        run_remote(IP, "pkill -f '[p]lug-camera_timelapse.py' || true", check=False)
         run_remote(IP, 'sudo shutdown -r now', check=False)
+        pool.close(IP) # the shared connection dies with the reboot
     except Exception as e:
         print(f'\tCould not restart {rig_name} [{IP}]: {e}')
+    return boot_id
+
+def wait_for_reboot(rigs, boot_ids):
+    # poll until every restarted rig reports a new boot id, up to reboot_wait seconds
+    # rigs that were not restarted (no boot id) only need to be reachable again
+    print(f'Waiting up to {reboot_wait} seconds for RPis to restart...\n')
+    deadline = time.monotonic() + reboot_wait
+    pending = list(rigs)
+
+    while len(pending) > 0 and time.monotonic() < deadline:
+        time.sleep(min(poll_interval, max(0, deadline - time.monotonic())))
+
+        def rebooted(i):
+            if not pool.connect(IPs[i], retry=True):
+                return False
+            new_id = read_boot_id(IPs[i])
+            if new_id != '' and new_id != boot_ids[i]:
+                return True  # a new boot, or (not restarted) reachable again
+            pool.close(IPs[i]) # still the old boot (or shutting down); reconnect on the next poll
+            return False
+
+        states = run_parallel(rebooted, pending, workers=workers)
+        pending = [i for i, worked in zip(pending, states) if not worked]
+
+    if len(pending) > 0:
+        print(f'{len(pending)} RPi(s) not back after {reboot_wait} seconds, retrying anyway\n')
 
 ###################
 # run script on all RPis in batch
@@ -257,17 +361,16 @@ for attempt in range(1, rounds + 1):
 
     if attempt > 1:
         print(f'\nRESTARTING FAILED RPIS BEFORE ATTEMPT {attempt}/{rounds}...')
-        for i in to_process:
-            restart_rig(i)
-
-        print(f'{reboot_wait}-second pause for RPis to restart...\n')
-        time.sleep(reboot_wait)
+        boot_ids = run_parallel(restart_rig, to_process, workers=workers)
+        wait_for_reboot(to_process, dict(zip(to_process, boot_ids)))
 
     print(f'RUNNING TIMELAPSES... ATTEMPT {attempt}/{rounds}')
     launched = []
     next_fail = []
-    for i in to_process:
-        worked, error = launch_timelapse(i, attempt)
+
+    # rigs are launched on a thread pool; failures are recorded afterwards, in rig order
+    results = run_parallel(lambda i: launch_timelapse(i, attempt), to_process, workers=workers)
+    for i, (worked, error) in zip(to_process, results):
         if worked:
             launched.append(i)
         else:
@@ -275,19 +378,19 @@ for attempt in range(1, rounds + 1):
             next_fail.append(i)
 
     if len(launched) > 0:
-        wait = 120
-        print(f'{wait}-second pause...\n')
-        time.sleep(wait)
-
         print('TESTING WHETHER TIMELAPSES STARTED...')
-        for i in launched:
-            worked, error, log_text = check_timelapse_started(i, attempt)
+        not_started = wait_for_first_images(launched)
+
+        # rigs without a first image get a final check, which also pulls their python.log
+        results = run_parallel(lambda i: check_timelapse_started(i, attempt), not_started, workers=workers)
+        for i, (worked, error, log_text) in zip(not_started, results):
             if not worked:
                 add_failure(i, attempt, error, log_text)
                 next_fail.append(i)
 
     to_process = next_fail
 
+pool.close_all()
 print('')
 
 if len(failure_history) > 0:
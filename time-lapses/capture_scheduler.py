@@ -0,0 +1,99 @@
+## Drift-free capture scheduling for timelapses
+# capture slots are fixed on a grid (slot i is due interval * i seconds after the start) and timed with the
+# monotonic clock, so `sudo date` from the batch script or NTP/cron changing the wall clock cannot bunch or stretch frames
+# a capture that starts late is reported, and slots missed entirely are either skipped (the timelapse stays on its grid)
+# or caught up (fired back to back, so the number of frames stays the same)
+# copy this file next to plug-camera_timelapse.py on the RPi; it only uses the standard library
+
+# Example usage
+# scheduler = CaptureScheduler(interval=600, num_captures=865, missed_policy='skip')
+# for slot in scheduler:
+#     capture(f'image{str(slot.index).zfill(5)}.jpg')
+# print(scheduler.summary())
+
+import time
+from collections import namedtuple
+
+# skip: drop slots whose time has already passed and continue with the latest due slot
+# catchup: run every slot, back to back until the schedule is met again
+missed_policies = ['skip', 'catchup']
+
+# deadline and started are seconds since the start of the timelapse, on the monotonic clock
+Slot = namedtuple('Slot', ['index', 'deadline', 'started', 'lateness'])
+
+class CaptureScheduler:
+    def __init__(self, interval, num_captures, missed_policy='skip', clock=time.monotonic, sleep=time.sleep, verbose=True):
+        """
+        :param interval: seconds between slots
+        :param num_captures: number of slots
+        :param missed_policy: 'skip' or 'catchup'
+        :param clock: monotonic clock (replaceable for simulations)
+        :param sleep: sleep function (replaceable for simulations)
+        """
+        if missed_policy not in missed_policies:
+            raise ValueError(f"missed_policy must be one of {missed_policies}, not '{missed_policy}'")
+        self.interval = interval
+        self.num_captures = num_captures
+        self.missed_policy = missed_policy
+        self.clock = clock
+        self.sleep = sleep
+        self.verbose = verbose
+
+        self.start = None
+        self.slots = []     # every slot that ran
+        self.durations = [] # seconds each slot's work took
+        self.missed = []    # indices of skipped slots
+
+    def elapsed(self):
+        return self.clock() - self.start
+
+    def wait_until(self, deadline):
+        # time.sleep can return early on signals, so keep sleeping until the monotonic deadline has passed
+        while True:
+            remaining = deadline - self.elapsed()
+            if remaining <= 0:
+                return
+            self.sleep(remaining)
+
+    def __iter__(self):
+        self.start = self.clock()
+        i = 0
+        while i < self.num_captures:
+            self.wait_until(i * self.interval)
+            started = self.elapsed()
+
+            if self.missed_policy == 'skip':
+                # the latest slot that is already due; everything before it is dropped
+                latest = min(int(started // self.interval), self.num_captures - 1)
+                if latest > i:
+                    self.missed.extend(range(i, latest))
+                    if self.verbose:
+                        print(f'Missed slots {i}-{latest - 1}, continuing with slot {latest}')
+                    i = latest
+
+            deadline = i * self.interval
+            slot = Slot(i, deadline, started, started - deadline)
+            self.slots.append(slot)
+            yield slot
+
+            duration = self.elapsed() - started
+            self.durations.append(duration)
+            if duration > self.interval and self.verbose:
+                print(f'Slot {i} took {duration:.3f}s, longer than the {self.interval}s interval')
+            i += 1
+
+    def summary(self):
+        """
+        :return: dict of jitter statistics: lateness is how long after its deadline each slot started
+        """
+        lateness = sorted(slot.lateness for slot in self.slots)
+        count = len(lateness)
+        return {
+            'captures': count,
+            'missed': len(self.missed),
+            'overruns': sum(duration > self.interval for duration in self.durations),
+            'lateness_mean_s': sum(lateness) / count if count > 0 else 0,
+            'lateness_median_s': lateness[count // 2] if count > 0 else 0,
+            'lateness_max_s': lateness[-1] if count > 0 else 0,
+            'duration_max_s': max(self.durations, default=0),
+        }
@@ -0,0 +1,131 @@
+## Background JPEG encode/save for timelapses
+# the capture loop hands each completed capture request to a writer thread through a bounded queue and returns straight away,
+# so the JPEG encode and SD-card write (the 150-300 ms 'camera delay') no longer sit between two captures
+# every queued request holds one camera buffer until it is saved and released, so the camera needs queue_size + 2 buffers
+# (queued, being saved, and the next capture; see still_configuration) and the queue is kept small: a full 12MP buffer is ~36 MB on a 512 MB Pi Zero 2 W
+# copy this file next to plug-camera_timelapse.py on the RPi; it only uses the standard library
+
+# Example usage
+# picam2.configure(still_configuration(picam2, queue_size=2))
+# writer = CaptureWriter(queue_size=2, full_policy='block')
+# for slot in scheduler:
+#     writer.submit(picam2.capture_request(), f'image{str(slot.index).zfill(5)}.jpg', slot.index)
+# writer.close()
+# print(writer.summary())
+
+import queue
+import threading
+import time
+from collections import namedtuple
+
+# block: wait for the writer to free a place, so every capture is saved and the loop slows down (the scheduler then reports late/missed slots)
+# drop: release the new request unsaved, so the loop keeps its timing and the frame is lost
+full_policies = ['block', 'drop']
+
+# seconds on the monotonic clock: queued is when the request was handed over, saved when its file was written
+SavedImage = namedtuple('SavedImage', ['index', 'path', 'queued', 'saved', 'save_seconds'])
+
+def still_configuration(picam2, queue_size, **kwargs):
+    """
+    :return: still configuration with enough buffers for queue_size queued requests, the one being saved and the next capture
+    """
+    return picam2.create_still_configuration(buffer_count=queue_size + 2, **kwargs)
+
+class CaptureWriter:
+    def __init__(self, queue_size=2, full_policy='block', stream='main', clock=time.monotonic, verbose=True, on_done=None):
+        """
+        :param queue_size: requests that can wait to be saved; each holds a camera buffer
+        :param full_policy: 'block' or 'drop', what submit does while the queue is full
+        :param stream: camera stream to save
+        :param on_done: optional function(info, status, queued, saved, save_seconds), called for every submitted frame once it
+                        is saved ('saved'), dropped ('dropped') or failed to save ('failed'); e.g. TimingLog.write
+        """
+        if full_policy not in full_policies:
+            raise ValueError(f"full_policy must be one of {full_policies}, not '{full_policy}'")
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.full_policy = full_policy
+        self.stream = stream
+        self.clock = clock
+        self.verbose = verbose
+        self.on_done = on_done
+
+        self.saved = []     # SavedImage for every written file
+        self.dropped = []   # indices released unsaved because the queue was full
+        self.failed = []    # (index, error) for saves that raised
+        self.blocked_seconds = 0.0
+        self.max_queued = 0
+
+        self.thread = threading.Thread(target=self.run, name='capture-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, request, path, index=None, info=None):
+        """
+        Hand a completed capture request over to the writer; it is saved to path and released there.
+
+        :param info: passed on to on_done (e.g. timing_log.frame_info); read anything needed from the request before submitting
+        :return: True if queued, False if it was dropped
+        """
+        info = info if info is not None else {'index': index}
+        item = (request, path, index, info, self.clock())
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            if self.full_policy == 'drop':
+                request.release()
+                self.dropped.append(index)
+                if self.verbose:
+                    print(f'Writer queue full, dropped image {index}')
+                if self.on_done is not None:
+                    self.on_done(info, 'dropped', item[-1])
+                return False
+            start = self.clock()
+            self.queue.put(item)
+            self.blocked_seconds += self.clock() - start
+        self.max_queued = max(self.max_queued, self.queue.qsize())
+        return True
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            request, path, index, info, queued = item
+            start = self.clock()
+            try:
+                request.save(self.stream, path)
+                saved = self.clock()
+                self.saved.append(SavedImage(index, path, queued, saved, saved - start))
+                status = 'saved'
+            except Exception as e:
+                saved = self.clock()
+                self.failed.append((index, str(e)))
+                print(f'Failed to save image {index} to {path}: {e}')
+                status = 'failed'
+            finally:
+                # always give the buffer back, or the camera runs out of them and capture_request hangs
+                request.release()
+
+            if self.on_done is not None:
+                try:
+                    self.on_done(info, status, queued, saved, saved - start)
+                except Exception as e:
+                    print(f'Failed to record image {index}: {e}')
+
+    def close(self):
+        # wait for everything queued to be saved
+        self.queue.put(None)
+        self.thread.join()
+
+    def summary(self):
+        save_seconds = sorted(image.save_seconds for image in self.saved)
+        count = len(save_seconds)
+        return {
+            'saved': count,
+            'dropped': len(self.dropped),
+            'failed': len(self.failed),
+            'max_queued': self.max_queued,
+            'blocked_s': self.blocked_seconds,
+            'save_median_s': save_seconds[count // 2] if count > 0 else 0,
+            'save_max_s': save_seconds[-1] if count > 0 else 0,
+            'latency_max_s': max((image.saved - image.queued for image in self.saved), default=0),
+        }
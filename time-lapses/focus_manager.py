@@ -0,0 +1,142 @@
+## Focus caching and refocusing for timelapses
+# instead of an autofocus cycle before every frame (seconds per capture), focus is found once, the lens is locked at that
+# position with manual LensPosition (as the video-recording scripts do), and the position is cached per rig
+# refocusing only happens on a schedule, or when a cheap sharpness score of the small lores stream of captured frames
+# drops well below its value right after the last focus (for a few frames in a row, so a larva crossing the view does not trigger it)
+# copy this file next to plug-camera_timelapse.py on the RPi
+
+# Example usage
+# picam2.configure(picam2.create_still_configuration(lores=lores_stream))
+# picam2.start()
+# focus = FocusManager(picam2, rig_name, 'focus_cache.json', refocus_every=6 * 3600)
+# focus.start()
+# for slot in scheduler:
+#     r = picam2.capture_request()
+#     reason = focus.check(r)
+#     writer.submit(r, ...)
+#     if reason is not None:
+#         focus.refocus(reason)
+
+import json
+import os
+import time
+
+import numpy as np
+from libcamera import controls
+
+# small YUV420 stream delivered with every capture, used only for the sharpness score
+lores_stream = {'size': (320, 240)}
+
+def sharpness(yuv):
+    """
+    :param yuv: lores YUV420 array (height * 3/2 rows; the first height rows are the luminance)
+    :return: squared gradient energy of the luminance, normalised by its mean brightness so lighting changes alone do not move it much
+    """
+    y = yuv[:yuv.shape[0] * 2 // 3].astype(np.float32)
+    energy = np.mean(np.diff(y, axis=0) ** 2) + np.mean(np.diff(y, axis=1) ** 2)
+    return float(energy / max(np.mean(y), 1.0) ** 2)
+
+def read_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+def write_cache(cache_path, cache):
+    # written to a temporary file first, so a reboot during the write never leaves a broken cache
+    with open(f'{cache_path}.tmp', 'w') as f:
+        json.dump(cache, f, indent=1)
+    os.replace(f'{cache_path}.tmp', cache_path)
+
+class FocusManager:
+    def __init__(self, picam2, rig_name, cache_path, refocus_every=0, sharpness_drop=0.7, patience=3, use_cached=False, clock=time.monotonic):
+        """
+        :param refocus_every: seconds between scheduled refocus cycles; 0 for none
+        :param sharpness_drop: refocus when sharpness falls below this fraction of its value after the last focus; 0 to disable
+        :param patience: consecutive low-sharpness frames needed before refocusing
+        :param use_cached: lock the cached lens position for this rig at start instead of running an autofocus cycle
+        """
+        self.picam2 = picam2
+        self.rig_name = rig_name
+        self.cache_path = cache_path
+        self.refocus_every = refocus_every
+        self.sharpness_drop = sharpness_drop
+        self.patience = patience
+        self.use_cached = use_cached
+        self.clock = clock
+
+        self.lens_position = None
+        self.reference = None   # sharpness of the first frame after the last focus
+        self.low_frames = 0
+        self.last_focus = None
+        self.refocus_count = 0
+
+    def lock(self, lens_position):
+        self.picam2.set_controls({"AfMode": controls.AfModeEnum.Manual, "LensPosition": lens_position})
+        self.lens_position = lens_position
+
+    def autofocus(self):
+        """
+        Run one autofocus cycle, lock the lens where it ended up and cache the position.
+
+        :return: lens position, or None if the cycle failed (the lens then stays where it was)
+        """
+        self.picam2.set_controls({"AfMode": controls.AfModeEnum.Auto})
+        success = self.picam2.autofocus_cycle()
+        lens_position = self.picam2.capture_metadata().get('LensPosition')
+        self.last_focus = self.clock()
+        self.reference = None
+        self.low_frames = 0
+        if not success or lens_position is None:
+            print(f'Autofocus failed on {self.rig_name}')
+            if self.lens_position is not None:
+                self.lock(self.lens_position)
+            return None
+
+        self.lock(lens_position)
+        cache = read_cache(self.cache_path)
+        cache[self.rig_name] = {'lens_position': lens_position, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+        write_cache(self.cache_path, cache)
+        print(f'Focused {self.rig_name} at lens position {lens_position:.2f}')
+        return lens_position
+
+    def start(self):
+        cached = read_cache(self.cache_path).get(self.rig_name, {}).get('lens_position')
+        if self.use_cached and cached is not None:
+            self.lock(cached)
+            self.last_focus = self.clock()
+            print(f'Locked {self.rig_name} at cached lens position {cached:.2f}')
+            return
+        if self.autofocus() is None and cached is not None:
+            # the cycle failed; the last good position for this rig is better than wherever the lens is
+            self.lock(cached)
+            print(f'Locked {self.rig_name} at cached lens position {cached:.2f}')
+
+    def check(self, request):
+        """
+        Score a captured request (it needs the lores stream) and decide whether the schedule or the sharpness asks for a refocus.
+        Call it before handing the request to the writer, which releases it; refocus after handing it over, as the
+        autofocus cycle needs free camera buffers.
+
+        :return: reason to refocus, or None
+        """
+        reason = None
+        if self.refocus_every > 0 and self.clock() - self.last_focus >= self.refocus_every:
+            reason = 'scheduled'
+        elif self.sharpness_drop > 0:
+            score = sharpness(request.make_array('lores'))
+            if self.reference is None:
+                self.reference = score
+            elif score < self.sharpness_drop * self.reference:
+                self.low_frames += 1
+                if self.low_frames >= self.patience:
+                    reason = f'sharpness {score:.4g} < {self.sharpness_drop} x {self.reference:.4g}'
+            else:
+                self.low_frames = 0
+
+        return reason
+
+    def refocus(self, reason, elapsed=None):
+        print(f'Refocusing {self.rig_name} ({reason}){f" at {elapsed:.2f}s" if elapsed is not None else ""}')
+        self.autofocus()
+        self.refocus_count += 1
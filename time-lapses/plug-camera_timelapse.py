@@ -1,12 +1,17 @@
 #!/usr/bin/python3
-import time
 from datetime import datetime
 from picamera2 import Picamera2
 import os
-import numpy as np
 import argparse
 import subprocess
 
+# copy capture_scheduler.py, capture_writer.py, video_timelapse.py, focus_manager.py and timing_log.py next to this script on the RPi
+from capture_scheduler import CaptureScheduler, missed_policies
+from capture_writer import CaptureWriter, full_policies, still_configuration
+from video_timelapse import capture_modes, video_configuration, record_segments
+from focus_manager import FocusManager, lores_stream
+from timing_log import TimingLog, frame_info
+
 # Example usage
 # python plug-camera_timelapse.py -r [rig_name]
 # 
@@ -17,15 +22,33 @@ duration = 518400 # total time of timelapse, in seconds
 interval = 600 # time between acquisitions, in seconds
 experiment_name ='exp' # will create a folder with this name
 focus_in_loop = False # do you autofocus before each capture, probably won't work for <3s intervals
+refocus_every = 0 # seconds between scheduled refocus cycles, 0 for none; otherwise the lens stays locked where the first cycle put it
+sharpness_drop = 0.7 # refocus when the sharpness of captured frames falls below this fraction of its value after focusing, 0 to disable
+cached_focus = False # lock the lens position cached for this rig instead of running the first autofocus cycle
+focus_cache = 'focus_cache.json' # lens position per rig, updated after every successful autofocus cycle
+missed_policy = 'skip' # what to do with capture slots that were missed entirely: 'skip' them or 'catchup' back to back
+queue_size = 2 # captures that can wait to be saved by the background writer; each holds a full-resolution camera buffer
+full_policy = 'block' # when the writer queue is full: 'block' the capture loop until there is room, or 'drop' the new image
+capture_mode = 'still' # 'still' captures, or for ~1-2 Hz timelapses a streaming video configuration: 'jpg' frames picked off the stream, or 'h264' segments
+segment_seconds = 3600 # length of each H.264 segment in 'h264' mode, in seconds
 current_time = ''
 
 # pulling user-input variables from command line
 parser = argparse.ArgumentParser(description='Timelapse script for plug cameras')
 parser.add_argument('-d', '--duration', dest='duration', action='store', type=int, required=True, default=duration, help='acquisition duration in seconds')
-parser.add_argument('-i', '--interval', dest='interval', action='store', type=int, required=True, default=interval, help='acquisition interval between frames in seconds')
+parser.add_argument('-i', '--interval', dest='interval', action='store', type=float, required=True, default=interval, help='acquisition interval between frames in seconds')
 parser.add_argument('-e', '--experiment_name', dest='experiment_name', action='store', type=str, required=True, default=duration, help='name of experiment, will create a folder')
 parser.add_argument('-r', '--rig_name', dest='rig_name', action='store', type=str, required=True, help='name of rig')
-parser.add_argument('-f', '--focus-in-loop', dest='focus_in_loop', action='store', type=bool, default=focus_in_loop, help='whether to run an autofocus cycle for each frame acquisition')
+parser.add_argument('-f', '--focus-in-loop', dest='focus_in_loop', action='store_true', help='run an autofocus cycle before every frame acquisition (instead of locking focus and refocusing only when needed)')
+parser.add_argument('-a', '--refocus-every', dest='refocus_every', action='store', type=float, default=refocus_every, help='seconds between scheduled refocus cycles, 0 for none')
+parser.add_argument('-b', '--sharpness-drop', dest='sharpness_drop', action='store', type=float, default=sharpness_drop, help='refocus when frame sharpness falls below this fraction of its value after focusing, 0 to disable')
+parser.add_argument('--cached-focus', dest='cached_focus', action='store_true', help='lock the cached lens position for this rig instead of running the first autofocus cycle')
+parser.add_argument('--focus-cache', dest='focus_cache', action='store', type=str, default=focus_cache, help='JSON file with the lens position of each rig')
+parser.add_argument('-m', '--missed', dest='missed_policy', action='store', type=str, default=missed_policy, choices=missed_policies, help='skip missed capture slots, or catch up on them back to back')
+parser.add_argument('-q', '--queue-size', dest='queue_size', action='store', type=int, default=queue_size, help='number of captures that can wait to be saved')
+parser.add_argument('-p', '--full-policy', dest='full_policy', action='store', type=str, default=full_policy, choices=full_policies, help='block the capture loop or drop the image when the save queue is full')
+parser.add_argument('-c', '--capture-mode', dest='capture_mode', action='store', type=str, default=capture_mode, choices=capture_modes, help='still captures, or jpg frames / h264 segments from a streaming video configuration for high-rate timelapses')
+parser.add_argument('-s', '--segment', dest='segment_seconds', action='store', type=int, default=segment_seconds, help='length of each H.264 segment in seconds, in h264 mode')
 parser.add_argument('-t', '--time', dest='current_time', action='store', type=str,  default=current_time, help='the current time, for using the batch script') 
 
 # ingesting user-input arguments
@@ -34,13 +57,29 @@ duration = args.duration
 interval = args.interval
 experiment_name = args.experiment_name
 focus_in_loop = args.focus_in_loop
+refocus_every = args.refocus_every
+sharpness_drop = args.sharpness_drop
+cached_focus = args.cached_focus
+focus_cache = args.focus_cache
 rig_name = args.rig_name
 current_time = args.current_time
+missed_policy = args.missed_policy
+queue_size = args.queue_size
+full_policy = args.full_policy
+capture_mode = args.capture_mode
+segment_seconds = args.segment_seconds
 
 picam2 = Picamera2()
-picam2.configure("still")
+if(capture_mode=='still'):
+    picam2.configure(still_configuration(picam2, queue_size, lores=lores_stream))
+else:
+    # the sensor keeps streaming, so no per-capture still switch; frames are picked off (jpg) or recorded from (h264) the stream
+    picam2.configure(video_configuration(picam2, capture_mode, interval, queue_size, lores=lores_stream))
 picam2.start()
-success = picam2.autofocus_cycle() # run an auto-focus cycle
+
+# run an auto-focus cycle (or reuse the cached lens position) and lock the lens there
+focus = FocusManager(picam2, rig_name, focus_cache, refocus_every=refocus_every, sharpness_drop=sharpness_drop, use_cached=cached_focus)
+focus.start()
 
 num_captures = int(duration / interval) + 1
 
@@ -56,38 +95,53 @@ if(current_time!=''):
 os.makedirs('data', exist_ok=True)
 os.makedirs(f'data/{now}_{rig_name}_{experiment_name}', exist_ok=True)
 
-# Record the initial time to calculate timelapse intervals
-start_time = time.time()
-
-capture_times = []
-for i in range(num_captures):
-
-    if(focus_in_loop==True):
-        success = picam2.autofocus_cycle() # auto-focus before each interval/capture
-
-    # acquire image
-    r = picam2.capture_request()
-    r.save("main", f"data/{now}_{rig_name}_{experiment_name}/{now}_{rig_name}_{experiment_name}_image{str(i).zfill(5)}.jpg")
-
-    # Calculate the elapsed time from the start of the time-lapse
-    elapsed_time = time.time() - start_time
-    capture_times.append(elapsed_time)
-    print(f"Captured image {i} of {num_captures} at {elapsed_time:.2f}s")
-
-    r.release()
-
-    # Calculate the expected time for the next capture
-    expected_next_capture_time = (i + 1) * interval
-
-    # Calculate the time to sleep for the next capture
-    sleep_duration = max(0, expected_next_capture_time - elapsed_time) # if value is negative, 0 will be selected as the max value and passed to time.sleep()
-    
-    time.sleep(sleep_duration)
-
-picam2.stop()
-
-# save capture_times in case needed in the future, in seconds
-np.savetxt(f'data/{now}_{rig_name}_{experiment_name}/{now}_{rig_name}_{experiment_name}_capture-times.csv', capture_times, delimiter=",")
+if(capture_mode=='h264'):
+    # the stream itself is the timelapse: one frame per interval, in H.264 segments with a timestamp sidecar each
+    segments = record_segments(picam2, interval, duration, f'data/{now}_{rig_name}_{experiment_name}/{now}_{rig_name}_{experiment_name}', segment_seconds)
+    picam2.stop()
+    print(f'Recorded {len(segments)} segments')
+
+else:
+    # captures are timed on the monotonic clock, so changes to the wall clock during the run do not affect them
+    # images keep their slot number, so skipped slots show up as gaps in the numbering
+    scheduler = CaptureScheduler(interval, num_captures, missed_policy=missed_policy)
+
+    # one row per frame (sensor timestamp, exposure, save latency) is appended as soon as the frame is saved and
+    # fsynced in batches, so a crash or the reboot below does not lose the timing data
+    timing_log = TimingLog(f'data/{now}_{rig_name}_{experiment_name}/{now}_{rig_name}_{experiment_name}_capture-times.csv')
+
+    # JPEG encoding and saving run on a background thread, so the loop only waits for the capture itself
+    # (its queue/save times are on the scheduler's clock, i.e. seconds since the start of the timelapse)
+    writer = CaptureWriter(queue_size=queue_size, full_policy=full_policy, clock=scheduler.elapsed, on_done=timing_log.write)
+
+    for slot in scheduler:
+        i = slot.index
+
+        if(focus_in_loop==True):
+            success = picam2.autofocus_cycle() # auto-focus before each interval/capture
+
+        # acquire image (in jpg mode, the next frame off the stream); the writer saves and releases it
+        r = picam2.capture_request()
+
+        # refocus (for the next capture) only if it is scheduled or this frame's sharpness dropped
+        refocus_reason = focus.check(r) if focus_in_loop==False else None
+
+        # Calculate the elapsed time from the start of the time-lapse
+        elapsed_time = scheduler.elapsed()
+        info = frame_info(slot, elapsed_time, r.get_metadata())
+        writer.submit(r, f"data/{now}_{rig_name}_{experiment_name}/{now}_{rig_name}_{experiment_name}_image{str(i).zfill(5)}.jpg", i, info)
+        print(f"Captured image {i} of {num_captures} at {elapsed_time:.2f}s ({slot.lateness:.3f}s late)")
+
+        if(refocus_reason is not None):
+            focus.refocus(refocus_reason, scheduler.elapsed())
+
+    # the last images are saved (and logged) before the camera is stopped
+    writer.close()
+    timing_log.close()
+    picam2.stop()
+    print(f'Capture timing: {scheduler.summary()}')
+    print(f'Saving: {writer.summary()}')
+    print(f'Refocus cycles: {focus.refocus_count}, final lens position: {focus.lens_position}')
 
 def run_command(ssh_command, rig_name):
     try:
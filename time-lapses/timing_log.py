@@ -0,0 +1,122 @@
+## Append-only per-frame timing log for timelapses
+# one CSV row per frame, appended as soon as the frame is saved (or dropped), and fsynced every few rows/seconds,
+# so a crash or the scheduled reboot loses at most the last batch instead of the whole run's timing data
+# besides the host-side slot timing, each row has the sensor's own timestamp (SensorTimestamp, ns, from the capture
+# request's metadata), the exposure and the save latency, which is what drift analysis needs
+# copy this file next to plug-camera_timelapse.py on the RPi
+
+# Example usage
+# log = TimingLog(f'{folder}/{name}_capture-times.csv')
+# writer = CaptureWriter(queue_size=2, on_done=log.write)
+# ...
+# writer.close()
+# log.close()
+#
+# afterwards, anywhere:
+# times = read_timing_log('exp_capture-times.csv')
+# offsets = sensor_drift(times, interval=600)
+
+import os
+import threading
+import time
+
+import numpy as np
+
+# status is 'saved', 'dropped' (writer queue full) or 'failed' (save raised)
+# deadline_s / started_s / captured_s: slot deadline, slot start and capture return, in seconds since the start on the monotonic clock
+# sensor_timestamp_ns: start of exposure of the frame's first line, on the sensor's (boot-time) clock
+# queued_s / saved_s: when the frame was handed to the writer and when its file was written, same clock as started_s
+columns = ['index', 'status', 'deadline_s', 'started_s', 'captured_s', 'sensor_timestamp_ns', 'exposure_us',
+           'analogue_gain', 'lens_position', 'queued_s', 'saved_s', 'save_s']
+
+def frame_info(slot, captured, metadata):
+    """
+    :param slot: capture_scheduler Slot
+    :param captured: seconds since the start when capture_request returned
+    :param metadata: the request's metadata (request.get_metadata())
+    :return: dict of the per-frame columns known at capture time
+    """
+    return {
+        'index': slot.index,
+        'deadline_s': slot.deadline,
+        'started_s': slot.started,
+        'captured_s': captured,
+        'sensor_timestamp_ns': metadata.get('SensorTimestamp', ''),
+        'exposure_us': metadata.get('ExposureTime', ''),
+        'analogue_gain': metadata.get('AnalogueGain', ''),
+        'lens_position': metadata.get('LensPosition', ''),
+    }
+
+class TimingLog:
+    def __init__(self, path, fsync_rows=10, fsync_seconds=60, clock=time.monotonic):
+        """
+        :param fsync_rows: fsync after this many rows
+        :param fsync_seconds: or after this many seconds since the last fsync, whichever comes first
+        """
+        self.path = path
+        self.fsync_rows = fsync_rows
+        self.fsync_seconds = fsync_seconds
+        self.clock = clock
+        self.lock = threading.Lock()  # rows come from the writer thread and (dropped frames) the capture loop
+
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', buffering=1)
+        if new_file:
+            self.file.write(','.join(columns) + '\n')
+        self.unsynced = 0
+        self.last_sync = self.clock()
+
+    def write(self, info, status, queued='', saved='', save_seconds=''):
+        """
+        :param info: dict from frame_info
+        :param status: 'saved', 'dropped' or 'failed'
+        """
+        row = dict(info, status=status, queued_s=queued, saved_s=saved, save_s=save_seconds)
+        line = ','.join(f'{row[c]:.6f}' if isinstance(row.get(c), float) else str(row.get(c, '')) for c in columns)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_rows or self.clock() - self.last_sync >= self.fsync_seconds:
+                self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = self.clock()
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            self.file.close()
+
+def read_timing_log(path):
+    """
+    :return: NumPy structured array with one record per frame (field names as in columns), sorted by index;
+             missing values are NaN, and a last row cut short by a crash is ignored
+    """
+    dtype = [('index', np.int64), ('status', 'U8')] + [(c, np.float64) for c in columns[2:]]
+    rows = []
+    with open(path) as f:
+        header = f.readline().strip().split(',')
+        for line in f:
+            values = line.rstrip('\n').split(',')
+            if not line.endswith('\n') or len(values) != len(header):
+                continue
+            row = dict(zip(header, values))
+            numbers = [float(row.get(c) or 'nan') for c in columns[2:]]
+            rows.append((int(row['index']), row['status'], *numbers))
+    times = np.array(rows, dtype=dtype)
+    return np.sort(times, order='index')
+
+def sensor_drift(times, interval):
+    """
+    :param times: array from read_timing_log
+    :return: (index, offset) for frames with a sensor timestamp; offset is the sensor time since the first such frame
+             minus the ideal time (index difference * interval), in seconds
+    """
+    times = times[~np.isnan(times['sensor_timestamp_ns'])]
+    if len(times) == 0:
+        return times['index'], np.zeros(0)
+    sensor_s = (times['sensor_timestamp_ns'] - times['sensor_timestamp_ns'][0]) / 1e9
+    return times['index'], sensor_s - (times['index'] - times['index'][0]) * interval
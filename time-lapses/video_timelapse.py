@@ -0,0 +1,83 @@
+## High-rate (sub-second to a few seconds) timelapses from a continuously streaming camera
+# in still mode every capture waits for a full-resolution still frame; at 1-2 Hz that cannot keep up
+# here the sensor keeps streaming in a video configuration and the timelapse either
+#   jpg:  picks the next frame off the stream in each capture slot (saved by the background CaptureWriter), or
+#   h264: records the stream at the timelapse rate itself into H.264 segments, each with a timestamp sidecar
+#         (picamera2 pts file, timecode format v2: one time in ms per frame)
+# copy this file next to plug-camera_timelapse.py on the RPi
+
+# Example usage
+# picam2.configure(video_configuration(picam2, 'jpg', interval=0.5, queue_size=2))
+# picam2.start()
+# ... the same capture loop as in still mode ...
+#
+# picam2.configure(video_configuration(picam2, 'h264', interval=0.5))
+# picam2.start()
+# segments = record_segments(picam2, interval=0.5, duration=86400, path_prefix='data/exp/exp', segment_seconds=3600)
+
+import time
+
+# still: a still configuration, one full-resolution capture per slot (the original behaviour)
+capture_modes = ['still', 'jpg', 'h264']
+
+# jpg frames use the sensor's 2x2 binned mode (fast readout, still half the full resolution);
+# the hardware H.264 encoder is limited to 1080p
+video_sizes = {'jpg': (2304, 1296), 'h264': (1920, 1080)}
+
+# in jpg mode the stream runs faster than the timelapse, so a capture slot waits at most 1/stream_framerate for the next frame
+stream_framerate = 10
+
+def video_configuration(picam2, capture_mode, interval, queue_size=2, size=None, lores=None):
+    """
+    :param capture_mode: 'jpg' or 'h264'
+    :param interval: seconds between timelapse frames
+    :param queue_size: writer queue size in jpg mode, to reserve enough buffers
+    :param lores: optional lores stream, e.g. for focus_manager's sharpness score
+    :return: video configuration streaming at the rate the mode needs
+    """
+    size = size or video_sizes[capture_mode]
+    if capture_mode == 'jpg':
+        framerate = max(stream_framerate, 1 / interval)
+        buffer_count = queue_size + 2
+    else:
+        # every recorded frame is a timelapse frame
+        framerate = 1 / interval
+        buffer_count = 6
+    frame_duration = int(1e6 / framerate)
+    return picam2.create_video_configuration(main={'size': size}, lores=lores, buffer_count=buffer_count,
+                                             controls={'FrameDurationLimits': (frame_duration, frame_duration)})
+
+def segment_paths(path_prefix, segment):
+    return f'{path_prefix}_segment{str(segment).zfill(4)}.h264', f'{path_prefix}_segment{str(segment).zfill(4)}_timestamps.txt'
+
+def record_segments(picam2, interval, duration, path_prefix, segment_seconds=3600, bitrate=None, clock=time.monotonic, sleep=time.sleep):
+    """
+    Record the (already started) stream into H.264 segments of segment_seconds each, until duration has passed.
+
+    The camera keeps streaming between segments; only the encoder is restarted, so a segment boundary costs at most a frame.
+
+    :param bitrate: H.264 bitrate in bits/s; None for the encoder's default
+    :return: list of (h264 path, timestamps path)
+    """
+    from picamera2.encoders import H264Encoder
+    from picamera2.outputs import FileOutput
+
+    # a keyframe every frame would waste space; one every ~10 s keeps seeking and cutting cheap
+    encoder = H264Encoder(bitrate=bitrate, iperiod=max(1, int(10 / interval)))
+    start = clock()
+    segments = []
+    segment = 0
+    while clock() - start < duration:
+        h264_path, timestamps_path = segment_paths(path_prefix, segment)
+        picam2.start_encoder(encoder, FileOutput(h264_path, pts=timestamps_path))
+        print(f'Recording segment {segment} to {h264_path}')
+
+        # sleep on the monotonic clock until the end of the segment (or of the timelapse)
+        end = min((segment + 1) * segment_seconds, duration)
+        while clock() - start < end:
+            sleep(max(0, min(end - (clock() - start), 60)))
+
+        picam2.stop_encoder()
+        segments.append((h264_path, timestamps_path))
+        segment += 1
+    return segments
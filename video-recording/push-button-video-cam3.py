@@ -7,6 +7,13 @@ from libcamera import controls
 from datetime import datetime
 import socket
 
+# keeps data/.manifest.tsv up to date, so transfers can be verified without re-scanning the RPi
+# copy rigtools/manifest.py next to this script on the RPi; recording works without it
+try:
+    from manifest import append_entry
+except ImportError:
+    append_entry = None
+
 experiment_duration = 10
 framerate = 30
 resolution = (1200, 1200)
@@ -79,6 +86,10 @@ try:
             picam2.stop_preview()
 
             GPIO.output(red_led,GPIO.LOW) # Red LED OFF to indicate the recording stopped
+
+            # record the finished video in the manifest
+            if append_entry is not None:
+                append_entry('data', f"{date}_pupae_video-{video_counter}.mp4")
             
             video_counter += 1
 
@@ -6,6 +6,13 @@ from picamera import PiCamera
 from datetime import datetime
 import socket
 
+# keeps data/.manifest.tsv up to date, so transfers can be verified without re-scanning the RPi
+# copy rigtools/manifest.py next to this script on the RPi; recording works without it
+try:
+    from manifest import append_entry
+except ImportError:
+    append_entry = None
+
 experiment_duration = 300
 Framerate = 1
 rig_name = socket.getfqdn()
@@ -88,6 +95,10 @@ while True:
         camera.stop_recording()
         camera.stop_preview()
         GPIO.output(red_led,GPIO.LOW) # Red LED OFF to indicate the recording stopped
+
+        # record the finished video in the manifest
+        if append_entry is not None:
+            append_entry('data', f"{date}_{rig_name}_video-{video_counter}.h264")
         
         video_counter += 1
 